@@ -1,25 +1,271 @@
+import hmac
+import io
+import json
+import os
+import queue
+import secrets
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+import time
+import click
+import copy
 from datetime import datetime
-from models.db import init_db, database# Imports from my database file
-
-app = Flask(__name__)
-app.secret_key = 'mysecretkey#123&***'
+from flask import Flask, Blueprint, Response, render_template, request, redirect, url_for, flash, session, jsonify, g, abort
+from flask import current_app, before_render_template, template_rendered
+from werkzeug.local import LocalProxy
+from models.db import init_db, connect, run_in_write_transaction, database# Imports from my database file
+from models.allocator import add_spots, resize_lot, check_counters, rebuild_counters
+from models.bookings import book_spot, vacate_spot
+from models.rollups import rebuild_rollups
+from models.timestamps import day_range, to_display, parse_local, now
+from models.cache import TTLCache
+from models.export import reservation_query, stream_rows, as_csv, as_ndjson
+from models.importer import import_lots, import_reservations
+from models.events import EventBus
+from models.archive import attach_archive, history_table, archive_reservations, has_archived_reservations
+from models.snapshot import Snapshot
+from models.billing import revenue_report
+from models.kiosk import process_events
+from models.metrics import RequestMetrics, TimedConnection
+from models.auth import PasswordHasher, HasherBusy, LoginLimiter
+from models.fragments import FragmentCache
+from models.schedule import ScheduleIndex, schedule_spot, cancel_scheduled, check_in, free_count
+from markupsafe import Markup
+
+# Every route is on this blueprint, registered on the apps built by create_app
+bp = Blueprint('parking', __name__, cli_group=None)
+
+# Default settings of an app, create_app overrides them from the environment
+# and its `config` argument. There is no default secret key, see create_app.
+defaults = {'SECRET_KEY': None}
+defaults['DATABASE'] = database
+defaults['CACHE_SIZE'] = 1024 # entries
+defaults['CACHE_TTL'] = 30    # seconds
+defaults['PAGE_SIZE'] = 50    # rows per page of history / users
+defaults['METRICS_ENABLED'] = True      # per-route latency, SQL and template timings
+defaults['SLOW_QUERY_SECONDS'] = 0.1    # statements slower than this are logged
+defaults['METRICS_TOKEN'] = None        # bearer token for scrapers, besides admin sessions
+
+# Bigger than any id or epoch timestamp, used as the open end of a keyset range
+MAX_INT = 2 ** 63 - 1
 
 def get_db_connection():
-    #establishing connection to the database.
-    conn = sqlite3.connect(database)
-    conn.row_factory = sqlite3.Row # It allows me to access tables columns by name
+    # Reusing one tuned connection for the whole request (app context),
+    # it is closed in close_db_connection when the request is torn down.
+    if 'db' not in g:
+        if current_app.config['METRICS_ENABLED']:
+            g.db = connect(current_app.config['DATABASE'], factory=TimedConnection)
+            g.db.slow_query_seconds = current_app.config['SLOW_QUERY_SECONDS']
+        else:
+            g.db = connect(current_app.config['DATABASE'])
+    return g.db
+
+def get_history_connection():
+    # The request's connection with the archive attached (models/archive.py),
+    # for the routes reading completed reservations through all_reservations.
+    conn = get_db_connection()
+    if not g.get('archive_attached'):
+        attach_archive(conn)
+        g.archive_attached = True
     return conn
 
+# Analytics routes read a periodically refreshed copy of the database (models/snapshot.py)
+defaults['SNAPSHOT_ENABLED'] = True
+defaults['SNAPSHOT_DATABASE'] = None    # next to DATABASE by default
+defaults['SNAPSHOT_INTERVAL'] = 30      # seconds between copies
+defaults['SNAPSHOT_MAX_STALENESS'] = 120 # older copies are ignored, the primary is read instead
+
+def get_analytics_connection():
+    # The snapshot while it is fresh enough, the primary database otherwise.
+    # g.data_as_of is when the data read through it was current, it is
+    # reported to clients in the X-Data-Age header.
+    if 'data_as_of' not in g:
+        g.data_as_of = time.time()
+        if current_app.config['SNAPSHOT_ENABLED']:
+            analytics_snapshot.start(current_app.config['DATABASE'], current_app.config['SNAPSHOT_DATABASE'])
+            taken_at = analytics_snapshot.taken_at
+            if taken_at is not None and g.data_as_of - taken_at <= current_app.config['SNAPSHOT_MAX_STALENESS']:
+                g.snapshot_db, g.data_as_of = analytics_snapshot.connect(), taken_at
+    return g.get('snapshot_db') or get_db_connection()
+
+def cached_analytics(key, fetch):
+    # fetch(conn) read through get_analytics_connection and cached together
+    # with its g.data_as_of, so the age reported for a cached answer is right.
+    def compute():
+        conn = get_analytics_connection()
+        return fetch(conn), g.data_as_of
+    data, g.data_as_of = dashboard_cache.get_or_set(key, compute)
+    return data
+
+# Tariff applied when a spot is vacated and in revenue reports (models/billing.py)
+defaults['TARIFF'] = {
+    'minimum_charge': 0.0,     # no bill is lower than this
+    'per_started_hour': False, # round durations up to whole hours
+    'daily_cap': None,         # most that 24 hours of parking can cost
+    'peak_hours': (),          # local start hours billed at peak_multiplier times the rate
+    'peak_multiplier': 1.0,
+}
+
+# Completed reservations older than this are moved to the archive by `flask archive-reservations`
+defaults['ARCHIVE_AFTER_DAYS'] = 180
+
+# Timestamps are stored as epoch seconds, templates show them as local time
+bp.add_app_template_filter(to_display, 'timestamp')
+
+def close_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        # Anything left uncommitted (e.g. after an error) is rolled back by close.
+        conn.close()
+    snapshot = g.pop('snapshot_db', None)
+    if snapshot is not None:
+        snapshot.close()
+
+# Password hashing runs in a process pool, see models/auth.py
+defaults['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1' # changing it rehashes passwords at login
+defaults['PASSWORD_HASH_WORKERS'] = 2      # hashing processes
+defaults['PASSWORD_HASH_MAX_PENDING'] = 64 # hashes queued or running before logins are turned away
+defaults['LOGIN_ATTEMPTS'] = 5             # per username ...
+defaults['LOGIN_WINDOW'] = 60              # ... in this many seconds
+
+# Request instrumentation, see models/metrics.py. The after_request hook is
+# registered before add_header, so it runs last and times the whole response.
+# The render timers are connected to each app's template signals by create_app.
+
+@bp.before_app_request
+def start_request_timer():
+    if current_app.config['METRICS_ENABLED']:
+        g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Unmatched URLs share one label, so clients can't grow the series
+        request_metrics.observe_request(request.endpoint or 'unmatched', response.status_code,
+                                        time.perf_counter() - started, g.get('db'))
+    return response
+
+def start_render_timer(sender, template, context, **extra):
+    if current_app.config['METRICS_ENABLED']:
+        g.setdefault('render_started', []).append(time.perf_counter())
+
+def record_render_time(sender, template, context, **extra):
+    started = g.get('render_started')
+    if started:
+        request_metrics.observe_render(template.name, time.perf_counter() - started.pop())
+
+# Dashboard and chart data is cached between the writes that change it,
+# every route that books, vacates or edits lots clears the cache.
+# Live occupancy updates are pushed to admin pages over Server-Sent Events.
+defaults['EVENT_QUEUE_SIZE'] = 100 # events buffered per client
+# Connected clients per process, each holds a server thread (None for no
+# limit). gunicorn.conf.py keeps it below the threads of a worker.
+defaults['EVENT_STREAMS_PER_PROCESS'] = None
+defaults['EVENT_STREAM_RETRY'] = 30 # seconds before a turned away client tries again
+
+def lots_changed(*lot_ids):
+    # Called after a committed write: dropping cached dashboard data and
+    # pushing the new occupancy of the changed lots to connected dashboards.
+    dashboard_cache.clear()
+    conn = get_db_connection()
+    for lot_id in lot_ids:
+        lot = conn.execute(
+            'SELECT prime_location_name, maximum_number_of_spots, occupied_spots, available_spots FROM parking_lots WHERE id = ?',
+            (lot_id,)
+        ).fetchone()
+        if lot is None:
+            occupancy_events.publish({'lot_id': lot_id, 'deleted': True})
+        else:
+            occupancy_events.publish({'lot_id': lot_id, 'name': lot['prime_location_name'],
+                                      'occupied': lot['occupied_spots'], 'available': lot['available_spots'],
+                                      'total': lot['maximum_number_of_spots']})
+
+def lots_version(conn):
+    # Bumped in the database by every write to any lot (migration 8), so a
+    # lot list cached with it is never reused after another process changed it
+    return conn.execute('SELECT version FROM lots_version WHERE id = 1').fetchone()[0]
+
+# Rendered table rows of each lot, reused until the lot's version changes
+defaults['FRAGMENT_CACHE_SIZE'] = 20000 # rows
+
+class ProcessState:
+    """
+    The objects built from an app's config that hold threads, processes or
+    cached data, kept in app.extensions['parking']. Built by create_app and
+    again in every forked server worker (gunicorn.conf.py): a worker must not
+    use its parent's snapshot thread or hashing processes, and starts with
+    empty caches of its own.
+    """
+    def __init__(self, config):
+        self.analytics_snapshot = Snapshot(interval=config['SNAPSHOT_INTERVAL'])
+        self.password_hasher = PasswordHasher(method=config['PASSWORD_HASH_METHOD'],
+                                              workers=config['PASSWORD_HASH_WORKERS'],
+                                              max_pending=config['PASSWORD_HASH_MAX_PENDING'])
+        self.login_limiter = LoginLimiter(attempts=config['LOGIN_ATTEMPTS'], window=config['LOGIN_WINDOW'])
+        self.request_metrics = RequestMetrics()
+        self.dashboard_cache = TTLCache(maxsize=config['CACHE_SIZE'], ttl=config['CACHE_TTL'])
+        self.occupancy_events = EventBus(queue_size=config['EVENT_QUEUE_SIZE'],
+                                         max_subscribers=config['EVENT_STREAMS_PER_PROCESS'])
+        self.fragment_cache = FragmentCache(maxsize=config['FRAGMENT_CACHE_SIZE'])
+        self.schedule_index = ScheduleIndex()
+
+    def close(self):
+        # Stopping the snapshot thread and the hashing processes
+        self.analytics_snapshot.stop()
+        self.password_hasher.shutdown()
+
+def init_process_state(app):
+    app.extensions['parking'] = ProcessState(app.config)
+
+def process_state(name):
+    # The named object of the current app's ProcessState, looked up on each use
+    return LocalProxy(lambda: getattr(current_app.extensions['parking'], name))
+
+analytics_snapshot = process_state('analytics_snapshot')
+password_hasher = process_state('password_hasher')
+login_limiter = process_state('login_limiter')
+request_metrics = process_state('request_metrics')
+dashboard_cache = process_state('dashboard_cache')
+occupancy_events = process_state('occupancy_events')
+fragment_cache = process_state('fragment_cache')
+schedule_index = process_state('schedule_index')
+
+def lot_rows(template_name, lots, context_of=None):
+    # The rows of `template_name` for the lots, rendering only the lots changed
+    # since their row was cached. context_of(stale_lots) gives the extra
+    # template variables of each stale lot, as {lot id: {name: value}}.
+    def render_stale(stale):
+        template = current_app.jinja_env.get_template(template_name)
+        context = context_of(stale) if context_of else {}
+        return {lot['id']: Markup(template.render(lot=lot, **context.get(lot['id'], {}))) for lot in stale}
+    return fragment_cache.render(template_name, lots, render_stale)
+
+def fetch_lots(conn):
+    # Every lot with its occupancy, which comes from the per-lot counters kept by models/allocator.py
+    lots = conn.execute('''
+    SELECT
+        pl.id,
+        pl.prime_location_name,
+        pl.price_per_hour,
+        pl.address,
+        pl.pincode,
+        pl.maximum_number_of_spots,
+        pl.occupied_spots,
+        pl.version
+    FROM
+        parking_lots pl
+    ORDER BY
+        pl.prime_location_name
+    ''').fetchall()
+    return [dict(lot) for lot in lots]
+
 #home page calling or rendering
-@app.route('/')
+@bp.route('/')
 def home():
     return render_template('index.html')
 
 # signup form setting
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     """User signup route."""
     if request.method == 'POST':
@@ -29,11 +275,11 @@ def signup():
 
         if not username or not password or not confirm_password:
             flash('All fields are required!', 'danger')
-            return redirect(url_for('signup'))
+            return redirect(url_for('.signup'))
 
         if password != confirm_password:
             flash('Passwords do not match!', 'danger')
-            return redirect(url_for('signup'))
+            return redirect(url_for('.signup'))
 
         conn = get_db_connection()
         try:
@@ -41,63 +287,84 @@ def signup():
             existing_user = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
             if existing_user:
                 flash('Username already exists. Please choose a different one.', 'warning')
-                return redirect(url_for('signup'))
+                return redirect(url_for('.signup'))
 
             # Hashing password
-            hashed_password = generate_password_hash(password)
+            try:
+                hashed_password = password_hasher.hash(password)
+            except HasherBusy:
+                flash('The server is busy, please try again in a moment.', 'warning')
+                return render_template('signup.html'), 503
 
             #Inserting new user into the database if doesn't exists already.
             conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
                          (username, hashed_password, 'user'))
             conn.commit()
             flash('Registration successful! Please login.', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
         except sqlite3.Error as e:
             flash(f'Database error during signup: {e}', 'danger')
             conn.rollback()
-        finally:
-            conn.close()
 
     return render_template('signup.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     #User and Admin login route.
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
+        if not login_limiter.allow(username):
+            flash(f'Too many login attempts, please try again in {login_limiter.retry_after(username)} seconds.', 'danger')
+            return render_template('login.html'), 429
+
         conn = get_db_connection()
         user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
 
-        if user and check_password_hash(user['password'], password):
+        try:
+            valid = user is not None and password_hasher.verify(user['password'], password)
+        except HasherBusy:
+            flash('The server is busy, please try again in a moment.', 'warning')
+            return render_template('login.html'), 503
+
+        if valid:
+            if password_hasher.needs_rehash(user['password']):
+                # Upgrading the stored hash to the current method and cost,
+                # unless the password was changed meanwhile.
+                try:
+                    conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                                 (password_hasher.hash(password), user['id'], user['password']))
+                    conn.commit()
+                except HasherBusy:
+                    pass # done at a later login
             # Storing user info into the session
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
             if user['role'] == 'admin':
                 flash(f'Welcome, Admin {username}!', 'success')
-                return redirect(url_for('admindashboard')) 
+                return redirect(url_for('.admindashboard')) 
             else:
                 flash(f'Welcome, {username}!', 'success')
-                return redirect(url_for('userdashboard')) 
+                return redirect(url_for('.userdashboard')) 
         else:
             flash('Invalid username or password.', 'danger')
 
     return render_template('login.html') 
 
 
-@app.route('/userdashboard')
+@bp.route('/userdashboard')
 def userdashboard():
     # In a real app, check if user is logged in
     if 'role' not in session or session['role'] != 'user':
         flash('You must be logged in to view this page.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     user_id = session['user_id']
     conn = get_db_connection()
     
-    # Check for an active booking for the current user
+    # Check for an active booking for the current user. Not cached, it is one
+    # indexed lookup and another process may have just booked or vacated.
     active_booking = conn.execute('''
         SELECT rs.id, rs.parking_timestamp, ps.spot_number, pl.prime_location_name
         FROM reserved_spots rs
@@ -106,304 +373,594 @@ def userdashboard():
         WHERE rs.user_id = ? AND rs.leaving_timestamp IS NULL
     ''', (user_id,)).fetchone()
 
-    lots = []
-    # If there is no active booking, then fetch the list of available lots
+    lots, next_cursor = [], None
+    try:
+        filters = lot_filters(request.args)
+    except ValueError:
+        flash('Prices must be numbers.', 'danger')
+        filters = lot_filters({})
+    # If there is no active booking, then fetch one page of the lots matching the filters
     if not active_booking:
-        lots = lots = conn.execute('''
-    SELECT
-        pl.id,
-        pl.prime_location_name,
-        pl.price_per_hour,
-        pl.address,
-        pl.pincode,
-        pl.maximum_number_of_spots,
-        COUNT(ps.id) as occupied_spots
-    FROM
-        parking_lots pl
-    LEFT JOIN
-        parking_spots ps ON pl.id = ps.lot_id AND ps.status = 'occupied'
-    GROUP BY
-        pl.id
-    ORDER BY
-        pl.prime_location_name
-    ''').fetchall()
-    
-    conn.close()
-    
+        after = request.args.get('after')
+        lots, next_cursor = dashboard_cache.get_or_set(
+            ('lots', tuple(filters.values()), after), lambda: search_lots(conn, after=after, **filters),
+            version=lots_version(conn)
+        )
+
+    # Reservations for later, read every time as they are few and change on their own schedule
+    scheduled = conn.execute('''
+        SELECT sr.id, sr.start_time, sr.end_time, ps.spot_number, pl.prime_location_name
+        FROM scheduled_reservations sr
+        JOIN parking_spots ps ON sr.spot_id = ps.id
+        JOIN parking_lots pl ON sr.lot_id = pl.id
+        WHERE sr.user_id = ? AND sr.status = 'scheduled' AND sr.end_time > ?
+        ORDER BY sr.start_time
+    ''', (user_id, now())).fetchall()
+
     # Pass both active_booking and lots to the template
     # One of them will be None/empty, and the template's 'if' statement will handle it.
-    return render_template('userdashboard.html', active_booking=active_booking, lots=lots)
+    return render_template('userdashboard.html', active_booking=active_booking,
+                           lot_rows=lot_rows('userlotrow.html', lots), next_cursor=next_cursor, filters=filters,
+                           scheduled=scheduled)
 
-@app.route('/api/mostusedlot')
+@bp.route('/api/lots/search')
+def lotsearch_api():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        filters = lot_filters(request.args)
+        limit = min(max(int(request.args.get('limit', current_app.config['PAGE_SIZE'])), 1), 200)
+    except ValueError:
+        return jsonify({'error': 'min_price, max_price and limit must be numbers'}), 400
+
+    lots, next_cursor = search_lots(get_db_connection(), after=request.args.get('after'), limit=limit, **filters)
+    return jsonify(items=lots, next=next_cursor)
+
+@bp.route('/api/mostusedlot')
 def mostusedlot():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
     user_id = session['user_id']
-    with get_db_connection() as conn:
-        # This query counts how many times the user has booked a spot in each lot
-        data = conn.execute('''
-            SELECT pl.prime_location_name, COUNT(rs.id) as booking_count
-            FROM reserved_spots rs
-            JOIN parking_spots ps ON rs.spot_id = ps.id
-            JOIN parking_lots pl ON ps.lot_id = pl.id
-            WHERE rs.user_id = ?
-            GROUP BY pl.prime_location_name
-        ''', (user_id,)).fetchall()
-        
-        # Format the data for the chart
-        labels = [row['prime_location_name'] for row in data]
-        values = [row['booking_count'] for row in data]
-        
-        return jsonify(labels=labels, values=values)
+    conn = get_analytics_connection()
+    # How many times the user has booked a spot in each lot (kept by models/rollups.py)
+    data = conn.execute('''
+        SELECT pl.prime_location_name, ulb.bookings as booking_count
+        FROM user_lot_bookings ulb
+        JOIN parking_lots pl ON ulb.lot_id = pl.id
+        WHERE ulb.user_id = ?
+    ''', (user_id,)).fetchall()
+
+    # Format the data for the chart
+    labels = [row['prime_location_name'] for row in data]
+    values = [row['booking_count'] for row in data]
+
+    return jsonify(labels=labels, values=values)
     
-@app.route('/api/usermonthlycost')
+@bp.route('/api/usermonthlycost')
 def usermonthlycost():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
     user_id = session['user_id']
-    with get_db_connection() as conn:
-        # This query sums up the total cost for each month
-        data = conn.execute('''
-            SELECT
-                strftime('%Y-%m', leaving_timestamp) as month,
-                SUM(total_cost) as total
-            FROM
-                reserved_spots
-            WHERE
-                user_id = ? AND leaving_timestamp IS NOT NULL
-            GROUP BY
-                month
-            ORDER BY
-                month
-        ''', (user_id,)).fetchall()
-        
-        # Format the data for the chart
-        labels = [row['month'] for row in data]
-        values = [row['total'] for row in data]
-        
-        return jsonify(labels=labels, values=values)
+    conn = get_analytics_connection()
+    # The user's total cost for each month (kept by models/rollups.py)
+    data = conn.execute('''
+        SELECT month, total_cost as total
+        FROM user_monthly_cost
+        WHERE user_id = ?
+        ORDER BY month
+    ''', (user_id,)).fetchall()
+
+    # Format the data for the chart
+    labels = [row['month'] for row in data]
+    values = [row['total'] for row in data]
+
+    return jsonify(labels=labels, values=values)
 
 
-@app.route('/bookspot/<int:lot_id>', methods=['POST'])
+@bp.route('/bookspot/<int:lot_id>', methods=['POST'])
 def bookspot(lot_id):
     #Ensuring the user is logged in
     if 'user_id' not in session:
         flash('You must be logged in to book a spot.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     user_id = session['user_id']
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+    status, booking = book_spot(get_db_connection(), user_id, lot_id)
 
-        # Check if the user already has an active booking
-        active_booking = conn.execute(
-            'SELECT id FROM reserved_spots WHERE user_id = ? AND leaving_timestamp IS NULL', (user_id,)
-        ).fetchone()
-
-        if active_booking:
-            flash('You already have an active parking spot.', 'warning')
-            return redirect(url_for('userdashboard'))
+    if status == 'booked':
+        lots_changed(lot_id)
+        flash('Your spot has been successfully booked!', 'success')
+    elif status == 'active_booking':
+        flash('You already have an active parking spot.', 'warning')
+    else:
+        flash('Sorry, no spots are available in this lot at the moment.', 'danger')
 
-        # Find the first available spot in the selected lot
-        available_spot = cursor.execute(
-            'SELECT id FROM parking_spots WHERE lot_id = ? AND status = ? LIMIT 1', (lot_id, 'available')
-        ).fetchone()
-
-        if available_spot:
-            spot_id = available_spot['id']
-            
-            # Get the price from the parking lot
-            lot_price = conn.execute('SELECT price_per_hour FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()['price_per_hour']
+    return redirect(url_for('.userdashboard'))
 
-            # 1. Update the spot status to 'occupied'
-            cursor.execute('UPDATE parking_spots SET status = ? WHERE id = ?', ('occupied', spot_id))
-
-            # 2. Create a new reservation record
-            cursor.execute(
-                'INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, parking_cost_per_unit) VALUES (?, ?, ?, ?)',
-                (spot_id, user_id, datetime.now().strftime('%Y-%m-%d %H:%M'), lot_price)
-            )
-            
-            conn.commit()
-            flash('Your spot has been successfully booked!', 'success')
-        else:
-            flash('Sorry, no spots are available in this lot at the moment.', 'danger')
-
-    return redirect(url_for('userdashboard'))
-
-@app.route('/vacatespot/<int:booking_id>', methods=['POST'])
+@bp.route('/vacatespot/<int:booking_id>', methods=['POST'])
 def vacatespot(booking_id):
     if 'user_id' not in session:
         flash('You must be logged in to perform this action.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     user_id = session['user_id']
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Find the active booking to ensure the user owns it
-        booking = cursor.execute(
-            'SELECT * FROM reserved_spots WHERE id = ? AND user_id = ? AND leaving_timestamp IS NULL',
-            (booking_id, user_id)
-        ).fetchone()
-
-        if booking:
-            spot_id = booking['spot_id']
-            
-            # --- Calculate Parking Cost ---
-            start_time_str = booking['parking_timestamp']
-            cost_per_hour = booking['parking_cost_per_unit']
-            
-            start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M')
-            end_time = datetime.now()
-            
-            duration_hours = (end_time - start_time).total_seconds() / 3600
-            total_cost = duration_hours * cost_per_hour
-            
-            # --- Update Database ---
-            # 1. Mark the booking as complete with timestamps and cost
-            cursor.execute(
-                'UPDATE reserved_spots SET leaving_timestamp = ?, total_cost = ? WHERE id = ?',
-                (end_time.strftime('%Y-%m-%d %H:%M'), total_cost, booking_id)
-            )
-            # 2. Mark the parking spot as available again
-            cursor.execute('UPDATE parking_spots SET status = ? WHERE id = ?', ('available', spot_id))
-            
-            conn.commit()
-            flash(f'Spot vacated successfully! Your total cost is ₹{total_cost:.2f}.', 'success')
-        else:
-            flash('Active booking not found or you do not have permission to vacate it.', 'danger')
+    status, booking = vacate_spot(get_db_connection(), user_id, booking_id, current_app.config['TARIFF'])
+
+    if status == 'vacated':
+        lots_changed(booking['lot_id'])
+        flash(f'Spot vacated successfully! Your total cost is ₹{booking["total_cost"]:.2f}.', 'success')
+    else:
+        flash('Active booking not found or you do not have permission to vacate it.', 'danger')
+
+    return redirect(url_for('.userdashboard'))
+
+# Reserving a spot for a later window, see models/schedule.py
+schedule_messages = {
+    'bad_window': 'Choose a window of 15 minutes to 7 days, starting in the next 90 days.',
+    'overlap': 'You already have a reservation at that time.',
+    'lot_full': 'Sorry, no spots are free in this lot for that time.',
+    'not_found': 'Lot not found.',
+}
+checkin_messages = {
+    'too_early': 'Your reservation has not started yet.',
+    'expired': 'Your reservation is over.',
+    'active_booking': 'You already have an active parking spot.',
+    'lot_full': 'Sorry, your spot is still taken and no other spot is free.',
+    'not_found': 'Reservation not found.',
+}
+
+@bp.route('/schedulespot/<int:lot_id>', methods=['POST'])
+def schedulespot(lot_id):
+    if 'user_id' not in session:
+        flash('You must be logged in to reserve a spot.', 'danger')
+        return redirect(url_for('.login'))
+    try:
+        start, end = parse_local(request.form['start']), parse_local(request.form['end'])
+    except (KeyError, ValueError):
+        flash('Enter a start and an end time.', 'danger')
+        return redirect(url_for('.userdashboard'))
+
+    status, reservation = schedule_spot(get_db_connection(), schedule_index, session['user_id'], lot_id, start, end)
+    if status == 'scheduled':
+        flash(f'Spot #{reservation["spot_number"]} is reserved for you from {to_display(start)} to {to_display(end)}.', 'success')
+    else:
+        flash(schedule_messages[status], 'danger')
+    return redirect(url_for('.userdashboard'))
+
+@bp.route('/cancelschedule/<int:reservation_id>', methods=['POST'])
+def cancelschedule(reservation_id):
+    if 'user_id' not in session:
+        flash('You must be logged in to perform this action.', 'danger')
+        return redirect(url_for('.login'))
 
-    return redirect(url_for('userdashboard'))
+    if cancel_scheduled(get_db_connection(), session['user_id'], reservation_id) == 'cancelled':
+        flash('Your reservation has been cancelled.', 'success')
+    else:
+        flash('Reservation not found.', 'danger')
+    return redirect(url_for('.userdashboard'))
 
-@app.route('/userhistory')
+@bp.route('/checkin/<int:reservation_id>', methods=['POST'])
+def checkin(reservation_id):
+    if 'user_id' not in session:
+        flash('You must be logged in to perform this action.', 'danger')
+        return redirect(url_for('.login'))
+
+    status, booking = check_in(get_db_connection(), schedule_index, session['user_id'], reservation_id)
+    if status == 'checked_in':
+        lots_changed(booking['lot_id'])
+        flash(f'Checked in, you are parked in Spot #{booking["spot_number"]}.', 'success')
+    else:
+        flash(checkin_messages[status], 'danger')
+    return redirect(url_for('.userdashboard'))
+
+@bp.route('/api/lots/<int:lot_id>/availability')
+def lotavailability_api(lot_id):
+    # Spots that can still be reserved over ?start=...&end=... (local 'YYYY-MM-DD HH:MM')
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        start, end = parse_local(request.args['start']), parse_local(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'start and end must be local date times'}), 400
+    if start >= end:
+        return jsonify({'error': 'start must be before end'}), 400
+
+    free = free_count(get_db_connection(), schedule_index, lot_id, start, end)
+    if free is None:
+        return jsonify({'error': 'unknown_lot'}), 404
+    return jsonify(lot_id=lot_id, start=start, end=end, free=free)
+
+# JSON API for the gate kiosks, versioned under /api/v1 (models/kiosk.py).
+# Gates authenticate with an X-Gate-Token header and name the user in each event.
+defaults['GATE_TOKENS'] = {}          # token -> gate name
+defaults['MAX_BATCH_EVENTS'] = 500    # events per /api/v1/gate/events request
+
+def authenticated_gate():
+    token = request.headers.get('X-Gate-Token', '')
+    for candidate, gate in current_app.config['GATE_TOKENS'].items():
+        if hmac.compare_digest(candidate, token):
+            return gate
+    return None
+
+def run_gate_events(gate, events):
+    # Applying the events and announcing the lots whose occupancy changed
+    results = process_events(get_db_connection(), gate, events, current_app.config['TARIFF'])
+    changed = {body['lot_id'] for status, body in results
+               if status in (200, 201) and 'lot_id' in body and not body.get('replayed')}
+    if changed:
+        lots_changed(*changed)
+    return results
+
+def lot_availability(lot):
+    return {'lot_id': lot['id'], 'prime_location_name': lot['prime_location_name'],
+            'price_per_hour': lot['price_per_hour'], 'available': lot['available_spots'],
+            'occupied': lot['occupied_spots'], 'total': lot['maximum_number_of_spots']}
+
+@bp.route('/api/v1/lots')
+@bp.route('/api/v1/lots/<int:lot_id>')
+def lots_v1(lot_id=None):
+    if authenticated_gate() is None:
+        return jsonify({'error': 'unauthorized'}), 401
+    conn = get_db_connection()
+    query = 'SELECT id, prime_location_name, price_per_hour, available_spots, occupied_spots, maximum_number_of_spots FROM parking_lots'
+    if lot_id is None:
+        return jsonify(lots=[lot_availability(lot) for lot in conn.execute(query + ' ORDER BY id')])
+    lot = conn.execute(query + ' WHERE id = ?', (lot_id,)).fetchone()
+    if lot is None:
+        return jsonify({'error': 'unknown_lot'}), 404
+    return jsonify(lot_availability(lot))
+
+@bp.route('/api/v1/bookings', methods=['POST'])
+@bp.route('/api/v1/bookings/vacate', methods=['POST'])
+def bookings_v1():
+    # {"username": ..., "lot_id": ...} to book, {"username": ..., "booking_id": optional} to vacate,
+    # with an optional Idempotency-Key header
+    gate = authenticated_gate()
+    if gate is None:
+        return jsonify({'error': 'unauthorized'}), 401
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'bad_event'}), 400
+
+    # Only the fields of the event are taken from the body, the key comes from the header
+    kind = 'vacate' if request.path.endswith('/vacate') else 'book'
+    fields = ('username', 'lot_id') if kind == 'book' else ('username', 'booking_id')
+    event = {'type': kind, **{field: payload[field] for field in fields if field in payload}}
+    if request.headers.get('Idempotency-Key'):
+        event['key'] = request.headers['Idempotency-Key']
+    [(status, body)] = run_gate_events(gate, [event])
+    return jsonify(body), status
+
+@bp.route('/api/v1/gate/events', methods=['POST'])
+def gate_events_v1():
+    # {"events": [{"type": "book" | "vacate", "username": ..., "key": ..., ...}, ...]}
+    # processed in one transaction, answered with one result per event
+    gate = authenticated_gate()
+    if gate is None:
+        return jsonify({'error': 'unauthorized'}), 401
+    payload = request.get_json(silent=True)
+    events = payload.get('events') if isinstance(payload, dict) else None
+    if not isinstance(events, list) or len(events) > current_app.config['MAX_BATCH_EVENTS']:
+        return jsonify({'error': f"expected up to {current_app.config['MAX_BATCH_EVENTS']} events"}), 400
+
+    results = run_gate_events(gate, events)
+    return jsonify(results=[{'status_code': status, **body} for status, body in results])
+
+def fetch_history_page(conn, user_id, before=None):
+    """
+    One page of a user's completed reservations, newest first, archived ones
+    included (`conn` comes from get_history_connection). Pages are cut by
+    the (parking_timestamp, id) of the last row shown (keyset pagination), so a
+    deep page costs the same as the first one. Returns (rows, next_cursor).
+    """
+    cursor = parse_cursor(before)
+    rows = conn.execute('''
+        SELECT rs.id, rs.parking_timestamp, rs.leaving_timestamp, rs.total_cost, pl.prime_location_name, ps.spot_number
+        FROM all_reservations rs
+        JOIN parking_spots ps ON rs.spot_id = ps.id
+        JOIN parking_lots pl ON ps.lot_id = pl.id
+        WHERE rs.user_id = ? AND rs.leaving_timestamp IS NOT NULL
+          AND (rs.parking_timestamp, rs.id) < (?, ?)
+        ORDER BY rs.parking_timestamp DESC, rs.id DESC
+        LIMIT ?
+    ''', (user_id, *(cursor or (MAX_INT, MAX_INT)), current_app.config['PAGE_SIZE'] + 1)).fetchall()
+    return page_of(rows, lambda row: f"{row['parking_timestamp']}:{row['id']}")
+
+def fetch_users_page(conn, after=None, prefix=''):
+    """
+    One page of registered users ordered by (username, id), starting after the
+    `after` cursor and optionally limited to usernames starting with `prefix`.
+    The prefix becomes a range on the username index rather than a LIKE scan.
+    Returns (rows, next_cursor).
+    """
+    start = max(parse_cursor(after, key_type=str) or (prefix, 0), (prefix, 0))
+    rows = conn.execute('''
+        SELECT id, username, role FROM users
+        WHERE role = 'user' AND (username, id) > (?, ?) AND username < ?
+        ORDER BY username, id
+        LIMIT ?
+    ''', (*start, prefix + '\U0010ffff', current_app.config['PAGE_SIZE'] + 1)).fetchall()
+    return page_of(rows, lambda row: f"{row['username']}:{row['id']}")
+
+def search_lots(conn, pincode='', name='', min_price=None, max_price=None, has_free=False, after=None, limit=None):
+    """
+    One page of lots matching the filters, ordered by name (without case) and
+    id, with their occupancy from the per-lot counters. Pincode and name match
+    by prefix, each filter can use an index of its own (migration 7), and
+    pages are cut by the (name, id) of the last row shown. Returns (rows, next_cursor).
+    """
+    conditions, params = [], []
+    if pincode:
+        conditions.append('pincode >= ? AND pincode < ?')
+        params += [pincode, pincode + '\U0010ffff']
+    if name:
+        conditions.append('prime_location_name COLLATE NOCASE >= ? AND prime_location_name COLLATE NOCASE < ?')
+        params += [name, name + '\U0010ffff']
+    if min_price is not None:
+        conditions.append('price_per_hour >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append('price_per_hour <= ?')
+        params.append(max_price)
+    if has_free:
+        conditions.append('available_spots > 0')
+    cursor = parse_cursor(after, key_type=str)
+    if cursor:
+        conditions.append('(prime_location_name COLLATE NOCASE, id) > (?, ?)')
+        params += cursor
+
+    limit = limit or current_app.config['PAGE_SIZE']
+    rows = conn.execute(f'''
+        SELECT id, prime_location_name, price_per_hour, address, pincode,
+               maximum_number_of_spots, occupied_spots, available_spots, version
+        FROM parking_lots
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY prime_location_name COLLATE NOCASE, id
+        LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+    return page_of(rows, lambda row: f"{row['prime_location_name']}:{row['id']}", limit)
+
+def lot_filters(args):
+    # The search filters of a request's query string, raises ValueError on a bad price
+    return {
+        'pincode': args.get('pincode', '').strip(),
+        'name': args.get('name', '').strip(),
+        'min_price': float(args['min_price']) if args.get('min_price') else None,
+        'max_price': float(args['max_price']) if args.get('max_price') else None,
+        'has_free': args.get('has_free') in ('1', 'true', 'on'),
+    }
+
+def parse_cursor(cursor, key_type=int):
+    # Cursors look like '<sort key>:<id>', anything else starts from the first page.
+    try:
+        key, row_id = cursor.rsplit(':', 1)
+        return key_type(key), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+def page_of(rows, cursor_of, page_size=None):
+    # One row more than the page size is fetched to know whether a next page exists.
+    page_size = page_size or current_app.config['PAGE_SIZE']
+    rows = [dict(row) for row in rows]
+    if len(rows) > page_size:
+        return rows[:page_size], cursor_of(rows[page_size - 1])
+    return rows, None
+
+@bp.route('/userhistory')
 def userhistory():
     if 'user_id' not in session:
         flash('You must be logged in to view your history.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
-    user_id = session['user_id']
-    with get_db_connection() as conn:
-        history = conn.execute('''
-            SELECT rs.parking_timestamp, rs.leaving_timestamp, rs.total_cost, pl.prime_location_name, ps.spot_number
-            FROM reserved_spots rs
-            JOIN parking_spots ps ON rs.spot_id = ps.id
-            JOIN parking_lots pl ON ps.lot_id = pl.id
-            WHERE rs.user_id = ? AND rs.leaving_timestamp IS NOT NULL
-            ORDER BY rs.parking_timestamp DESC
-        ''', (user_id,)).fetchall()
-    
-    return render_template('userhistory.html', history=history)
+    history, next_cursor = fetch_history_page(get_history_connection(), session['user_id'], request.args.get('before'))
+    return render_template('userhistory.html', history=history, next_cursor=next_cursor)
+
+@bp.route('/api/userhistory')
+def userhistory_api():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    history, next_cursor = fetch_history_page(get_history_connection(), session['user_id'], request.args.get('before'))
+    return jsonify(items=history, next=next_cursor)
+
+def export_response(query, params, filename):
+    # Streaming the rows as they are read instead of building the whole file in memory
+    rows = stream_rows(current_app.config['DATABASE'], query, params)
+    if request.args.get('format') == 'ndjson':
+        body, mimetype, filename = as_ndjson(rows), 'application/x-ndjson', filename + '.ndjson'
+    else:
+        body, mimetype, filename = as_csv(rows), 'text/csv', filename + '.csv'
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def parse_date_range():
+    # ?start=YYYY-MM-DD&end=YYYY-MM-DD (both days included) -> epoch range, raises ValueError
+    start, end = request.args.get('start'), request.args.get('end')
+    start = day_range(datetime.strptime(start, '%Y-%m-%d').date())[0] if start else None
+    end = day_range(datetime.strptime(end, '%Y-%m-%d').date())[1] if end else None
+    return start, end
+
+@bp.route('/export/myhistory')
+def export_myhistory():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        start, end = parse_date_range()
+    except ValueError:
+        return jsonify({'error': 'Dates must look like YYYY-MM-DD'}), 400
+
+    query, params = reservation_query(user_id=session['user_id'], start=start, end=end)
+    return export_response(query, params, 'my_parking_history')
+
+@bp.route('/admin/export/reservations')
+def export_reservations():
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Not authorized'}), 403
+    try:
+        start, end = parse_date_range()
+        lot_id = int(request.args['lot_id']) if request.args.get('lot_id') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must look like YYYY-MM-DD and lot_id must be a number'}), 400
 
-@app.route('/user/usersummarychart')
+    query, params = reservation_query(lot_id=lot_id, start=start, end=end)
+    return export_response(query, params, 'reservations')
+
+@bp.route('/api/admin/revenue')
+def revenue():
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Not authorized'}), 403
+    try:
+        # Here the dates select the day reservations ended (when they were paid)
+        start, end = parse_date_range()
+        lot_id = int(request.args['lot_id']) if request.args.get('lot_id') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must look like YYYY-MM-DD and lot_id must be a number'}), 400
+
+    # Revenue under the current tariff, next to what was billed at the time
+    rows = revenue_report(get_history_connection(), current_app.config['TARIFF'], lot_id, start, end)
+    total = {key: round(sum(row[key] for row in rows), 2) for key in ('reservations', 'revenue', 'billed')}
+    return jsonify(tariff=current_app.config['TARIFF'], rows=rows, total=total)
+
+@bp.route('/user/usersummarychart')
 def usersummarychart():
     return render_template('usersummarychart.html')
 
-@app.route('/admindashboard')
+@bp.route('/admindashboard')
 def admindashboard():
     if 'role' not in session or session['role'] != 'admin':
         flash('You must be logged in as an admin to view this page.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     conn = get_db_connection()
-    lots = lots = conn.execute('''
-    SELECT
-        pl.id,
-        pl.prime_location_name,
-        pl.price_per_hour,
-        pl.address,
-        pl.pincode,
-        pl.maximum_number_of_spots,
-        (SELECT COUNT(*) FROM parking_spots ps WHERE ps.lot_id = pl.id AND ps.status = 'occupied') as occupied_spots
-        FROM parking_lots pl
-        ORDER BY pl.prime_location_name
-    ''').fetchall()
-    occupiedspots_details = {}
-    for lot in lots:
-        details = conn.execute('''
-            SELECT ps.spot_number, u.username, rs.parking_timestamp
-            FROM reserved_spots rs
-            JOIN parking_spots ps ON rs.spot_id = ps.id
+    lots = dashboard_cache.get_or_set(('admindashboard',), lambda: fetch_lots(conn), version=lots_version(conn))
+
+    def fetch_details(stale):
+        # The occupied spot details of the lots whose rows are re-rendered, in
+        # one query grouped per lot here, instead of running one query per lot.
+        context = {lot['id']: {'details': []} for lot in stale}
+        spots = conn.execute('''
+            SELECT ps.lot_id, ps.spot_number, u.username, rs.parking_timestamp
+            FROM parking_spots ps
+            JOIN reserved_spots rs ON rs.spot_id = ps.id AND rs.leaving_timestamp IS NULL
             JOIN users u ON rs.user_id = u.id
-            WHERE ps.lot_id = ? AND rs.leaving_timestamp IS NULL
-            ORDER BY ps.spot_number
-        ''', (lot['id'],)).fetchall()
-        occupiedspots_details[lot['id']] = details
-    conn.close()
-    return render_template('admindashboard.html', lots=lots , occupiedspots_details=occupiedspots_details)
-
-@app.route('/admin/adminsummarychart')
+            WHERE ps.lot_id IN (SELECT value FROM json_each(?)) AND ps.status = 'occupied'
+            ORDER BY ps.lot_id, ps.spot_number
+        ''', (json.dumps(list(context)),)).fetchall()
+        for spot in spots:
+            context[spot['lot_id']]['details'].append(dict(spot))
+        return context
+
+    return render_template('admindashboard.html', lot_rows=lot_rows('adminlotrow.html', lots, fetch_details))
+
+@bp.route('/admin/adminsummarychart')
 def adminsummarychart():
     return render_template('adminsummarychart.html')
 
-@app.route('/api/admin/peakhours')
+@bp.route('/api/admin/peakhours')
 def peakhours():
     if 'role' not in session or session['role'] != 'admin':
         return jsonify({'error': 'Not authorized'}), 403
 
-    with get_db_connection() as conn:
-        # This query counts bookings started per hour for the current day
+    def fetch_peakhours(conn):
+        # Bookings started per hour for the current day, summed over the lots
+        # from the hourly rollup (kept by models/rollups.py)
         data = conn.execute('''
             SELECT
-                strftime('%H', parking_timestamp) as hour,
-                COUNT(id) as booking_count
+                hour,
+                SUM(bookings) as booking_count
             FROM
-                reserved_spots
+                hourly_bookings
             WHERE
-                date(parking_timestamp) = date('now', 'localtime')
+                hour >= ? AND hour < ?
             GROUP BY
                 hour
-            ORDER BY
-                hour
-        ''').fetchall()
+        ''', (day_start, day_end)).fetchall()
 
         # Prepare a full 24-hour dataset
         labels = [f"{h:02d}:00" for h in range(24)]
         values = [0] * 24
         for row in data:
-            hour_index = int(row['hour'])
+            hour_index = datetime.fromtimestamp(row['hour']).hour
             values[hour_index] = row['booking_count']
-        
-        return jsonify(labels=labels, values=values)
+        return labels, values
+
+    day_start, day_end = day_range()
+    labels, values = cached_analytics(('peakhours', day_start), fetch_peakhours)
+    return jsonify(labels=labels, values=values)
     
-@app.route('/api/admin/lotoccupancy')
+@bp.route('/api/admin/lotoccupancy')
 def lotoccupancy():
     if 'role' not in session or session['role'] != 'admin':
         return jsonify({'error': 'Not authorized'}), 403
 
-    with get_db_connection() as conn:
-        # This is the same query from your dashboard table
+    def fetch_lotoccupancy(conn):
+        # Reading the occupancy counters, same as the dashboard table
         data = conn.execute('''
-            SELECT pl.prime_location_name, COUNT(ps.id) as occupied_count
+            SELECT pl.prime_location_name, pl.occupied_spots as occupied_count
             FROM parking_lots pl
-            LEFT JOIN parking_spots ps ON pl.id = ps.lot_id AND ps.status = 'occupied'
-            GROUP BY pl.id
             ORDER BY occupied_count DESC
         ''').fetchall()
 
         labels = [row['prime_location_name'] for row in data]
         values = [row['occupied_count'] for row in data]
+        return labels, values
 
-        return jsonify(labels=labels, values=values)
+    labels, values = cached_analytics(('lotoccupancy',), fetch_lotoccupancy)
+    return jsonify(labels=labels, values=values)
     
-@app.route('/admin/allusers')
+@bp.route('/api/admin/occupancy/stream')
+def occupancystream():
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Not authorized'}), 403
+
+    # The stream outlives the request, it keeps the app's bus itself
+    bus = occupancy_events._get_current_object()
+    subscriber = bus.subscribe()
+    if subscriber is None:
+        # Every stream this process serves is taken, the page retries later
+        return jsonify({'error': 'Too many live clients'}), 503, {'Retry-After': str(current_app.config['EVENT_STREAM_RETRY'])}
+    def events():
+        try:
+            # Sent right away, so the client knows the stream is open
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # Comment line keeping idle connections (and proxies) alive
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'data: {json.dumps(event)}\n\n'
+        finally:
+            bus.unsubscribe(subscriber)
+
+    return Response(events(), mimetype='text/event-stream', headers={'X-Accel-Buffering': 'no'})
+
+@bp.route('/admin/allusers')
 def allusers():
     if 'role' not in session or session['role'] != 'admin':
         flash('You must be an admin to view this page.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
-    with get_db_connection() as conn:
-        users = conn.execute("SELECT id, username, role FROM users WHERE role = 'user' ORDER BY username").fetchall()
-    
-    return render_template('allusers.html', users=users)
+    prefix = request.args.get('q', '').strip()
+    users, next_cursor = fetch_users_page(get_db_connection(), request.args.get('after'), prefix)
+    return render_template('allusers.html', users=users, next_cursor=next_cursor, q=prefix)
 
-@app.route('/admin/createlot', methods=['GET', 'POST'])
+@bp.route('/api/admin/users')
+def allusers_api():
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Not authorized'}), 403
+
+    users, next_cursor = fetch_users_page(get_db_connection(), request.args.get('after'), request.args.get('q', '').strip())
+    return jsonify(items=users, next=next_cursor)
+
+@bp.route('/admin/createlot', methods=['GET', 'POST'])
 def createlot():
     # Protecting the route
     if 'role' not in session or session['role'] != 'admin':
         flash('You must be an admin to perform this action.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     if request.method == 'POST':
         # Getting the data from the form
@@ -415,7 +972,7 @@ def createlot():
 
         if not name or not price or not spots:
             flash('Name, Price, and Number of Spots are required!', 'danger')
-            return redirect(url_for('createlot'))
+            return redirect(url_for('.createlot'))
 
         conn = get_db_connection()
         try:
@@ -429,16 +986,13 @@ def createlot():
             lot_id = cursor.lastrowid
 
             # 4. Automatically create the parking spots for this lot
-            for spot_num in range(1, int(spots) + 1):
-                cursor.execute(
-                    'INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, ?)',
-                    (lot_id, spot_num, 'available')
-                )
+            add_spots(conn, lot_id, int(spots))
             
             # 5. Commit all changes
             conn.commit()
+            lots_changed(lot_id)
             flash(f'Parking lot "{name}" and its {spots} spots have been created successfully!', 'success')
-            return redirect(url_for('admindashboard'))
+            return redirect(url_for('.admindashboard'))
 
         except sqlite3.IntegrityError:
             flash(f'A parking lot with the name "{name}" already exists.', 'warning')
@@ -446,82 +1000,285 @@ def createlot():
         except sqlite3.Error as e:
             flash(f'Database error: {e}', 'danger')
             conn.rollback()
-        finally:
-            conn.close()
 
     # For a GET request, you would normally show a form.
     # Since we are creating dummy pages, we'll just return a simple message.
     return render_template('createlot.html')
 
-@app.route('/admin/deletelot/<int:lot_id>', methods=['POST'])
+@bp.route('/admin/deletelot/<int:lot_id>', methods=['POST'])
 def deletelot(lot_id):
     if 'role' not in session or session['role'] != 'admin':
         flash('You must be an admin to perform this action.', 'danger')
-        return redirect(url_for('login'))
-        
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+        return redirect(url_for('.login'))
         
+    def delete_lot(conn):
         # Check if any spots in the lot are occupied
-        occupied_count = cursor.execute(
-            'SELECT COUNT(id) FROM parking_spots WHERE lot_id = ? AND status = ?', (lot_id, 'occupied')
-        ).fetchone()[0]
-
-        if occupied_count > 0:
-            flash('Cannot delete a lot that has parked vehicles.', 'danger')
-        else:
-            # ON DELETE CASCADE in the database will handle deleting the spots
-            cursor.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
-            conn.commit()
-            flash('Parking lot deleted successfully.', 'success')
-            
-    return redirect(url_for('admindashboard'))
-
-@app.route('/admin/editlot/<int:lot_id>', methods=['GET', 'POST'])
+        lot = conn.execute('SELECT occupied_spots FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+        if lot and lot['occupied_spots'] > 0:
+            return 'occupied'
+        # The archive is outside the foreign keys, its history is checked here
+        if has_archived_reservations(conn, lot_id):
+            return 'history'
+        # ON DELETE CASCADE in the database will handle deleting the spots
+        conn.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
+        return 'deleted'
+
+    try:
+        status = run_in_write_transaction(get_history_connection(), delete_lot)
+    except sqlite3.IntegrityError:
+        # The spots are still referenced by past reservations (ON DELETE RESTRICT).
+        status = 'history'
+    if status == 'occupied':
+        flash('Cannot delete a lot that has parked vehicles.', 'danger')
+    elif status == 'history':
+        flash('Cannot delete a lot that has reservation history.', 'danger')
+    else:
+        lots_changed(lot_id)
+        flash('Parking lot deleted successfully.', 'success')
+    return redirect(url_for('.admindashboard'))
+
+@bp.route('/admin/editlot/<int:lot_id>', methods=['GET', 'POST'])
 def editlot(lot_id):
     if 'role' not in session or session['role'] != 'admin':
         flash('You must be an admin to perform this action.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
-    conn = get_db_connection()
+    conn = get_history_connection()
     
     if request.method == 'POST':
         name = request.form['prime_location_name']
         price = request.form['price_per_hour']
         address = request.form['address']
         pincode = request.form['pincode']
-        
-        conn.execute(
-            'UPDATE parking_lots SET prime_location_name = ?, price_per_hour = ?, address = ?, pincode = ? WHERE id = ?',
-            (name, price, address, pincode, lot_id)
-        )
-        conn.commit()
-        conn.close()
+        spots = request.form.get('maximum_number_of_spots', '')
+
+        try:
+            spots = int(spots) if spots else None
+        except ValueError:
+            flash('The number of spots must be a whole number.', 'danger')
+            return redirect(url_for('.editlot', lot_id=lot_id))
+        if spots is not None and spots < 1:
+            flash('A lot needs at least one spot.', 'danger')
+            return redirect(url_for('.editlot', lot_id=lot_id))
+
+        def update_lot(conn):
+            # Every refusal comes before the first write, so a refused edit
+            # commits nothing
+            if conn.execute('SELECT 1 FROM parking_lots WHERE id = ?', (lot_id,)).fetchone() is None:
+                return 'not_found'
+            if spots is not None:
+                # Adding or removing spots in bulk when the size changed, keeping
+                # the spots archived reservations point at
+                if has_archived_reservations(conn, lot_id, above=spots):
+                    return 'history'
+                status = resize_lot(conn, lot_id, spots)
+                if status != 'resized':
+                    return status
+            conn.execute(
+                'UPDATE parking_lots SET prime_location_name = ?, price_per_hour = ?, address = ?, pincode = ? WHERE id = ?',
+                (name, price, address, pincode, lot_id)
+            )
+            return 'updated'
+
+        try:
+            status = run_in_write_transaction(conn, update_lot)
+        except sqlite3.IntegrityError as e:
+            if 'FOREIGN KEY' in str(e):
+                flash('Cannot remove spots that have reservation history.', 'danger')
+            else:
+                flash(f'A parking lot with the name "{name}" already exists.', 'warning')
+            return redirect(url_for('.editlot', lot_id=lot_id))
+
+        if status == 'not_found':
+            flash('Lot not found.', 'danger')
+            return redirect(url_for('.admindashboard'))
+        if status == 'occupied':
+            flash('Cannot remove spots that are currently occupied.', 'danger')
+            return redirect(url_for('.editlot', lot_id=lot_id))
+        if status == 'history':
+            flash('Cannot remove spots that have reservation history.', 'danger')
+            return redirect(url_for('.editlot', lot_id=lot_id))
+        lots_changed(lot_id)
         flash('Parking lot details updated successfully.', 'success')
-        return redirect(url_for('admindashboard'))
+        return redirect(url_for('.admindashboard'))
 
     # For a GET request, fetch the lot data and show the form
     lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
-    conn.close()
     if lot is None:
         flash('Lot not found.', 'danger')
-        return redirect(url_for('admindashboard'))
+        return redirect(url_for('.admindashboard'))
         
     return render_template('editlot.html', lot=lot)
 
 
 
-@app.route('/logout')
+importers = {'lots': import_lots, 'reservations': import_reservations}
+
+@bp.route('/admin/import', methods=['GET', 'POST'])
+def bulkimport():
+    if 'role' not in session or session['role'] != 'admin':
+        flash('You must be an admin to perform this action.', 'danger')
+        return redirect(url_for('.login'))
+
+    report = None
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in importers or not upload:
+            flash('Choose what to import and a CSV file.', 'danger')
+            return redirect(url_for('.bulkimport'))
+
+        # Reading the upload as text line by line, it is never loaded whole
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        report = importers[kind](get_db_connection(), lines)
+        # Imported reservations are all completed, only new lots change the occupancy shown
+        lots_changed(*report['lot_ids'])
+        flash(f"Imported {report['imported']} {kind}, rejected {report['rejected']} row(s).",
+              'success' if not report['rejected'] else 'warning')
+
+    return render_template('import.html', report=report)
+
+@bp.cli.command('import-csv')
+@click.argument('kind', type=click.Choice(list(importers)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_csv_command(kind, path):
+    """Importing parking lots or historical reservations from a CSV file."""
+    conn = connect(current_app.config['DATABASE'])
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as lines:
+            report = importers[kind](conn, lines)
+    finally:
+        conn.close()
+    click.echo(f"Imported {report['imported']} {kind}, rejected {report['rejected']} row(s).")
+    for line, reason in report['errors']:
+        click.echo(f'  line {line}: {reason}')
+    if report['rejected'] > len(report['errors']):
+        click.echo(f"  ... and {report['rejected'] - len(report['errors'])} more")
+
+@bp.cli.command('check-counters')
+@click.option('--fix', is_flag=True, help='Rebuild the counters that are out of sync.')
+def check_counters_command(fix):
+    """Comparing the per-lot occupancy counters with the spot table."""
+    conn = connect(current_app.config['DATABASE'])
+    try:
+        with conn:
+            stale = check_counters(conn)
+            for row in stale:
+                click.echo(f"Lot {row['id']}: counters {row['available_spots']}/{row['occupied_spots']}, "
+                           f"spots {row['actual_available']}/{row['actual_occupied']} (available/occupied)")
+            if fix:
+                click.echo(f'Rebuilt counters of {rebuild_counters(conn)} lot(s).')
+            elif not stale:
+                click.echo('All lot counters are consistent.')
+    finally:
+        conn.close()
+
+
+@bp.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recomputing the analytics rollup tables from the reservation history."""
+    conn = connect(current_app.config['DATABASE'])
+    try:
+        attach_archive(conn)
+        run_in_write_transaction(conn, lambda conn: rebuild_rollups(conn, history_table(conn)))
+        click.echo('Rollup tables rebuilt.')
+    finally:
+        conn.close()
+
+@bp.cli.command('archive-reservations')
+@click.option('--days', type=int, default=None, help='archive reservations that ended this many days ago or earlier '
+                                                     '(ARCHIVE_AFTER_DAYS by default)')
+@click.option('--batch-size', type=int, default=5000, help='rows moved per transaction')
+def archive_reservations_command(days, batch_size):
+    """Moving old completed reservations into the archive database."""
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    conn = connect(current_app.config['DATABASE'])
+    try:
+        attach_archive(conn, create=True)
+        moved = archive_reservations(conn, int(time.time()) - days * 86400, batch_size)
+        click.echo(f'Archived {moved} reservation(s) older than {days} days.')
+    finally:
+        conn.close()
+
+
+@bp.route('/logout')
 def logout():
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.after_request
+@bp.route('/api/admin/cachestats')
+def cachestats():
+    if 'role' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Not authorized'}), 403
+    return jsonify({**dashboard_cache.stats(), 'fragments': fragment_cache.stats()})
+
+@bp.route('/admin/metrics')
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    # Compared in constant time, as bytes since a header may hold any latin-1 text
+    authorization = request.headers.get('Authorization', '').encode()
+    scraper = token is not None and hmac.compare_digest(authorization, f'Bearer {token}'.encode())
+    if ('role' not in session or session['role'] != 'admin') and not scraper:
+        return jsonify({'error': 'Not authorized'}), 403
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+
+    cache = dashboard_cache.stats()
+    fragments = fragment_cache.stats()
+    snapshot_age = analytics_snapshot.age()
+    text = request_metrics.render([
+        ('dashboard_cache_hits_total', 'counter', 'Dashboard cache hits.', cache['hits']),
+        ('dashboard_cache_misses_total', 'counter', 'Dashboard cache misses.', cache['misses']),
+        ('dashboard_cache_entries', 'gauge', 'Entries in the dashboard cache.', cache['size']),
+        ('fragment_cache_hits_total', 'counter', 'Lot rows reused from the fragment cache.', fragments['hits']),
+        ('fragment_cache_misses_total', 'counter', 'Lot rows rendered.', fragments['misses']),
+        ('occupancy_stream_clients', 'gauge', 'Connected live occupancy clients.', len(occupancy_events.subscribers)),
+        ('analytics_snapshot_age_seconds', 'gauge', 'Age of the analytics snapshot.',
+         'NaN' if snapshot_age is None else round(snapshot_age, 3)),
+    ])
+    return Response(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@bp.after_app_request
 def add_header(response):
-    response.cache_control.no_store = True
+    if 'data_as_of' in g:
+        # How old the analytics data is, in seconds (snapshot and cache lag)
+        response.headers['X-Data-Age'] = str(max(0, int(time.time() - g.data_as_of)))
+    if response.mimetype == 'application/json' and response.status_code == 200:
+        # JSON APIs get an ETag, so a client polling unchanged data gets a 304
+        # without the body. They must still revalidate and stay private.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.add_etag()
+        response.make_conditional(request)
+    else:
+        response.cache_control.no_store = True
     return response
 
+def create_app(config=None):
+    """
+    Building an app for a deployment, with its own config, caches, hashing
+    processes and snapshot (ProcessState, in app.extensions['parking']).
+    Settings are the defaults above, then PARKING_* environment variables,
+    e.g. PARKING_SECRET_KEY, PARKING_DATABASE or PARKING_PASSWORD_HASH_WORKERS
+    (values are parsed as JSON when they can be), then `config`. A secret key
+    is required. The schema is not touched, init_db is run once by whoever
+    starts the server.
+    """
+    app = Flask(__name__, template_folder='Templates')
+    app.config.update(copy.deepcopy(defaults))
+    app.config.from_prefixed_env('PARKING')
+    app.config.update(config or {})
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError('SECRET_KEY must be set (PARKING_SECRET_KEY), sessions are signed with it')
+    app.register_blueprint(bp)
+    app.teardown_appcontext(close_db_connection)
+    before_render_template.connect(start_render_timer, app)
+    template_rendered.connect(record_render_time, app)
+    init_process_state(app)
+    return app
 
 if __name__ == '__main__':
-    init_db()
+    # Development server, see gunicorn.conf.py for production. Without
+    # PARKING_SECRET_KEY sessions last until the server restarts.
+    app = create_app(None if 'PARKING_SECRET_KEY' in os.environ else {'SECRET_KEY': secrets.token_hex()})
+    init_db(app.config['DATABASE'])
     app.run(debug=True)
-
@@ -0,0 +1,85 @@
+"""
+Billing benchmark.
+
+Prices --charges synthetic reservations in one compute_charges() pass under a
+tariff using every rule. It checks a sample against charge() (the single
+booking path vacatespot uses), then builds the per-lot, per-day revenue
+report over --rows seeded reservations. Fails if the report takes longer
+than --max-seconds.
+
+    python -m benchmarks.bench_billing [--charges 5000000] [--rows 1000000] [--max-seconds 10]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from models.db import init_db, connect
+from models.allocator import add_spots
+from models.archive import attach_archive
+from models.billing import compute_charges, charge, revenue_report
+
+tariff = {'minimum_charge': 5, 'per_started_hour': True, 'daily_cap': 120,
+          'peak_hours': (8, 9, 17, 18), 'peak_multiplier': 1.5}
+
+def seed(path, rows, lots=50):
+    conn = connect(path)
+    with conn:
+        conn.execute("INSERT INTO users (username, password, role) VALUES ('bench', 'x', 'user')")
+        for lot in range(1, lots + 1):
+            conn.execute('INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots) '
+                         'VALUES (?, ?, 20)', (f'Bench {lot}', 5 + lot % 20))
+            add_spots(conn, lot, 20)
+        # Stays of 5 minutes to 3 days over the past two years, generated inside SQLite
+        conn.execute('''
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :rows)
+            INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost_per_unit, total_cost)
+            SELECT 1 + abs(random()) % (:lots * 20), 2, :start + n * (63072000 / :rows),
+                   :start + n * (63072000 / :rows) + 300 + abs(random()) % 259200, 5 + n % 20, 10
+            FROM seq
+        ''', {'rows': rows, 'lots': lots, 'start': int(time.time()) - 63072000})
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--charges', type=int, default=5000000)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--max-seconds', type=float, default=10)
+    args = parser.parse_args()
+    import numpy as np
+
+    rng = np.random.default_rng(1)
+    seconds = rng.integers(0, 4 * 86400, args.charges)
+    rates = rng.integers(5, 50, args.charges).astype(np.float64)
+    start_hours = rng.integers(0, 24, args.charges)
+    started = time.perf_counter()
+    charges = compute_charges(tariff, seconds, rates, start_hours)
+    elapsed = time.perf_counter() - started
+    print(f'compute_charges: {args.charges} reservations in {elapsed:.2f}s '
+          f'({args.charges / elapsed / 1e6:.1f}M/s)')
+
+    # Single bookings must be billed exactly like the batch
+    for i in random.Random(1).sample(range(args.charges), 1000):
+        parking = int(datetime(2024, 5, 1, int(start_hours[i])).timestamp())
+        if charge(tariff, parking, parking + int(seconds[i]), rates[i]) != charges[i]:
+            sys.exit(f'charge() and compute_charges() disagree for reservation {i}')
+    print('charge() matches compute_charges() on 1000 samples')
+
+    path = os.path.join(tempfile.mkdtemp(), 'billing.db')
+    init_db(path)
+    seed(path, args.rows)
+    conn = connect(path)
+    attach_archive(conn)
+    started = time.perf_counter()
+    rows = revenue_report(conn, tariff)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    print(f'revenue_report: {args.rows} reservations -> {len(rows)} lot-days in {elapsed:.2f}s '
+          f'({args.rows / elapsed:,.0f} rows/s)')
+    if elapsed > args.max_seconds:
+        sys.exit(f'the report took over {args.max_seconds}s')
+
+if __name__ == '__main__':
+    main()
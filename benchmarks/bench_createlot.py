@@ -0,0 +1,59 @@
+"""
+Lot creation benchmark.
+
+Times creating 1k/10k/100k spot lots with the bulk add_spots() against the
+previous one INSERT per spot loop, and growing/shrinking a lot in place
+with resize_lot().
+
+    python -m benchmarks.bench_createlot [--sizes 1000 10000 100000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from models.db import init_db, connect, run_in_write_transaction
+from models.allocator import add_spots, resize_lot
+
+def create_lot(conn, name, size):
+    return conn.execute(
+        'INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots) VALUES (?, 10, ?)',
+        (name, size)
+    ).lastrowid
+
+def spots_one_by_one(conn, lot_id, size):
+    for spot_num in range(1, size + 1):
+        conn.execute(
+            'INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, ?)',
+            (lot_id, spot_num, 'available')
+        )
+
+def timed(conn, work):
+    start = time.perf_counter()
+    run_in_write_transaction(conn, work)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'createlot.db')
+    init_db(path)
+    conn = connect(path)
+
+    print(f"{'spots':>8} {'loop (s)':>10} {'bulk (s)':>10} {'grow x2 (s)':>12} {'shrink /2 (s)':>14}")
+    for size in args.sizes:
+        loop = timed(conn, lambda conn: spots_one_by_one(conn, create_lot(conn, f'Loop {size}', size), size))
+        lot_id = None
+        def bulk(conn):
+            nonlocal lot_id
+            lot_id = create_lot(conn, f'Bulk {size}', size)
+            add_spots(conn, lot_id, size)
+        bulk_time = timed(conn, bulk)
+        grow = timed(conn, lambda conn: resize_lot(conn, lot_id, size * 2))
+        shrink = timed(conn, lambda conn: resize_lot(conn, lot_id, size // 2))
+        print(f'{size:>8} {loop:>10.3f} {bulk_time:>10.3f} {grow:>12.3f} {shrink:>14.3f}')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
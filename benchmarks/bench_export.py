@@ -0,0 +1,80 @@
+"""
+Export benchmark.
+
+Seeds a synthetic reservation table (a million rows by default), streams it
+through /admin/export/reservations as CSV and NDJSON, then as CSV filtered by
+lot and by dates, and reports rows/sec, time to first byte and how much the
+peak RSS grew during each export. Fails if the growth exceeds --max-rss-mb,
+i.e. if an export stops streaming. Pages of
+the database file mapped by mmap_size count towards RSS too, so the first
+export shows some growth even though the Python heap stays flat.
+
+    python -m benchmarks.bench_export [--rows 1000000] [--max-rss-mb 50]
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from models.db import init_db, connect
+from models.allocator import add_spots
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def seed(path, rows):
+    conn = connect(path)
+    with conn:
+        conn.execute("INSERT INTO users (username, password, role) VALUES ('bench', 'x', 'user')")
+        conn.execute("INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots) VALUES ('Bench', 10, 100)")
+        add_spots(conn, 1, 100)
+        # Completed reservations spread over the past years, generated inside SQLite
+        conn.execute('''
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost_per_unit, total_cost)
+            SELECT 1 + n % 100, 2, 1600000000 + n * 60, 1600000000 + n * 60 + 3600, 10, 10 FROM seq
+        ''', (rows,))
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--max-rss-mb', type=float, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'export.db')
+    init_db(path)
+    seed(path, args.rows)
+
+    from app import create_app
+    app = create_app({'DATABASE': path, 'SECRET_KEY': 'bench'})
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin_123', 'password': 'admin#0123'})
+
+    # Every format unfiltered, then CSV by lot and by dates: each must stream
+    exports = [(fmt, f'format={fmt}') for fmt in ('csv', 'ndjson')] + [
+        ('lot', 'format=csv&lot_id=1'),
+        ('dates', 'format=csv&start=2021-01-01&end=2021-06-30'),
+    ]
+    for label, query in exports:
+        before = peak_rss_mb()
+        start = time.perf_counter()
+        response = client.get(f'/admin/export/reservations?{query}', buffered=False)
+        first_byte, size, lines = None, 0, 0
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+            lines += chunk.count('\n') if isinstance(chunk, str) else chunk.count(b'\n')
+        response.close()
+        elapsed = time.perf_counter() - start
+        growth = peak_rss_mb() - before
+        print(f'{label:>6}: {lines} lines, {size / 1e6:.0f} MB in {elapsed:.1f}s ({lines / elapsed:.0f} rows/sec), '
+              f'first byte after {first_byte * 1000:.0f} ms, peak RSS grew {growth:.1f} MB')
+        assert growth <= args.max_rss_mb, f'peak RSS grew by {growth:.1f} MB while exporting {label}'
+
+if __name__ == '__main__':
+    main()
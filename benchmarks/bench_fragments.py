@@ -0,0 +1,86 @@
+"""
+Dashboard fragment cache benchmark.
+
+Seeds --lots parking lots with a few parked users each, then times the admin
+dashboard (every lot and its occupied spots) and a user dashboard page
+through the Flask test client, with a booking or vacate before each request
+as on a busy site. "before" clears the fragment cache on every request, so
+every lot row is rendered as before models/fragments.py. "after" keeps it,
+so only the row of the lot that changed is rendered again.
+
+    python -m benchmarks.bench_fragments [--lots 1000] [--repeat 50]
+"""
+import argparse
+import os
+import tempfile
+import time
+from werkzeug.security import generate_password_hash
+from models.db import init_db, connect
+from models.allocator import add_spots
+from models.bookings import book_spot, vacate_spot
+
+def seed(path, lots, spots=20, parked=5):
+    init_db(path)
+    conn = connect(path)
+    with conn:
+        for lot in range(1, lots + 1):
+            conn.execute('INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots, address, pincode) '
+                         'VALUES (?, ?, ?, ?, ?)', (f'Lot {lot:05d}', 10 + lot % 40, spots, f'{lot} Ring Road', f'{110000 + lot}'))
+            add_spots(conn, lot, spots)
+        hashed = generate_password_hash('fragments')
+        conn.executemany("INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+                         ((f'driver{i:05d}', hashed) for i in range(lots * parked + 2)))
+    # Users 2.. park in every lot. Of the last two, one books and vacates during the run, the other views the user dashboard
+    for i in range(lots * parked):
+        book_spot(conn, 2 + i, 1 + i // parked)
+    conn.close()
+    return 2 + lots * parked
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lots', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'fragments.db')
+    driver = seed(path, args.lots)
+    from app import create_app, lots_changed
+    app = create_app({'DATABASE': path, 'SECRET_KEY': 'bench'})
+    fragment_cache = app.extensions['parking'].fragment_cache
+    admin, user = app.test_client(), app.test_client()
+    with admin.session_transaction() as session:
+        session.update(user_id=1, username='admin', role='admin')
+    with user.session_transaction() as session:
+        session.update(user_id=driver + 1, username='viewer', role='user')
+
+    def change_a_lot(i):
+        # Booking on even runs and vacating on odd ones, in a lot that moves around
+        conn = connect(path)
+        if i % 2 == 0:
+            book_spot(conn, driver, 1 + i * 7 % args.lots)
+        else:
+            active = conn.execute('SELECT id FROM reserved_spots WHERE user_id = ? AND leaving_timestamp IS NULL',
+                                  (driver,)).fetchone()
+            vacate_spot(conn, driver, active['id'])
+        conn.close()
+        with app.test_request_context():
+            lots_changed()
+
+    for page, client in (('/admindashboard', admin), ('/userdashboard', user)):
+        for label, cached in (('before', False), ('after', True)):
+            client.get(page)
+            elapsed = 0
+            for i in range(args.repeat):
+                change_a_lot(i)
+                if not cached:
+                    fragment_cache.clear()
+                started = time.perf_counter()
+                response = client.get(page)
+                elapsed += time.perf_counter() - started
+                assert response.status_code == 200
+            print(f'{page:>16} {label:>6}: {elapsed / args.repeat * 1000:7.2f} ms per request '
+                  f'({len(response.data) // 1024} KiB)')
+    print('fragment cache:', fragment_cache.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Gate kiosk API benchmark.
+
+Times a full book-and-vacate cycle per user three ways, through the Flask
+test client:
+- html: the form POSTs, each followed by the userdashboard page the browser
+  is redirected to
+- json: POST /api/v1/bookings and /api/v1/bookings/vacate with idempotency keys
+- batch: the same events sent to /api/v1/gate/events, --batch at a time
+It reports wall time and CPU time per gate event (a booking or a vacate).
+
+    python -m benchmarks.bench_kiosk [--users 200] [--batch 50]
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+from werkzeug.security import generate_password_hash
+from models.db import init_db, connect
+from models.allocator import add_spots
+
+def seed(path, users, lots=10):
+    init_db(path)
+    conn = connect(path)
+    with conn:
+        for lot in range(1, lots + 1):
+            conn.execute('INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots) '
+                         'VALUES (?, 10, ?)', (f'Gate lot {lot}', users))
+            add_spots(conn, lot, users)
+        hashed = generate_password_hash('kiosk')
+        conn.executemany("INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+                         ((f'driver{i:05d}', hashed) for i in range(users)))
+    conn.close()
+
+def measure(name, events, run):
+    wall, cpu = time.perf_counter(), time.process_time()
+    run()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    print(f'{name:>6}: {events} events, {wall / events * 1000:.2f} ms wall and {cpu / events * 1000:.2f} ms CPU per event')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'kiosk.db')
+    seed(path, args.users)
+    from app import create_app
+    app = create_app({'DATABASE': path, 'SECRET_KEY': 'bench', 'GATE_TOKENS': {'bench': 'bench-gate'}})
+    usernames = [f'driver{i:05d}' for i in range(args.users)]
+    gate = app.test_client()
+    headers = {'X-Gate-Token': 'bench'}
+
+    sessions = []
+    for username in usernames:
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': 'kiosk'})
+        sessions.append(client)
+
+    def html():
+        for i, client in enumerate(sessions):
+            client.post(f'/bookspot/{1 + i % 10}')
+            page = client.get('/userdashboard').get_data(as_text=True)
+            booking = re.search(r'/vacatespot/(\d+)', page).group(1)
+            client.post(f'/vacatespot/{booking}')
+            client.get('/userdashboard')
+
+    def json_api():
+        for i, username in enumerate(usernames):
+            gate.post('/api/v1/bookings', json={'username': username, 'lot_id': 1 + i % 10},
+                      headers={**headers, 'Idempotency-Key': f'book-{i}'})
+            gate.post('/api/v1/bookings/vacate', json={'username': username},
+                      headers={**headers, 'Idempotency-Key': f'vacate-{i}'})
+
+    def batch():
+        for kind in ('book', 'vacate'):
+            for start in range(0, args.users, args.batch):
+                events = [{'type': kind, 'username': usernames[i], 'lot_id': 1 + i % 10, 'key': f'batch-{kind}-{i}'}
+                          for i in range(start, min(start + args.batch, args.users))]
+                gate.post('/api/v1/gate/events', json={'events': events}, headers=headers)
+
+    measure('html', 2 * args.users, html)
+    measure('json', 2 * args.users, json_api)
+    measure('batch', 2 * args.users, batch)
+
+if __name__ == '__main__':
+    main()
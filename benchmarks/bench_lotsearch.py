@@ -0,0 +1,91 @@
+"""
+Lot search benchmark.
+
+Seeds --lots parking lots (10k by default) with random pincodes, prices and
+occupancy, and compares the full lot list the user dashboard used to load
+(fetch_lots) with search_lots pages under each filter. Both the query and
+the rendering of the dashboard table are timed. Also prints the query plan of
+each search, to show which index serves it.
+
+    python -m benchmarks.bench_lotsearch [--lots 10000] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from models.db import init_db, connect
+
+def seed(path, lots):
+    init_db(path)
+    rng = random.Random(1)
+    conn = connect(path)
+    with conn:
+        for lot in range(lots):
+            spots = rng.randint(10, 200)
+            occupied = spots if rng.random() < 0.3 else rng.randint(0, spots)
+            conn.execute('''
+                INSERT INTO parking_lots (prime_location_name, price_per_hour, address, pincode,
+                                          maximum_number_of_spots, occupied_spots, available_spots)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (f'{rng.choice(["Central", "North", "South", "East", "West", "Old Town", "Market"])} Lot {lot:05d}',
+                  rng.randint(10, 100), f'{lot} Ring Road', f'{rng.randint(110001, 110999)}', spots, occupied,
+                  spots - occupied))
+    conn.close()
+
+def timed(repeat, fn):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lots', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'lotsearch.db')
+    seed(path, args.lots)
+    from flask import render_template
+    from app import create_app, fetch_lots, search_lots, lot_rows, fragment_cache
+    app = create_app({'DATABASE': path, 'SECRET_KEY': 'bench'})
+    conn = connect(path)
+
+    searches = {
+        'first page': {},
+        'pincode 1105': {'pincode': '1105'},
+        'name "north"': {'name': 'north'},
+        'price 20-30': {'min_price': 20, 'max_price': 30},
+        'has free spots': {'has_free': True},
+        'all filters': {'pincode': '110', 'name': 'market', 'min_price': 10, 'max_price': 60, 'has_free': True},
+    }
+    def render_page(lots):
+        # Rendering every row, without the rows cached by models/fragments.py
+        fragment_cache.clear()
+        return render_template('userdashboard.html', active_booking=None, lot_rows=lot_rows('userlotrow.html', lots),
+                               next_cursor=None, filters={})
+
+    with app.test_request_context('/userdashboard'):
+        ms, lots = timed(args.repeat, lambda: fetch_lots(conn))
+        render_ms, _ = timed(5, lambda: render_page(lots))
+        print(f'{"full list (old)":>16}: {len(lots):>5} rows, query {ms:7.2f} ms, render {render_ms:8.2f} ms')
+        for name, filters in searches.items():
+            ms, (page, _) = timed(args.repeat, lambda: search_lots(conn, **filters))
+            render_ms, _ = timed(5, lambda: render_page(page))
+            print(f'{name:>16}: {len(page):>5} rows, query {ms:7.2f} ms, render {render_ms:8.2f} ms')
+
+    # Which index serves each search
+    for name, filters in searches.items():
+        statements = []
+        conn.set_trace_callback(statements.append)
+        with app.app_context():
+            search_lots(conn, **filters)
+        conn.set_trace_callback(None)
+        sql = statements[-1]
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+        print(f'{name:>16}: {"; ".join(plan)}')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Scheduled reservation benchmark.
+
+Seeds one lot of --spots spots and books --reservations random windows of
+1 to 4 hours over the next 80 days through schedule_spot, timing the first and
+the last 1000 bookings: with the interval index (models/schedule.py) a booking
+shouldn't get slower as the schedule fills. Then times an availability lookup
+(free_count) against the same question asked in SQL, a NOT EXISTS probe per
+spot, and reloading the lot into an empty index. Finally checks in the
+database that no two held windows of a spot overlap.
+
+    python -m benchmarks.bench_schedule [--spots 200] [--reservations 40000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from werkzeug.security import generate_password_hash
+from models.db import init_db, connect
+from models.allocator import add_spots
+from models.schedule import ScheduleIndex, schedule_spot, free_count
+from models.timestamps import now
+
+def seed(path, spots, users):
+    init_db(path)
+    conn = connect(path)
+    with conn:
+        conn.execute('INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots, address, pincode) '
+                     "VALUES ('Depot', 20, ?, '1 Ring Road', '110001')", (spots,))
+        add_spots(conn, 1, spots)
+        hashed = generate_password_hash('schedule')
+        conn.executemany("INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+                         ((f'driver{i:05d}', hashed) for i in range(users)))
+    conn.close()
+
+def windows(count, rng):
+    start_of_day = now() // 86400 * 86400 + 86400
+    for _ in range(count):
+        start = start_of_day + rng.randrange(80 * 96) * 900
+        yield start, start + rng.randrange(4, 17) * 900
+
+def sql_free_count(conn, lot_id, start, end):
+    return conn.execute('''
+        SELECT count(*) FROM parking_spots ps WHERE lot_id = ? AND NOT EXISTS (
+            SELECT 1 FROM scheduled_reservations
+            WHERE spot_id = ps.id AND status IN ('scheduled', 'checked_in') AND start_time < ? AND end_time > ?
+        )
+    ''', (lot_id, end, start)).fetchone()[0]
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for i in range(repeat):
+        function(i)
+    return (time.perf_counter() - started) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--spots', type=int, default=200)
+    parser.add_argument('--reservations', type=int, default=40000)
+    parser.add_argument('--users', type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'schedule.db')
+    seed(path, args.spots, args.users)
+    conn = connect(path)
+    index = ScheduleIndex()
+    rng = random.Random(7)
+
+    statuses, timings = {}, []
+    for i, (start, end) in enumerate(windows(args.reservations, rng)):
+        started = time.perf_counter()
+        status, _ = schedule_spot(conn, index, 2 + i % args.users, 1, start, end)
+        timings.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f'{args.reservations} bookings on {args.spots} spots: {statuses}')
+    print(f'  first 1000: {sum(timings[:1000]) / 1000 * 1e6:7.1f} us/booking')
+    print(f'  last 1000:  {sum(timings[-1000:]) / 1000 * 1e6:7.1f} us/booking')
+
+    lookups = list(windows(1000, rng))
+    assert all(free_count(conn, index, 1, start, end) == sql_free_count(conn, 1, start, end) for start, end in lookups[:100])
+    indexed = timed(lambda i: free_count(conn, index, 1, *lookups[i]), len(lookups))
+    sql = timed(lambda i: sql_free_count(conn, 1, *lookups[i]), len(lookups))
+    print(f'availability: index {indexed * 1e6:7.1f} us, SQL {sql * 1e6:7.1f} us per lookup')
+
+    reload = timed(lambda i: ScheduleIndex().load(conn, 1), 5)
+    print(f'reload: {reload * 1000:.1f} ms, {index.stats()}')
+
+    overlaps = conn.execute('''
+        SELECT count(*) FROM (
+            SELECT start_time, lag(end_time) OVER (PARTITION BY spot_id ORDER BY start_time) AS previous_end
+            FROM scheduled_reservations WHERE status IN ('scheduled', 'checked_in')
+        ) WHERE previous_end > start_time
+    ''').fetchone()[0]
+    print(f'overlapping windows: {overlaps}')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
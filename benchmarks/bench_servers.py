@@ -0,0 +1,111 @@
+"""
+Development server vs production server throughput.
+
+Seeds one database with the load test dataset (benchmarks/loadtest.py) and
+runs the same workload of concurrent parkers and admins for --duration
+seconds against each server, over HTTP, each on its own copy of the database:
+- dev: `python app.py`, the single process Werkzeug server in debug mode
+- gunicorn: `gunicorn -c gunicorn.conf.py wsgi:app`, --workers processes of
+  --threads threads each
+Prints requests per second and latency percentiles of each.
+
+    python -m benchmarks.bench_servers [--workers 3] [--threads 4] [--duration 20]
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from benchmarks.loadtest import seed, HttpSession, Recorder, parker, admin, percentile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+dev_server = '''
+import sys
+from app import create_app
+from models.db import init_db
+app = create_app({'SECRET_KEY': 'bench'})
+init_db(app.config['DATABASE'])
+app.run(port=int(sys.argv[1]), debug=True, use_reloader=False)
+'''
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_until_up(url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                response.read()
+                return
+        except OSError:
+            if process.poll() is not None:
+                sys.exit('the server exited before answering')
+            time.sleep(0.05)
+    sys.exit(f'no answer within {timeout}s')
+
+def run_workload(url, args):
+    recorder = Recorder()
+    deadline = time.time() + args.duration
+    threads = [
+        threading.Thread(target=parker, args=(HttpSession(url), recorder, f'parker{i:06d}', args.lots, deadline))
+        for i in range(args.parkers)
+    ] + [threading.Thread(target=admin, args=(HttpSession(url), recorder, deadline)) for _ in range(args.admins)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    samples = sorted(sample for timings in recorder.timings.values() for sample in timings)
+    return len(samples) / elapsed, samples, sum(recorder.errors.values())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--lots', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--parkers', type=int, default=16, help='concurrent simulated users')
+    parser.add_argument('--admins', type=int, default=2, help='concurrent simulated admins')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per server')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    seeded = os.path.join(directory, 'seeded.db')
+    seed(seeded, args.lots, 50, args.users, 1)
+
+    servers = {
+        'dev': lambda port: [sys.executable, '-c', dev_server, str(port)],
+        'gunicorn': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+    }
+    for name, command in servers.items():
+        path = os.path.join(directory, f'{name}.db')
+        shutil.copy(seeded, path)
+        port = free_port()
+        env = {**os.environ, 'PARKING_DATABASE': path, 'PARKING_SECRET_KEY': 'bench-servers',
+               'WEB_BIND': f'127.0.0.1:{port}', 'WEB_CONCURRENCY': str(args.workers), 'WEB_THREADS': str(args.threads)}
+        process = subprocess.Popen(command(port), cwd=root, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f'http://127.0.0.1:{port}'
+            wait_until_up(url + '/', process)
+            rps, samples, errors = run_workload(url, args)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f'{name:>9}: {rps:7.1f} req/s, p50 {percentile(samples, 50) * 1000:7.1f} ms, '
+              f'p95 {percentile(samples, 95) * 1000:7.1f} ms, p99 {percentile(samples, 99) * 1000:7.1f} ms, '
+              f'{len(samples)} requests, {errors} errors')
+    print(f'{os.cpu_count()} CPU(s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Time from starting a server process to its first served request.
+
+Each run starts a fresh interpreter that imports the app, runs init_db and
+serves on a free port, while this script polls '/' until it answers. Cold
+runs start from no database, warm runs from an existing one (the usual case
+for a restarted or newly forked worker). The script exits with status 1 when
+the warm median is over --target-ms.
+
+    python -m benchmarks.bench_startup --runs 10 --target-ms 500
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+server = '''
+import sys
+from models.db import init_db
+from app import create_app
+app = create_app({'DATABASE': sys.argv[1], 'SECRET_KEY': 'bench'})
+init_db(sys.argv[1])
+app.run(port=int(sys.argv[2]), use_reloader=False)
+'''
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def time_to_first_request(path, timeout=30):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', server, path, str(port)], cwd=root,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1) as response:
+                    response.read()
+                    return time.perf_counter() - started
+            except OSError:
+                if process.poll() is not None:
+                    sys.exit('the server exited before answering')
+                time.sleep(0.002)
+        sys.exit(f'no answer within {timeout}s')
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--target-ms', type=float, default=500, help='warm start target (median)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    cold, warm = [], []
+    for run in range(args.runs):
+        path = os.path.join(directory, f'startup{run}.db')
+        cold.append(time_to_first_request(path))
+        warm.append(time_to_first_request(path))
+
+    for name, samples in (('cold', cold), ('warm', warm)):
+        print(f'{name}: median {statistics.median(samples) * 1000:.0f} ms, '
+              f'min {min(samples) * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms')
+    median = statistics.median(warm) * 1000
+    if median > args.target_ms:
+        sys.exit(f'warm start {median:.0f} ms is over the {args.target_ms:.0f} ms target')
+    print(f'warm start is within the {args.target_ms:.0f} ms target')
+
+if __name__ == '__main__':
+    main()
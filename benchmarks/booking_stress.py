@@ -0,0 +1,95 @@
+"""
+Concurrent booking stress test.
+
+Fires bookings for many users at a single lot from several threads (one
+connection per thread, like request threads) and checks that no spot was
+handed out twice and the lot counters still match the spots. Then vacates
+every booking the same way. Reports bookings and vacates per second.
+
+    python -m benchmarks.booking_stress --spots 2000 --users 3000 --threads 16
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from models.db import init_db, connect
+from models.allocator import add_spots, check_counters
+from models.bookings import book_spot, vacate_spot
+
+def run_threads(path, threads, work, items):
+    """Splitting items over `threads` threads, each with its own connection, returns elapsed seconds."""
+    def worker(chunk):
+        conn = connect(path)
+        try:
+            for item in chunk:
+                work(conn, item)
+        finally:
+            conn.close()
+
+    pool = [threading.Thread(target=worker, args=(items[i::threads],)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--spots', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    init_db(path)
+    conn = connect(path)
+    with conn:
+        lot_id = conn.execute(
+            "INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots) VALUES ('Stress', 10, ?)",
+            (args.spots,)
+        ).lastrowid
+        add_spots(conn, lot_id, args.spots)
+        conn.executemany(
+            "INSERT INTO users (username, password, role) VALUES (?, 'x', 'user')",
+            [(f'user{i}',) for i in range(args.users)]
+        )
+    user_ids = [row['id'] for row in conn.execute("SELECT id FROM users WHERE role = 'user'")]
+
+    outcomes = {}
+    lock = threading.Lock()
+    def book(conn, user_id):
+        status, booking = book_spot(conn, user_id, lot_id)
+        with lock:
+            outcomes[status] = outcomes.get(status, 0) + 1
+
+    elapsed = run_threads(path, args.threads, book, user_ids)
+    print(f"{len(user_ids)} booking requests in {elapsed:.2f}s: {len(user_ids) / elapsed:.0f} bookings/sec {outcomes}")
+
+    # No spot or user may have more than one active reservation, and every
+    # active reservation must sit on an occupied spot.
+    doubles = conn.execute('''
+        SELECT COUNT(*) FROM (SELECT spot_id FROM reserved_spots WHERE leaving_timestamp IS NULL
+                              GROUP BY spot_id HAVING COUNT(*) > 1)
+    ''').fetchone()[0]
+    active = conn.execute('SELECT COUNT(*) FROM reserved_spots WHERE leaving_timestamp IS NULL').fetchone()[0]
+    occupied = conn.execute("SELECT COUNT(*) FROM parking_spots WHERE status = 'occupied'").fetchone()[0]
+    assert doubles == 0, f'{doubles} spots were allocated twice'
+    assert active == occupied == min(args.spots, args.users), (active, occupied)
+    assert outcomes.get('booked') == active, outcomes
+    assert not check_counters(conn), 'lot counters out of sync after booking'
+
+    bookings = conn.execute(
+        'SELECT id, user_id FROM reserved_spots WHERE leaving_timestamp IS NULL'
+    ).fetchall()
+    elapsed = run_threads(path, args.threads, lambda conn, b: vacate_spot(conn, b['user_id'], b['id']), bookings)
+    print(f"{len(bookings)} vacates in {elapsed:.2f}s: {len(bookings) / elapsed:.0f} vacates/sec")
+
+    assert conn.execute("SELECT COUNT(*) FROM parking_spots WHERE status = 'occupied'").fetchone()[0] == 0
+    assert not check_counters(conn), 'lot counters out of sync after vacating'
+    conn.close()
+    print('OK: no double allocations, counters consistent.')
+
+if __name__ == '__main__':
+    main()
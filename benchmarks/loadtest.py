@@ -0,0 +1,230 @@
+"""
+Load test for the booking workflow.
+
+Seeds a synthetic dataset (lots, spots, users and years of past reservations)
+into a fresh database, then runs concurrent simulated users against the real
+routes, through the Flask test client or a running server (--url). Each
+parker logs in, looks at the dashboard and charts, books a spot, reads
+the history and vacates again. Each admin loads the dashboard and the chart
+APIs. Throughput and p50/p95/p99 latency are reported per route as JSON
+(--output), so runs on different commits can be compared. Running the same
+config with and without --no-metrics shows what the instrumentation costs.
+
+    python -m benchmarks.loadtest --lots 200 --users 2000 --years 2 --parkers 32 --admins 4 --duration 30
+    python -m benchmarks.loadtest --url http://127.0.0.1:5000 --db parking_app.db ...
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from werkzeug.security import generate_password_hash
+from models.db import init_db, connect
+from models.allocator import add_spots, rebuild_counters
+from models.rollups import rebuild_rollups
+
+password = 'loadtest#1'
+admin_login = {'username': 'admin_123', 'password': 'admin#0123'}
+
+def seed(path, lots, spots, users, years):
+    """Filling a new database with lots, users and `years` of completed reservations."""
+    init_db(path)
+    conn = connect(path)
+    with conn:
+        for lot in range(lots):
+            lot_id = conn.execute(
+                'INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots, address, pincode) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (f'Lot {lot:05d}', 10 + lot % 40, spots, f'{lot} Main Road', f'{226000 + lot % 500}')
+            ).lastrowid
+            add_spots(conn, lot_id, spots)
+        # One hash shared by every simulated user, hashing each would dominate seeding
+        hashed = generate_password_hash(password)
+        conn.executemany(
+            "INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+            ((f'parker{i:06d}', hashed) for i in range(users))
+        )
+        # About one visit per user every other day, generated inside SQLite
+        now = int(time.time())
+        visits = users * years * 180
+        conn.execute('''
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :visits)
+            INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost_per_unit, total_cost)
+            SELECT 1 + abs(random()) % (:lots * :spots),
+                   2 + abs(random()) % :users,
+                   :now - :span + n * (:span / :visits),
+                   :now - :span + n * (:span / :visits) + 600 + abs(random()) % 14400,
+                   10, 10 + abs(random()) % 200
+            FROM seq
+        ''', {'visits': visits, 'lots': lots, 'spots': spots, 'users': users, 'now': now - 86400,
+              'span': years * 365 * 86400})
+        rebuild_counters(conn)
+        rebuild_rollups(conn)
+    conn.close()
+
+class TestClientSession:
+    """Requests through the Flask test client, in process."""
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+class HttpSession:
+    """Requests to a running server, with its own cookie jar (session)."""
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Redirects are reported as is, like the test client does, and timed on their own
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.errors = {}
+
+    def timed(self, session, name, method, path, data=None):
+        start = time.perf_counter()
+        status, body = session.request(method, path, data)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.timings.setdefault(name, []).append(elapsed)
+            if status >= 400:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        return status, body
+
+    def report(self, duration):
+        routes = {}
+        for name, samples in sorted(self.timings.items()):
+            samples.sort()
+            routes[name] = {
+                'requests': len(samples),
+                'errors': self.errors.get(name, 0),
+                'throughput_rps': round(len(samples) / duration, 1),
+                'mean_ms': round(statistics.fmean(samples) * 1000, 2),
+                'p50_ms': round(percentile(samples, 50) * 1000, 2),
+                'p95_ms': round(percentile(samples, 95) * 1000, 2),
+                'p99_ms': round(percentile(samples, 99) * 1000, 2),
+            }
+        total = sum(len(samples) for samples in self.timings.values())
+        return {'routes': routes, 'total_requests': total, 'throughput_rps': round(total / duration, 1)}
+
+def percentile(sorted_samples, pct):
+    index = max(0, min(len(sorted_samples) - 1, round(pct / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+def parker(session, recorder, username, lots, deadline):
+    recorder.timed(session, 'login', 'POST', '/login', {'username': username, 'password': password})
+    while time.time() < deadline:
+        recorder.timed(session, 'userdashboard', 'GET', '/userdashboard')
+        recorder.timed(session, 'bookspot', 'POST', f'/bookspot/{random.randint(1, lots)}')
+        status, page = recorder.timed(session, 'userdashboard', 'GET', '/userdashboard')
+        recorder.timed(session, 'api_mostusedlot', 'GET', '/api/mostusedlot')
+        recorder.timed(session, 'api_usermonthlycost', 'GET', '/api/usermonthlycost')
+        recorder.timed(session, 'userhistory', 'GET', '/userhistory')
+        booking = re.search(r'/vacatespot/(\d+)', page)
+        if booking:
+            recorder.timed(session, 'vacatespot', 'POST', f'/vacatespot/{booking.group(1)}')
+
+def admin(session, recorder, deadline):
+    recorder.timed(session, 'login', 'POST', '/login', admin_login)
+    while time.time() < deadline:
+        recorder.timed(session, 'admindashboard', 'GET', '/admindashboard')
+        recorder.timed(session, 'api_admin_peakhours', 'GET', '/api/admin/peakhours')
+        recorder.timed(session, 'api_admin_lotoccupancy', 'GET', '/api/admin/lotoccupancy')
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lots', type=int, default=200)
+    parser.add_argument('--spots', type=int, default=50, help='spots per lot')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=1, help='years of past reservations')
+    parser.add_argument('--parkers', type=int, default=16, help='concurrent simulated users')
+    parser.add_argument('--admins', type=int, default=2, help='concurrent simulated admins')
+    parser.add_argument('--duration', type=float, default=20, help='seconds')
+    parser.add_argument('--url', help='drive a running server instead of the in-process test client')
+    parser.add_argument('--db', help='database to seed (a temporary one by default); '
+                                     'with --url it must be the database the server uses')
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='turn the request instrumentation off (test client only)')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+    if os.path.exists(path):
+        sys.exit(f'{path} already exists, the load test seeds a fresh database')
+    started = time.perf_counter()
+    seed(path, args.lots, args.spots, args.users, args.years)
+    print(f'Seeded {path} in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    if args.url:
+        new_session = lambda: HttpSession(args.url)
+    else:
+        from app import create_app
+        app = create_app({'DATABASE': path, 'SECRET_KEY': 'loadtest', 'METRICS_ENABLED': not args.no_metrics})
+        new_session = lambda: TestClientSession(app)
+
+    recorder = Recorder()
+    deadline = time.time() + args.duration
+    threads = [
+        threading.Thread(target=parker, args=(new_session(), recorder, f'parker{i:06d}', args.lots, deadline))
+        for i in range(min(args.parkers, args.users))
+    ] + [threading.Thread(target=admin, args=(new_session(), recorder, deadline)) for _ in range(args.admins)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = {
+        'commit': git_commit(),
+        'target': args.url or 'test_client',
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'db', 'url')},
+        'duration_s': round(elapsed, 2),
+        **recorder.report(elapsed),
+    }
+    for name, route in results['routes'].items():
+        print(f"{name:>24} {route['requests']:>7} req {route['throughput_rps']:>8} rps  "
+              f"p50 {route['p50_ms']:>8} ms  p95 {route['p95_ms']:>8} ms  p99 {route['p99_ms']:>8} ms  "
+              f"errors {route['errors']}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
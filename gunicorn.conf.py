@@ -0,0 +1,49 @@
+"""
+Production server settings, used with `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Prefork worker processes, each serving requests on a pool of threads
+(gthread). The app is loaded once by the master and forked. The master
+creates or upgrades the schema before the first worker starts, and every
+worker builds its own per-process state (caches, snapshot thread, password
+hashing processes) after the fork. One worker at a time refreshes the
+analytics snapshot, the others only read it (models/snapshot.py).
+
+Server settings come from the environment:
+    WEB_BIND          address to listen on (127.0.0.1:8000)
+    WEB_CONCURRENCY   worker processes (2 per CPU + 1)
+    WEB_THREADS       threads per worker (4)
+App settings are PARKING_* variables read by create_app, PARKING_SECRET_KEY
+is required.
+
+A live occupancy client holds one of a worker's threads while it stays
+connected, so a worker serves at most half its threads as streams
+(PARKING_EVENT_STREAMS_PER_PROCESS) and turns further ones away with a 503.
+"""
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get('WEB_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+# Read by create_app when the app is loaded, after this file
+os.environ.setdefault('PARKING_EVENT_STREAMS_PER_PROCESS', str(max(threads // 2, 1)))
+preload_app = True
+
+def on_starting(server):
+    # Once, in the master, before any worker exists
+    if not os.environ.get('PARKING_SECRET_KEY'):
+        sys.exit('PARKING_SECRET_KEY must be set, sessions would be signed with the development key')
+    from models.db import init_db
+    from wsgi import app
+    init_db(app.config['DATABASE'])
+
+def post_fork(server, worker):
+    from app import init_process_state
+    from wsgi import app
+    init_process_state(app)
+
+def worker_exit(server, worker):
+    from wsgi import app
+    app.extensions['parking'].close()
@@ -0,0 +1,150 @@
+"""
+Spot allocation with per-lot occupancy counters.
+
+parking_lots keeps denormalized `available_spots` / `occupied_spots` counters
+so dashboards don't have to aggregate parking_spots. They are only changed
+through the functions below, inside the caller's transaction, together with
+the spot rows they describe. The partial index idx_parking_spots_free holds
+exactly the free spots of every lot ordered by spot number, so the next spot
+is found with a single index lookup instead of a scan.
+"""
+from models.timestamps import now
+
+def allocate_spot(conn, lot_id, held_until=None):
+    """
+    Marking the lowest numbered free spot of a lot occupied, None when the lot
+    is full. With `held_until` (epoch seconds), spots held by a scheduled
+    reservation (models/schedule.py) between now and then are passed over.
+    """
+    # One conditional statement both picks the spot and claims it. The held
+    # windows of a spot never overlap, so only the last one starting before
+    # held_until can still be running.
+    spot = conn.execute('''
+        UPDATE parking_spots SET status = 'occupied'
+        WHERE id = (
+            SELECT id FROM parking_spots ps WHERE lot_id = :lot_id AND status = 'available'
+            AND (:held_until IS NULL OR coalesce((
+                SELECT end_time FROM scheduled_reservations
+                WHERE spot_id = ps.id AND status IN ('scheduled', 'checked_in') AND start_time < :held_until
+                ORDER BY start_time DESC LIMIT 1
+            ), 0) <= :now)
+            ORDER BY spot_number LIMIT 1
+        ) AND status = 'available'
+        RETURNING id, spot_number
+    ''', {'lot_id': lot_id, 'held_until': held_until, 'now': now()}).fetchone()
+    if spot is None:
+        return None
+
+    conn.execute(
+        'UPDATE parking_lots SET available_spots = available_spots - 1, occupied_spots = occupied_spots + 1 WHERE id = ?',
+        (lot_id,)
+    )
+    return spot
+
+def claim_spot(conn, spot_id):
+    """Marking a given free spot occupied, returns its lot id (None if it wasn't free)."""
+    spot = conn.execute(
+        "UPDATE parking_spots SET status = 'occupied' WHERE id = ? AND status = 'available' RETURNING lot_id",
+        (spot_id,)
+    ).fetchone()
+    if spot is None:
+        return None
+
+    conn.execute(
+        'UPDATE parking_lots SET available_spots = available_spots - 1, occupied_spots = occupied_spots + 1 WHERE id = ?',
+        (spot['lot_id'],)
+    )
+    return spot['lot_id']
+
+def release_spot(conn, spot_id):
+    """Marking an occupied spot available again, returns its lot id (None if it wasn't occupied)."""
+    spot = conn.execute(
+        "UPDATE parking_spots SET status = 'available' WHERE id = ? AND status = 'occupied' RETURNING lot_id",
+        (spot_id,)
+    ).fetchone()
+    if spot is None:
+        return None
+
+    conn.execute(
+        'UPDATE parking_lots SET available_spots = available_spots + 1, occupied_spots = occupied_spots - 1 WHERE id = ?',
+        (spot['lot_id'],)
+    )
+    return spot['lot_id']
+
+def add_spots(conn, lot_id, count, first_number=1):
+    """Creating `count` free spots for a lot, numbered from `first_number`, in one statement."""
+    if count <= 0:
+        return
+    # A recursive CTE generates the spot numbers inside SQLite, so even a
+    # 100k spot lot is a single INSERT instead of one statement per spot.
+    conn.execute('''
+        WITH RECURSIVE seq(n) AS (
+            SELECT ? UNION ALL SELECT n + 1 FROM seq WHERE n < ?
+        )
+        INSERT INTO parking_spots (lot_id, spot_number, status)
+        SELECT ?, n, 'available' FROM seq
+    ''', (first_number, first_number + count - 1, lot_id))
+    conn.execute(
+        'UPDATE parking_lots SET available_spots = available_spots + ? WHERE id = ?', (count, lot_id)
+    )
+
+def resize_lot(conn, lot_id, new_size):
+    """
+    Changing the number of spots of a lot in place. Growing appends free spots
+    after the highest spot number, shrinking deletes the trailing spots above
+    `new_size` and is refused ('occupied') while any of them is taken.
+    Returns 'resized', 'occupied' or 'not_found'.
+    """
+    lot = conn.execute('SELECT maximum_number_of_spots FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+    if lot is None:
+        return 'not_found'
+
+    current_size = lot['maximum_number_of_spots']
+    if new_size > current_size:
+        add_spots(conn, lot_id, new_size - current_size, first_number=current_size + 1)
+    elif new_size < current_size:
+        occupied = conn.execute(
+            "SELECT 1 FROM parking_spots WHERE lot_id = ? AND spot_number > ? AND status = 'occupied' LIMIT 1",
+            (lot_id, new_size)
+        ).fetchone()
+        if occupied:
+            return 'occupied'
+        removed = conn.execute(
+            "DELETE FROM parking_spots WHERE lot_id = ? AND spot_number > ? AND status = 'available'",
+            (lot_id, new_size)
+        ).rowcount
+        conn.execute(
+            'UPDATE parking_lots SET available_spots = available_spots - ? WHERE id = ?', (removed, lot_id)
+        )
+
+    conn.execute('UPDATE parking_lots SET maximum_number_of_spots = ? WHERE id = ?', (new_size, lot_id))
+    return 'resized'
+
+# Counts recomputed from the spot table, one row per lot.
+_actual_counts = '''
+    SELECT
+        pl.id,
+        pl.available_spots,
+        pl.occupied_spots,
+        COUNT(ps.id) FILTER (WHERE ps.status = 'available') as actual_available,
+        COUNT(ps.id) FILTER (WHERE ps.status = 'occupied') as actual_occupied
+    FROM parking_lots pl
+    LEFT JOIN parking_spots ps ON ps.lot_id = pl.id
+    GROUP BY pl.id
+'''
+
+def check_counters(conn):
+    """Listing the lots whose counters don't match their spots."""
+    return [
+        row for row in conn.execute(_actual_counts).fetchall()
+        if (row['available_spots'], row['occupied_spots']) != (row['actual_available'], row['actual_occupied'])
+    ]
+
+def rebuild_counters(conn):
+    """Recomputing every lot's counters from the spot table, returns the number of lots fixed."""
+    stale = check_counters(conn)
+    conn.executemany(
+        'UPDATE parking_lots SET available_spots = ?, occupied_spots = ? WHERE id = ?',
+        [(row['actual_available'], row['actual_occupied'], row['id']) for row in stale]
+    )
+    return len(stale)
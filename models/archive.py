@@ -0,0 +1,145 @@
+"""
+Archiving old completed reservations into a second SQLite file.
+
+reserved_spots keeps the active reservations and the recent history, so the
+tables and indexes the booking routes work on stay small. Completed
+reservations older than a configurable age are moved, in batches, into
+reserved_spots of '<database>-archive.db', next to the main file.
+
+Code reading the whole history calls attach_archive() on its connection and
+reads the temporary view all_reservations, which is the UNION ALL of both
+tables (the main table alone when nothing has been archived yet).
+
+Each batch is first copied into the archive and committed, and only then
+deleted from the main table. With WAL a transaction spanning two files is
+not atomic across them. In this order a crash can only leave rows in both
+places, and the next run removes them from the main table. Archived rows
+are outside the main file's foreign keys, so the routes deleting spots (lot
+deletion and resizing) ask has_archived_reservations() themselves: the
+history joins parking_spots, and rows of a deleted spot would drop out of
+it.
+"""
+import os
+from models.db import run_in_write_transaction
+
+archive_schema = [
+    '''CREATE TABLE IF NOT EXISTS archive.reserved_spots (
+        id INTEGER PRIMARY KEY, -- same id as in the main table
+        spot_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        parking_timestamp INTEGER NOT NULL,
+        leaving_timestamp INTEGER NOT NULL,
+        parking_cost_per_unit REAL NOT NULL,
+        total_cost REAL
+    )''',
+    '''CREATE INDEX IF NOT EXISTS archive.idx_archived_user_time
+       ON reserved_spots(user_id, parking_timestamp)''',
+    '''CREATE INDEX IF NOT EXISTS archive.idx_archived_parking_time
+       ON reserved_spots(parking_timestamp)''',
+    '''CREATE INDEX IF NOT EXISTS archive.idx_archived_spot
+       ON reserved_spots(spot_id)''',
+    'PRAGMA archive.user_version = 2',
+]
+archive_version = 2 # every statement is idempotent, an older archive reruns them all
+
+columns = 'id, spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost_per_unit, total_cost'
+
+def archive_path(conn):
+    """The archive file belonging to the connection's main database, None in memory."""
+    main = conn.execute("SELECT file FROM pragma_database_list WHERE name = 'main'").fetchone()[0]
+    return os.path.splitext(main)[0] + '-archive.db' if main else None
+
+def has_history_view(conn):
+    return conn.execute(
+        "SELECT 1 FROM temp.sqlite_master WHERE type = 'view' AND name = 'all_reservations'"
+    ).fetchone() is not None
+
+def attach_archive(conn, create=False):
+    """
+    Attaching the archive, if there is one (or `create`), and defining the
+    temp view all_reservations over the whole history. Must be called
+    outside a transaction. Returns True when the archive is attached.
+    """
+    if has_history_view(conn):
+        return conn.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone() is not None
+    path = archive_path(conn)
+    attached = path is not None and (create or os.path.exists(path))
+    if attached:
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        if conn.execute('PRAGMA archive.user_version').fetchone()[0] < archive_version:
+            for statement in archive_schema:
+                conn.execute(statement)
+        conn.execute(f'''
+            CREATE TEMP VIEW all_reservations AS
+            SELECT {columns} FROM main.reserved_spots
+            UNION ALL
+            SELECT {columns} FROM archive.reserved_spots
+        ''')
+    else:
+        conn.execute(f'CREATE TEMP VIEW all_reservations AS SELECT {columns} FROM main.reserved_spots')
+    return attached
+
+def history_table(conn):
+    """
+    The table or view with the complete reservation history on `conn`.
+    Refuses to return the main table alone when an archive exists but isn't
+    attached, as reading only the recent history would silently drop rows.
+    """
+    if has_history_view(conn):
+        return 'all_reservations'
+    path = archive_path(conn)
+    if path and os.path.exists(path):
+        raise RuntimeError(f'{path} holds archived reservations, attach it first (attach_archive)')
+    return 'reserved_spots'
+
+def has_archived_reservations(conn, lot_id, above=0):
+    """
+    Whether archived reservations point at spots of a lot numbered above
+    `above` (any spot by default). Reads the archive attached by
+    attach_archive(), no archive means no archived reservations.
+    """
+    if conn.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone() is None:
+        return False
+    return conn.execute('''
+        SELECT 1 FROM parking_spots ps
+        WHERE ps.lot_id = ? AND ps.spot_number > ?
+          AND EXISTS (SELECT 1 FROM archive.reserved_spots a WHERE a.spot_id = ps.id)
+        LIMIT 1
+    ''', (lot_id, above)).fetchone() is not None
+
+def archive_reservations(conn, cutoff, batch_size=5000):
+    """
+    Moving completed reservations that ended before `cutoff` (epoch seconds)
+    into the attached archive, `batch_size` rows per transaction. Returns the
+    number of rows moved.
+    """
+    def copy_batch(conn):
+        last = conn.execute('''
+            SELECT max(id) FROM (
+                SELECT id FROM main.reserved_spots
+                WHERE leaving_timestamp < ?
+                ORDER BY id LIMIT ?
+            )
+        ''', (cutoff, batch_size)).fetchone()[0]
+        if last is not None:
+            conn.execute(f'''
+                INSERT OR IGNORE INTO archive.reserved_spots ({columns})
+                SELECT {columns} FROM main.reserved_spots
+                WHERE id <= ? AND leaving_timestamp < ?
+            ''', (last, cutoff))
+        return last
+
+    def delete_batch(conn, last):
+        # Only rows the archive really has, see the module docstring.
+        return conn.execute('''
+            DELETE FROM main.reserved_spots
+            WHERE id <= ? AND leaving_timestamp < ?
+              AND EXISTS (SELECT 1 FROM archive.reserved_spots a WHERE a.id = main.reserved_spots.id)
+        ''', (last, cutoff)).rowcount
+
+    moved = 0
+    while True:
+        last = run_in_write_transaction(conn, copy_batch)
+        if last is None:
+            return moved
+        moved += run_in_write_transaction(conn, lambda conn: delete_batch(conn, last))
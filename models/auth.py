@@ -0,0 +1,102 @@
+"""
+Password hashing off the request threads, and per-username login limits.
+
+Hashing is CPU bound and holds the GIL, so it runs in a small process pool.
+At most `max_pending` hashes may be queued or running. A request that can't
+get a slot within `wait` seconds gets HasherBusy instead of tying up its
+thread. The pool is started on first use, so it is created in the process
+that serves requests, not in a parent that forks workers later. That
+process runs request threads, and forking it could leave a child stuck on
+a lock another thread held, so the hashing processes are started by a
+forkserver (spawned where there is none) instead of forked from it.
+
+`method` is a werkzeug method string in full form, e.g. 'scrypt:32768:8:1' or
+'pbkdf2:sha256:600000'. Stored hashes made with other parameters are replaced
+at the user's next successful login (see needs_rehash).
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, method='scrypt:32768:8:1', workers=2, max_pending=64, wait=5):
+        self.method = method
+        self.workers = workers
+        self.wait = wait
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.wait):
+            raise HasherBusy()
+        try:
+            with self.lock:
+                if self.pool is None:
+                    # Imported here, multiprocessing is slow to import and only needed at the first login
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+                    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+            return self.pool.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        return self.run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """True when the stored hash was made with another method or cost."""
+        return stored_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        # Called in a forked child too, where the parent's pool can't be used.
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+class LoginLimiter:
+    """
+    Allowing `attempts` logins per username in any `window` seconds. Only the
+    `maxsize` most recently tried usernames are tracked. The limits are per
+    process, so each worker counts on its own.
+    """
+    def __init__(self, attempts=5, window=60, maxsize=10000):
+        self.attempts = attempts
+        self.window = window
+        self.maxsize = maxsize
+        self.recent = OrderedDict() # username -> deque of attempt times, oldest first
+        self.lock = threading.Lock()
+
+    def allow(self, username):
+        """Counting an attempt for `username`, False when it is over the limit."""
+        now = time.monotonic()
+        with self.lock:
+            times = self.recent.get(username)
+            if times is None:
+                times = self.recent[username] = deque()
+            self.recent.move_to_end(username)
+            while times and times[0] <= now - self.window:
+                times.popleft()
+            if len(times) >= self.attempts:
+                return False
+            times.append(now)
+            while len(self.recent) > self.maxsize:
+                self.recent.popitem(last=False)
+            return True
+
+    def retry_after(self, username):
+        """Seconds until `username` can try again."""
+        with self.lock:
+            times = self.recent.get(username)
+            if not times:
+                return 0
+            return max(0, int(times[0] + self.window - time.monotonic()) + 1)
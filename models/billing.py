@@ -0,0 +1,134 @@
+"""
+Billing: charging reservations under a tariff, whole arrays at a time.
+
+compute_charges() prices any number of reservations in one vectorized NumPy
+pass. vacate_spot bills a single booking with charge(), which goes through
+the same function, so a bill and a revenue report always agree to the cent.
+
+Tariff rules, applied in this order:
+- peak pricing: the hourly rate is multiplied by `peak_multiplier` when the
+  reservation starts in one of `peak_hours` (local hours, 0-23)
+- per started hour: the duration is rounded up to whole hours
+- daily cap: every full 24 hours of a stay cost at most `daily_cap`, and so
+  does the rest of it
+- minimum charge: no reservation costs less than `minimum_charge`
+Charges are rounded to cents. The default tariff bills the exact duration at
+the lot's hourly rate.
+
+NumPy is imported on first use, as it is slow to import and only needed
+once something is billed.
+"""
+import json
+import time
+from datetime import date, datetime, timedelta
+
+default_tariff = {
+    'minimum_charge': 0.0,
+    'per_started_hour': False,
+    'daily_cap': None,
+    'peak_hours': (),
+    'peak_multiplier': 1.0,
+}
+
+# Rows priced per NumPy pass when building a report
+report_batch = 100000
+
+def compute_charges(tariff, seconds, rates, start_hours):
+    """Charges for arrays of durations (seconds), hourly rates and local start hours."""
+    import numpy as np
+    tariff = {**default_tariff, **(tariff or {})}
+    hours = np.clip(np.asarray(seconds, dtype=np.float64), 0, None) / 3600
+    rates = np.asarray(rates, dtype=np.float64)
+
+    if tariff['peak_hours'] and tariff['peak_multiplier'] != 1:
+        peak = np.zeros(24, dtype=bool)
+        peak[list(tariff['peak_hours'])] = True
+        starts_in_peak = peak[np.asarray(start_hours, dtype=np.int64) % 24]
+        rates = np.where(starts_in_peak, rates * tariff['peak_multiplier'], rates)
+    if tariff['per_started_hour']:
+        hours = np.ceil(hours)
+
+    if tariff['daily_cap'] is None:
+        charges = hours * rates
+    else:
+        days = np.floor(hours / 24)
+        cap = tariff['daily_cap']
+        charges = days * np.minimum(24 * rates, cap) + np.minimum((hours - 24 * days) * rates, cap)
+    return np.round(np.maximum(charges, tariff['minimum_charge']), 2)
+
+def charge(tariff, parking_timestamp, leaving_timestamp, rate):
+    """The charge for a single reservation."""
+    start_hour = datetime.fromtimestamp(parking_timestamp).hour
+    return float(compute_charges(tariff, [leaving_timestamp - parking_timestamp], [rate], [start_hour])[0])
+
+def local_time(timestamps):
+    """
+    Epoch seconds -> local wall clock seconds, as an array. The UTC offset is
+    looked up once per distinct hour, since offsets only change between hours.
+    """
+    import numpy as np
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    hours, inverse = np.unique(timestamps // 3600, return_inverse=True)
+    offsets = np.array([time.localtime(hour * 3600).tm_gmtoff for hour in hours.tolist()], dtype=np.int64)
+    return timestamps + offsets[inverse]
+
+def revenue_report(conn, tariff=None, lot_id=None, start=None, end=None):
+    """
+    Revenue per lot per local day, for the reservations that ended in
+    [start, end) (epoch seconds, both optional). `conn` must have the archive
+    attached (models/archive.py). Each row has the revenue under `tariff` and
+    what was billed at the time. Rows are sorted by day, then lot.
+    """
+    import numpy as np
+    conditions, params = ['rs.leaving_timestamp IS NOT NULL'], []
+    if lot_id is not None:
+        conditions.append('ps.lot_id = ?')
+        params.append(lot_id)
+    if start is not None:
+        conditions.append('rs.leaving_timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append('rs.leaving_timestamp < ?')
+        params.append(end)
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f'''
+        SELECT ps.lot_id, rs.parking_timestamp, rs.leaving_timestamp, rs.parking_cost_per_unit, coalesce(rs.total_cost, 0)
+        FROM all_reservations rs
+        JOIN parking_spots ps ON rs.spot_id = ps.id
+        WHERE {' AND '.join(conditions)}
+    ''', params)
+
+    groups = {} # (lot_id, day) -> [reservations, revenue, billed]
+    while True:
+        rows = cursor.fetchmany(report_batch)
+        if not rows:
+            break
+        data = np.array(rows, dtype=np.float64)
+        parking, leaving = data[:, 1].astype(np.int64), data[:, 2].astype(np.int64)
+        start_hours = local_time(parking) % 86400 // 3600
+        charges = compute_charges(tariff, leaving - parking, data[:, 3], start_hours)
+        # Days are counted from 1970-01-01 on the local calendar
+        days = local_time(leaving) // 86400
+        keys, inverse = np.unique(data[:, 0].astype(np.int64) * 100000 + days, return_inverse=True)
+        counts = np.bincount(inverse)
+        revenue = np.bincount(inverse, weights=charges)
+        billed = np.bincount(inverse, weights=data[:, 4])
+        for key, n, r, b in zip(keys.tolist(), counts.tolist(), revenue.tolist(), billed.tolist()):
+            group = groups.setdefault(divmod(key, 100000), [0, 0.0, 0.0])
+            group[0] += n
+            group[1] += r
+            group[2] += b
+
+    # Names of the lots in the report only
+    lot_ids = json.dumps(sorted({lot for lot, day in groups}))
+    names = dict(conn.execute(
+        'SELECT id, prime_location_name FROM parking_lots WHERE id IN (SELECT value FROM json_each(?))', (lot_ids,)
+    ).fetchall())
+    epoch = date(1970, 1, 1)
+    return [
+        {'lot_id': lot, 'prime_location_name': names.get(lot), 'day': (epoch + timedelta(days=day)).isoformat(),
+         'reservations': n, 'revenue': round(revenue, 2), 'billed': round(billed, 2)}
+        for (lot, day), (n, revenue, billed) in sorted(groups.items(), key=lambda item: (item[0][1], item[0][0]))
+    ]
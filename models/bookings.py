@@ -0,0 +1,92 @@
+"""
+Booking and vacating spots.
+
+Each operation runs as one BEGIN IMMEDIATE transaction (see
+models.db.run_in_write_transaction), so the checks it makes and the rows it
+writes can't interleave with a concurrent booking. The unique partial indexes
+on active reservations back this up at the database level: a user and a spot
+can never have more than one reservation without a leaving_timestamp.
+book/vacate do the work inside a transaction the caller already holds, for
+callers combining several operations (models/kiosk.py).
+"""
+import sqlite3
+from models.db import run_in_write_transaction
+from models.allocator import allocate_spot, release_spot
+from models.rollups import record_booking, record_vacate
+from models.timestamps import now
+from models.billing import charge
+from models.schedule import walkin_hold, end_checked_in
+
+def book(conn, user_id, lot_id):
+    """
+    Booking the first free spot of a lot for a user, inside the caller's
+    write transaction. Returns (status, booking) like book_spot.
+    """
+    active_booking = conn.execute(
+        'SELECT id FROM reserved_spots WHERE user_id = ? AND leaving_timestamp IS NULL', (user_id,)
+    ).fetchone()
+    if active_booking:
+        return 'active_booking', None
+
+    # Not taking a spot somebody reserved for the next hour (models/schedule.py)
+    spot = allocate_spot(conn, lot_id, held_until=now() + walkin_hold)
+    if spot is None:
+        return 'lot_full', None
+
+    booking = conn.execute('''
+        INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, parking_cost_per_unit)
+        SELECT ?, ?, ?, price_per_hour FROM parking_lots WHERE id = ?
+        RETURNING id, spot_id, parking_timestamp, parking_cost_per_unit
+    ''', (spot['id'], user_id, now(), lot_id)).fetchone()
+    record_booking(conn, user_id, lot_id, booking['parking_timestamp'])
+    return 'booked', {**dict(booking), 'lot_id': lot_id, 'spot_number': spot['spot_number']}
+
+def book_spot(conn, user_id, lot_id):
+    """
+    Booking the first free spot of a lot for a user.
+    Returns (status, booking) where status is 'booked', 'active_booking' (the user
+    is already parked somewhere) or 'lot_full', and booking is only set when booked.
+    """
+    try:
+        return run_in_write_transaction(conn, lambda conn: book(conn, user_id, lot_id))
+    except sqlite3.IntegrityError:
+        # Only possible if the user got an active reservation some other way.
+        return 'active_booking', None
+
+def vacate(conn, user_id, booking_id, tariff=None):
+    """
+    Closing a user's active booking inside the caller's write transaction.
+    Returns (status, booking) like vacate_spot.
+    """
+    # Find the active booking to ensure the user owns it
+    booking = conn.execute(
+        'SELECT * FROM reserved_spots WHERE id = ? AND user_id = ? AND leaving_timestamp IS NULL',
+        (booking_id, user_id)
+    ).fetchone()
+    if booking is None:
+        return 'not_found', None
+
+    # --- Calculate Parking Cost ---
+    leaving_timestamp = now()
+    total_cost = charge(tariff, booking['parking_timestamp'], leaving_timestamp, booking['parking_cost_per_unit'])
+
+    # 1. Mark the booking as complete with timestamps and cost
+    conn.execute(
+        'UPDATE reserved_spots SET leaving_timestamp = ?, total_cost = ? WHERE id = ?',
+        (leaving_timestamp, total_cost, booking_id)
+    )
+    # 2. Mark the parking spot as available again
+    lot_id = release_spot(conn, booking['spot_id'])
+    # 3. A reservation checked in as this booking no longer holds the spot
+    end_checked_in(conn, booking_id, leaving_timestamp)
+    record_vacate(conn, user_id, leaving_timestamp, total_cost)
+    return 'vacated', {**dict(booking), 'lot_id': lot_id, 'leaving_timestamp': leaving_timestamp, 'total_cost': total_cost}
+
+def vacate_spot(conn, user_id, booking_id, tariff=None):
+    """
+    Closing a user's active booking, billing it under `tariff` (see
+    models/billing.py) and freeing its spot, also for the rest of a
+    reservation it was checked in from (models/schedule.py). Returns
+    (status, booking) where status is 'vacated' or 'not_found'.
+    """
+    return run_in_write_transaction(conn, lambda conn: vacate(conn, user_id, booking_id, tariff))
@@ -0,0 +1,60 @@
+"""
+A small in-process cache for dashboard and chart data.
+
+Entries expire after `ttl` seconds and the least recently used entry is evicted
+once `maxsize` entries are stored. The routes that change bookings or lots
+clear the cache, the TTL only bounds how stale data written by another process
+(CLI commands, other workers) can get. Data that must not be stale is stored
+with a `version` read from the database, and is only reused while the
+database still has that version. Hit/miss counters are kept so the effect can
+be checked under load.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (expires_at, version, value), oldest use first
+        self.lock = threading.Lock()
+        self.generation = 0 # bumped by clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key, compute, version=None):
+        """
+        Returning the cached value for `key`, computing and storing it on a
+        miss. A value stored with another `version` is a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic() and entry[1] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            generation = self.generation
+
+        # Computed outside the lock so a slow query doesn't block other keys.
+        value = compute()
+        with self.lock:
+            # Not storing a value computed before the cache was cleared.
+            if generation != self.generation:
+                return value
+            self.entries[key] = (time.monotonic() + self.ttl, version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                    'maxsize': self.maxsize, 'ttl': self.ttl}
@@ -1,24 +1,95 @@
+import argparse
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
+import time
+from werkzeug.security import generate_password_hash
+from models.migrations import migrate, is_current
 
 # Defining path of my database file
 database = 'parking_app.db'
 
-def init_db():
+# Seconds a connection waits on a locked database before giving up.
+busy_timeout = 10
+
+# Pragmas applied to every new connection. WAL lets readers run alongside the
+# single writer, synchronous=NORMAL is safe under WAL and avoids an fsync per
+# commit, and foreign_keys turns on the constraints declared in the schema.
+connection_pragmas = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA cache_size = -16000',   # ~16 MB page cache per connection
+    'PRAGMA mmap_size = 268435456', # map up to 256 MB of the file
+    'PRAGMA temp_store = MEMORY',
+)
+
+def connect(path=None, factory=sqlite3.Connection):
+    """Opening a tuned connection to the database (defaults to `database`)."""
+    conn = sqlite3.connect(path or database, timeout=busy_timeout, factory=factory)
+    conn.row_factory = sqlite3.Row # It allows me to access tables columns by name
+    for pragma in connection_pragmas:
+        conn.execute(pragma)
+    return conn
+
+# How many times a write transaction is attempted when the database stays locked
+# for longer than busy_timeout, and the base delay between attempts (seconds).
+write_attempts = 5
+write_retry_delay = 0.05
+
+def run_in_write_transaction(conn, work):
     """
-    Initializing the SQLite database:
+    Running work(conn) inside a BEGIN IMMEDIATE transaction and committing it.
+    The write lock is taken up front, so whatever `work` reads can't be changed
+    by another writer before it writes. Starting the transaction is retried a
+    few times with backoff while the database is busy; any error in `work`
+    rolls the transaction back and is re-raised.
+    """
+    for attempt in range(1, write_attempts + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            break
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == write_attempts:
+                raise
+            time.sleep(write_retry_delay * 2 ** (attempt - 1))
+    try:
+        result = work(conn)
+        conn.commit()
+        return result
+    except BaseException:
+        conn.rollback()
+        raise
+
+# Default admin account, created by init_db when missing
+admin_username = 'admin_123'
+admin_password_raw = 'admin#0123' # Default password for the admin
+
+def is_initialized(conn):
+    """True when the schema is current and the admin exists, so init_db has nothing to do."""
+    return is_current(conn) and conn.execute(
+        'SELECT 1 FROM users WHERE username = ?', (admin_username,)).fetchone() is not None
+
+def init_db(path=None):
+    """
+    Initializing the SQLite database (`path` defaults to `database`):
+    - Returning right away, without any DDL, when the database is already current.
     - Connecting to the databiase.
     - Creating 'users', 'parking_lots', 'parking_spots', and 'reserved_spots' tables if they don't exist.
+      These are the original (version 0) tables, the migrations evolve them.
+    - Applying pending schema migrations (indexes etc., see models/migrations.py).
     - Inserts a default 'admin' user if one doesn't already exist.
     """
     conn = None # Initialize conn to None
     try:
         # Connecting to the SQLite database. If the file doesn't exist, it will be created.
-        conn = sqlite3.connect(database)
+        conn = connect(path)
+        # Fast path for every start after the first: one query, no DDL, no output.
+        if is_initialized(conn):
+            return
+
         cursor = conn.cursor()
 
-        print(f"Connected to database: {database}")
+        print(f"Connected to database: {path or database}")
 
         # 1. Now creating users table which stores user credentials and roles.
         cursor.execute('''
@@ -74,15 +145,16 @@ def init_db():
         ''')
         print("Table 'reserved_spots' ensured.")
 
-        # Insert default 'admin' user if not exists.
-        admin_username = 'admin_123'
-        admin_password_raw = 'admin#0123' # Default password for the admin
-        admin_password_hash = generate_password_hash(admin_password_raw)
+        # Bringing the schema up to the latest version.
+        migrate(conn)
 
+        # Insert default 'admin' user if not exists.
         cursor.execute("SELECT id FROM users WHERE username = ?", (admin_username,))
         admin_exists = cursor.fetchone()
 
         if not admin_exists:
+            # Only hashed when the admin is created, hashing is slow on purpose.
+            admin_password_hash = generate_password_hash(admin_password_raw)
             cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
                            (admin_username, admin_password_hash, 'admin'))
             print(f"Default admin user '{admin_username}' created with password '{admin_password_raw}'.")
@@ -102,11 +174,17 @@ def init_db():
             conn.close() # Always close the connection
 
 if __name__ == '__main__':
-    # This block runs only when db.py is executed directly
-    # You might want to delete the old database file for a clean start during development
-    if os.path.exists(database):
+    # This block runs only when db.py is executed directly (python -m models.db)
+    parser = argparse.ArgumentParser(description='Creating or upgrading the database.')
+    parser.add_argument('--reset', action='store_true',
+                        help='delete the existing database first, for a clean start during development')
+    args = parser.parse_args()
+    if args.reset and os.path.exists(database):
         os.remove(database)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
         print(f"Existing database '{database}' removed for a clean start.")
-    
+
     init_db()
 
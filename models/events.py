@@ -0,0 +1,50 @@
+"""
+In-process event bus for live occupancy updates.
+
+Routes that change a lot publish its new occupancy, and every connected
+Server-Sent Events client has its own bounded queue. A client that falls
+behind loses its oldest events rather than growing its queue. Each event
+carries the lot's absolute counts, so the newer events it still gets are
+enough to show the right numbers.
+
+A connected client holds a server thread for as long as it stays, so the
+number of clients can be capped (`max_subscribers`); subscribe() turns
+clients away past it.
+"""
+import queue
+import threading
+
+class EventBus:
+    def __init__(self, queue_size=100, max_subscribers=None):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers # None for no limit
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        """A new client's queue, None when `max_subscribers` are connected."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            if self.max_subscribers is not None and len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(event)
+                    break
+                except queue.Full:
+                    # Dropping the oldest event of a slow client to make room.
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
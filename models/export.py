@@ -0,0 +1,96 @@
+"""
+Streaming export of reservation history as CSV or NDJSON.
+
+Rows are read from the database in fetchmany() batches and written out as they
+come, so memory stays flat however many rows are exported and the first bytes
+go out before the query has finished.
+"""
+import csv
+import io
+import json
+from models.db import connect
+from models.archive import attach_archive
+from models.timestamps import to_display
+
+columns = ['id', 'username', 'prime_location_name', 'spot_number', 'parking_time', 'leaving_time',
+           'parking_cost_per_unit', 'total_cost']
+
+batch_size = 1000
+
+def reservation_query(user_id=None, lot_id=None, start=None, end=None):
+    """
+    Building the export query and its parameters from the optional filters.
+    It reads all_reservations, so the archived history is exported too.
+    """
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append('rs.user_id = ?')
+        params.append(user_id)
+    if lot_id is not None:
+        # The unary + keeps SQLite from starting at the lot's spots, which
+        # needs a temp B-tree to sort all their rows before the first one is
+        # sent. Read in parking_timestamp order from the index, the rows
+        # stream and the filter is checked on each.
+        conditions.append('+ps.lot_id = ?')
+        params.append(lot_id)
+    if start is not None:
+        conditions.append('rs.parking_timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append('rs.parking_timestamp < ?')
+        params.append(end)
+
+    query = f'''
+        SELECT rs.id, u.username, pl.prime_location_name, ps.spot_number,
+               rs.parking_timestamp, rs.leaving_timestamp, rs.parking_cost_per_unit, rs.total_cost
+        FROM all_reservations rs
+        JOIN parking_spots ps ON rs.spot_id = ps.id
+        JOIN parking_lots pl ON ps.lot_id = pl.id
+        JOIN users u ON rs.user_id = u.id
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY rs.parking_timestamp, rs.id
+    '''
+    return query, params
+
+def stream_rows(path, query, params):
+    """Yielding the query's rows in batches from a connection of its own."""
+    conn = connect(path)
+    try:
+        attach_archive(conn)
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield [
+                    row['id'], row['username'], row['prime_location_name'], row['spot_number'],
+                    to_display(row['parking_timestamp']), to_display(row['leaving_timestamp']),
+                    row['parking_cost_per_unit'], row['total_cost'],
+                ]
+    finally:
+        conn.close()
+
+def as_csv(rows):
+    """Turning rows into CSV text chunks, one chunk per batch of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def as_ndjson(rows):
+    """Turning rows into newline delimited JSON chunks, one chunk per batch of rows."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row))))
+        if len(lines) == batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
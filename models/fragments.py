@@ -0,0 +1,57 @@
+"""
+Rendered HTML of dashboard rows, cached per lot.
+
+Each entry is keyed by the row template and lot id, and remembers the lot
+`version` it was rendered at (migration 8 bumps it on every write to the
+lot). A page render reuses the rows of unchanged lots and renders only the
+stale ones. Since the version comes from the database, a row is never reused
+after a change made by another process, and no invalidation is needed.
+"""
+import threading
+from collections import OrderedDict
+
+class FragmentCache:
+    def __init__(self, maxsize=20000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict() # (name, lot_id) -> (version, html), oldest use first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, name, lots, render_stale):
+        """
+        The fragments of `lots` (dicts with id and version), in order.
+        render_stale(stale_lots) renders the lots missing from the cache or
+        cached at another version, and returns {lot id: html}.
+        """
+        fragments, stale = {}, []
+        with self.lock:
+            for lot in lots:
+                entry = self.entries.get((name, lot['id']))
+                if entry and entry[0] == lot['version']:
+                    self.entries.move_to_end((name, lot['id']))
+                    fragments[lot['id']] = entry[1]
+                else:
+                    stale.append(lot)
+            self.hits += len(lots) - len(stale)
+            self.misses += len(stale)
+
+        # Rendered outside the lock, a row rendered twice by concurrent requests is harmless
+        if stale:
+            rendered = render_stale(stale)
+            with self.lock:
+                for lot in stale:
+                    self.entries[(name, lot['id'])] = (lot['version'], rendered[lot['id']])
+                    self.entries.move_to_end((name, lot['id']))
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            fragments.update(rendered)
+        return [fragments[lot['id']] for lot in lots]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
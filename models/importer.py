@@ -0,0 +1,201 @@
+"""
+Bulk CSV import of parking lots and historical reservations.
+
+Files are parsed row by row (never loaded whole), each row is validated and
+the good ones are written in large batches. Rejected rows are reported with
+their line number and reason.
+
+Lots:          prime_location_name, price_per_hour, maximum_number_of_spots, address, pincode
+Reservations:  username, prime_location_name, spot_number, parking_time, leaving_time,
+               parking_cost_per_unit, total_cost
+
+The reservation columns match the export (models/export.py), so an export can
+be imported elsewhere. Times are local 'YYYY-MM-DD HH:MM[:SS]' or epoch
+seconds. Only completed reservations can be imported. Reservations are first
+loaded into a temporary staging table; references to users, lots and spots
+are then resolved with a single set-based INSERT ... SELECT, and the
+imported rows are added to the chart rollups the same way. When the import
+is a large share of reserved_spots, its secondary indexes are dropped for
+that insert and rebuilt afterwards; a small import updates them in place, as
+rebuilding would cost time in proportion to the whole table.
+"""
+import csv
+from datetime import datetime
+from models.db import run_in_write_transaction
+from models.allocator import add_spots
+from models.rollups import record_history
+
+batch_size = 10000
+
+# Rejected rows kept for the report; the rest are only counted.
+max_reported = 1000
+
+# Non-unique indexes rebuilt after a large reservation import instead of
+# being updated row by row. The unique partial indexes only cover active
+# reservations, which are never imported, so they stay in place.
+deferred_indexes = ['idx_reserved_spots_spot', 'idx_reserved_spots_user_time', 'idx_reserved_spots_parking_time']
+
+# Imports of at least this share of the rows already in reserved_spots defer
+# the indexes. Measured on a 1M-row table, rebuilding wins from about half.
+defer_share = 0.5
+
+# The staged rows whose user, lot and spot exist, with their ids
+resolved = '''
+    SELECT ir.line, ps.id AS spot_id, u.id AS user_id, ps.lot_id, ir.parking_timestamp, ir.leaving_timestamp,
+           ir.parking_cost_per_unit, ir.total_cost
+    FROM temp.import_reservations ir
+    JOIN users u ON u.username = ir.username
+    JOIN parking_lots pl ON pl.prime_location_name = ir.lot_name
+    JOIN parking_spots ps ON ps.lot_id = pl.id AND ps.spot_number = ir.spot_number
+'''
+
+def new_report():
+    # lot_ids: the lots created, for the caller to announce
+    return {'imported': 0, 'rejected': 0, 'errors': [], 'lot_ids': []}
+
+def reject(report, line, reason):
+    report['rejected'] += 1
+    if len(report['errors']) < max_reported:
+        report['errors'].append((line, reason))
+
+def parse_time(value):
+    """Local 'YYYY-MM-DD HH:MM[:SS]' or epoch seconds -> epoch seconds."""
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+def missing_columns(reader, required):
+    return [name for name in required if name not in (reader.fieldnames or [])]
+
+def import_lots(conn, lines):
+    """Importing parking lots (and generating their spots) from CSV text lines."""
+    report = new_report()
+    reader = csv.DictReader(lines)
+    missing = missing_columns(reader, ['prime_location_name', 'price_per_hour', 'maximum_number_of_spots'])
+    if missing:
+        reject(report, 1, f"missing columns: {', '.join(missing)}")
+        return report
+
+    def insert_batch(conn, batch):
+        for line, name, price, spots, address, pincode in batch:
+            lot = conn.execute('''
+                INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots, address, pincode)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (prime_location_name) DO NOTHING
+                RETURNING id
+            ''', (name, price, spots, address, pincode)).fetchone()
+            if lot is None:
+                reject(report, line, f'lot "{name}" already exists')
+                continue
+            add_spots(conn, lot['id'], spots)
+            report['imported'] += 1
+            report['lot_ids'].append(lot['id'])
+
+    batch = []
+    for line, row in enumerate(reader, start=2):
+        name = (row.get('prime_location_name') or '').strip()
+        try:
+            price = float(row['price_per_hour'])
+            spots = int(row['maximum_number_of_spots'])
+        except (TypeError, ValueError):
+            reject(report, line, 'price_per_hour and maximum_number_of_spots must be numbers')
+            continue
+        if not name or price < 0 or spots < 1:
+            reject(report, line, 'a name, a price >= 0 and at least one spot are required')
+            continue
+        batch.append((line, name, price, spots, (row.get('address') or '').strip(), (row.get('pincode') or '').strip()))
+        if len(batch) >= batch_size // 10: # lots carry their spots, so smaller batches
+            run_in_write_transaction(conn, lambda conn: insert_batch(conn, batch))
+            batch = []
+    if batch:
+        run_in_write_transaction(conn, lambda conn: insert_batch(conn, batch))
+    return report
+
+def import_reservations(conn, lines):
+    """Importing completed reservations from CSV text lines."""
+    report = new_report()
+    reader = csv.DictReader(lines)
+    missing = missing_columns(reader, ['username', 'prime_location_name', 'spot_number', 'parking_time',
+                                       'leaving_time', 'parking_cost_per_unit', 'total_cost'])
+    if missing:
+        reject(report, 1, f"missing columns: {', '.join(missing)}")
+        return report
+
+    conn.execute('DROP TABLE IF EXISTS temp.import_reservations')
+    conn.execute('''
+        CREATE TEMP TABLE import_reservations (
+            line INTEGER PRIMARY KEY,
+            username TEXT, lot_name TEXT, spot_number INTEGER,
+            parking_timestamp INTEGER, leaving_timestamp INTEGER,
+            parking_cost_per_unit REAL, total_cost REAL
+        )
+    ''')
+    try:
+        # 1. Parsing and checking each row on its own, loading the good ones into staging.
+        def stage(conn, batch):
+            conn.executemany('INSERT INTO temp.import_reservations VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+
+        batch = []
+        for line, row in enumerate(reader, start=2):
+            try:
+                parking, leaving = parse_time(row['parking_time']), parse_time(row['leaving_time'])
+                values = (line, row['username'].strip(), row['prime_location_name'].strip(), int(row['spot_number']),
+                          parking, leaving, float(row['parking_cost_per_unit']), float(row['total_cost']))
+            except (AttributeError, TypeError, ValueError):
+                reject(report, line, 'bad number or time, or missing leaving_time')
+                continue
+            if leaving < parking:
+                reject(report, line, 'leaving_time is before parking_time')
+                continue
+            batch.append(values)
+            if len(batch) >= batch_size:
+                run_in_write_transaction(conn, lambda conn: stage(conn, batch))
+                batch = []
+        if batch:
+            run_in_write_transaction(conn, lambda conn: stage(conn, batch))
+
+        # 2. Resolving users and spots for all staged rows at once.
+        def load(conn):
+            unresolved = conn.execute('''
+                SELECT ir.line, u.id IS NULL as no_user, pl.id IS NULL as no_lot
+                FROM temp.import_reservations ir
+                LEFT JOIN users u ON u.username = ir.username
+                LEFT JOIN parking_lots pl ON pl.prime_location_name = ir.lot_name
+                LEFT JOIN parking_spots ps ON ps.lot_id = pl.id AND ps.spot_number = ir.spot_number
+                WHERE ps.id IS NULL OR u.id IS NULL
+                ORDER BY ir.line
+            ''')
+            for row in unresolved:
+                reason = 'unknown user' if row['no_user'] else 'unknown lot' if row['no_lot'] else 'unknown spot'
+                reject(report, row['line'], reason)
+
+            # max(id) is a cheap estimate of the table size, count(*) would read a whole index
+            staged = conn.execute('SELECT count(*) FROM temp.import_reservations').fetchone()[0]
+            existing = conn.execute('SELECT max(id) FROM reserved_spots').fetchone()[0] or 0
+            saved = []
+            if staged >= existing * defer_share:
+                saved = [row['sql'] for row in conn.execute(
+                    f"SELECT sql FROM sqlite_master WHERE type = 'index' AND name IN ({','.join('?' * len(deferred_indexes))})",
+                    deferred_indexes
+                )]
+                for name in deferred_indexes:
+                    conn.execute(f'DROP INDEX IF EXISTS {name}')
+            report['imported'] = conn.execute(f'''
+                INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost_per_unit, total_cost)
+                SELECT spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost_per_unit, total_cost
+                FROM ({resolved})
+                ORDER BY line
+            ''').rowcount
+            for sql in saved:
+                conn.execute(sql)
+
+            # Only the imported rows are added to the chart rollups
+            record_history(conn, resolved)
+
+        run_in_write_transaction(conn, load)
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.import_reservations')
+
+    report['errors'].sort()
+    return report
@@ -0,0 +1,119 @@
+"""
+Gate kiosk events behind the /api/v1 JSON API.
+
+An event books a spot for a user at an entry gate, or vacates the user's
+active booking at an exit gate. Events are handled in batches, one write
+transaction per batch, and each event runs inside its own SAVEPOINT. If one
+event fails, only its own changes are rolled back and the rest of the batch
+still commits.
+
+An event may carry an idempotency key chosen by the gate. The outcome of a
+keyed event is stored in idempotency_keys in the same transaction as the
+booking itself. A gate retrying after a timeout gets the stored outcome
+back, instead of booking or billing twice. A key used again with a different
+request is refused. Keys are forgotten after `key_ttl` seconds.
+
+Only outcomes the same request would get again are stored: a booking or a
+vacate done, and the events refused for what they are. A 409 (the lot is
+full, the user already parked) depends on the moment, it is not kept, and a
+retry with the same key after the spot frees up is run again.
+"""
+import hashlib
+import json
+import sqlite3
+from models.db import run_in_write_transaction
+from models.bookings import book, vacate
+from models.timestamps import now
+
+key_ttl = 86400
+stored_status_codes = {200, 201, 400, 404, 422} # outcomes replayed for a known key
+
+def request_hash(event):
+    fields = {name: value for name, value in event.items() if name != 'key'}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+def is_id(value):
+    # A JSON integer (booleans are ints in Python) SQLite can store
+    return type(value) is int and 0 < value < 2 ** 63
+
+def run_event(conn, event, tariff):
+    """Booking or vacating for one event. Returns (status_code, body)."""
+    kind = event.get('type')
+    if kind not in ('book', 'vacate'):
+        return 400, {'error': 'unknown_type'}
+    # The ids are passed to SQLite, anything else is refused here. Exit gates
+    # may leave the booking out, the user's active one is vacated.
+    field = 'lot_id' if kind == 'book' else 'booking_id'
+    if not is_id(event.get(field)) and not (kind == 'vacate' and event.get(field) is None):
+        return 400, {'error': 'bad_event'}
+
+    user = conn.execute("SELECT id FROM users WHERE username = ? AND role = 'user'",
+                        (str(event.get('username', '')),)).fetchone()
+    if user is None:
+        return 404, {'error': 'unknown_user'}
+
+    if kind == 'book':
+        lot_id = event['lot_id']
+        if conn.execute('SELECT 1 FROM parking_lots WHERE id = ?', (lot_id,)).fetchone() is None:
+            return 404, {'error': 'unknown_lot'}
+        status, booking = book(conn, user['id'], lot_id)
+        if status != 'booked':
+            return 409, {'error': status}
+        return 201, {'status': 'booked', 'booking_id': booking['id'], 'lot_id': lot_id,
+                     'spot_number': booking['spot_number'], 'parking_timestamp': booking['parking_timestamp']}
+
+    booking_id = event.get('booking_id')
+    if booking_id is None:
+        active = conn.execute('SELECT id FROM reserved_spots WHERE user_id = ? AND leaving_timestamp IS NULL',
+                              (user['id'],)).fetchone()
+        booking_id = active['id'] if active else None
+    status, booking = vacate(conn, user['id'], booking_id, tariff)
+    if status != 'vacated':
+        return 404, {'error': 'no_active_booking'}
+    return 200, {'status': 'vacated', 'booking_id': booking['id'], 'lot_id': booking['lot_id'],
+                 'total_cost': booking['total_cost'], 'leaving_timestamp': booking['leaving_timestamp']}
+
+def apply_event(conn, gate, event, tariff):
+    """One event inside its own savepoint, replaying the stored outcome of a known key."""
+    if not isinstance(event, dict):
+        return 400, {'error': 'bad_event'}
+    key = event.get('key')
+    fingerprint = request_hash(event)
+    if key is not None:
+        stored = conn.execute('''
+            SELECT request_hash, status_code, response FROM idempotency_keys
+            WHERE gate = ? AND key = ? AND created_at >= ?
+        ''', (gate, str(key), now() - key_ttl)).fetchone()
+        if stored is not None:
+            if stored['request_hash'] != fingerprint:
+                return 422, {'error': 'key_reused'}
+            return stored['status_code'], {**json.loads(stored['response']), 'replayed': True}
+
+    conn.execute('SAVEPOINT event')
+    try:
+        status_code, body = run_event(conn, event, tariff)
+    except sqlite3.IntegrityError:
+        # A unique active reservation index refused the booking
+        conn.execute('ROLLBACK TO event')
+        status_code, body = 409, {'error': 'active_booking'}
+    except BaseException:
+        conn.execute('ROLLBACK TO event')
+        conn.execute('RELEASE event')
+        raise
+    if key is not None and status_code in stored_status_codes:
+        conn.execute('''
+            INSERT OR REPLACE INTO idempotency_keys (gate, key, request_hash, status_code, response, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (gate, str(key), fingerprint, status_code, json.dumps(body), now()))
+    conn.execute('RELEASE event')
+    return status_code, body
+
+def process_events(conn, gate, events, tariff=None):
+    """
+    Applying a list of events from `gate` in one transaction.
+    Returns a (status_code, body) per event.
+    """
+    def work(conn):
+        conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (now() - key_ttl,))
+        return [apply_event(conn, gate, event, tariff) for event in events]
+    return run_in_write_transaction(conn, work)
@@ -0,0 +1,155 @@
+"""
+Request, SQL and template instrumentation, exposed in the Prometheus text format.
+
+Each request is timed per endpoint, and the statements run on the request's
+connection are counted and timed by TimedConnection. Statements slower than
+the configured threshold go to the 'parking.slowquery' log. Everything is kept
+in process (per worker) as cumulative histograms and counters.
+
+Statement times cover execute() only. SQLite computes the first row there,
+and the remaining rows of a big SELECT are read later by fetchall().
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+statement_buckets = (1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+slow_query_log = logging.getLogger('parking.slowquery')
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.record(sql, time.perf_counter() - start)
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A connection counting and timing its statements. Connection.execute()
+    doesn't go through cursor(), so both are overridden.
+    """
+    slow_query_seconds = None # set by the owner to log slow statements
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = 0
+        self.seconds = 0.0
+        self.slow_queries = 0
+
+    def record(self, sql, seconds):
+        self.statements += 1
+        self.seconds += seconds
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            self.slow_queries += 1
+            slow_query_log.warning('%.1f ms: %s', seconds * 1000, ' '.join(sql.split()))
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def format_labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=latency_buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {} # label values -> [count per bucket..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{labels}}} {values[-1]}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {} # label values -> total
+        self.lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series = dict(self.series)
+        for label_values, total in sorted(series.items()):
+            lines.append(f'{self.name}{{{format_labels(self.labels, label_values)}}} {total}')
+        return lines
+
+class RequestMetrics:
+    def __init__(self):
+        self.requests = Counter('http_requests_total', 'Requests by endpoint and status.', ('endpoint', 'status'))
+        self.latency = Histogram('http_request_duration_seconds', 'Time to build the response.', ('endpoint',))
+        self.statements = Histogram('db_statements_per_request', 'SQL statements run per request.',
+                                    ('endpoint',), statement_buckets)
+        self.sql_time = Histogram('db_time_per_request_seconds', 'Time spent in SQL per request.', ('endpoint',))
+        self.slow_queries = Counter('db_slow_queries_total', 'Statements over the slow query threshold.', ('endpoint',))
+        self.render_time = Histogram('template_render_duration_seconds', 'Time to render a template.', ('template',))
+
+    def observe_request(self, endpoint, status, seconds, conn=None):
+        """Recording a finished request, with the statements of its connection if it had one."""
+        self.requests.inc(1, endpoint, status)
+        self.latency.observe(seconds, endpoint)
+        if isinstance(conn, TimedConnection):
+            self.statements.observe(conn.statements, endpoint)
+            self.sql_time.observe(conn.seconds, endpoint)
+            if conn.slow_queries:
+                self.slow_queries.inc(conn.slow_queries, endpoint)
+
+    def observe_render(self, template, seconds):
+        self.render_time.observe(seconds, template)
+
+    def render(self, extra=()):
+        """The Prometheus text exposition, followed by extra (name, type, help, value) samples."""
+        lines = []
+        for metric in (self.requests, self.latency, self.statements, self.sql_time, self.slow_queries, self.render_time):
+            lines.extend(metric.render())
+        for name, kind, help, value in extra:
+            lines.extend([f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {value}'])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,256 @@
+"""
+Versioned schema migrations.
+
+The schema version is stored in the database itself with PRAGMA user_version.
+Each entry of `migrations` upgrades the schema by one version and is a list of
+steps, either SQL statements or functions taking the connection. Migrations
+are applied in order, each inside its own transaction, so running `migrate`
+again on an up to date database does nothing.
+
+A checksum of the migration steps is stored as PRAGMA application_id, so
+startup can tell with one query that a database needs no work (is_current),
+and notice a migration that was edited in place instead of added.
+"""
+import zlib
+from models.allocator import rebuild_counters
+from models.rollups import rebuild_rollups
+
+migrations = [
+    # 1. Indexes for the access paths used by the routes.
+    [
+        # Active reservation of a user (bookspot, userdashboard), and on a spot
+        # (admindashboard). Unique: at most one active reservation per user and
+        # per spot (models/bookings.py).
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_reserved_spots_active_user
+           ON reserved_spots(user_id) WHERE leaving_timestamp IS NULL''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_reserved_spots_active_spot
+           ON reserved_spots(spot_id) WHERE leaving_timestamp IS NULL''',
+        # Every reservation of a spot, needed by the ON DELETE RESTRICT check
+        # when spots are deleted (deletelot).
+        '''CREATE INDEX IF NOT EXISTS idx_reserved_spots_spot
+           ON reserved_spots(spot_id)''',
+        # A user's reservations ordered by time (userhistory, user charts).
+        '''CREATE INDEX IF NOT EXISTS idx_reserved_spots_user_time
+           ON reserved_spots(user_id, parking_timestamp)''',
+        # Bookings started in a time window (peakhours).
+        '''CREATE INDEX IF NOT EXISTS idx_reserved_spots_parking_time
+           ON reserved_spots(parking_timestamp)''',
+        # Spots of a lot by status (bookspot, deletelot, occupancy counts).
+        '''CREATE INDEX IF NOT EXISTS idx_parking_spots_lot_status
+           ON parking_spots(lot_id, status, spot_number)''',
+    ],
+    # 2. Per-lot occupancy counters and the free spot index (models/allocator.py).
+    [
+        'ALTER TABLE parking_lots ADD COLUMN available_spots INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE parking_lots ADD COLUMN occupied_spots INTEGER NOT NULL DEFAULT 0',
+        """CREATE INDEX IF NOT EXISTS idx_parking_spots_free
+           ON parking_spots(lot_id, spot_number) WHERE status = 'available'""",
+        rebuild_counters,
+    ],
+    # 3. Rollup tables behind the chart APIs (models/rollups.py).
+    [
+        '''CREATE TABLE hourly_bookings (
+               hour TEXT NOT NULL,      -- 'YYYY-MM-DD HH:00'
+               lot_id INTEGER NOT NULL,
+               bookings INTEGER NOT NULL,
+               PRIMARY KEY (hour, lot_id)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE user_monthly_cost (
+               user_id INTEGER NOT NULL,
+               month TEXT NOT NULL,     -- 'YYYY-MM'
+               total_cost REAL NOT NULL,
+               PRIMARY KEY (user_id, month)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE user_lot_bookings (
+               user_id INTEGER NOT NULL,
+               lot_id INTEGER NOT NULL,
+               bookings INTEGER NOT NULL,
+               PRIMARY KEY (user_id, lot_id)
+           ) WITHOUT ROWID''',
+        # Filled by migration 4, once timestamps are integers.
+    ],
+    # 4. Integer epoch timestamps (models/timestamps.py). The TEXT local times
+    #    'YYYY-MM-DD HH:MM' are converted to epoch seconds by rebuilding the
+    #    table, then the hourly rollup is rebuilt keyed by epoch hour.
+    [
+        '''CREATE TABLE reserved_spots_new (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               spot_id INTEGER NOT NULL,
+               user_id INTEGER NOT NULL,
+               parking_timestamp INTEGER NOT NULL, -- Unix epoch seconds
+               leaving_timestamp INTEGER,          -- NULLable, updated when vehicle leaves
+               parking_cost_per_unit REAL NOT NULL,
+               total_cost REAL,
+               FOREIGN KEY (spot_id) REFERENCES parking_spots(id) ON DELETE RESTRICT,
+               FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE RESTRICT
+           )''',
+        '''INSERT INTO reserved_spots_new
+           SELECT id, spot_id, user_id,
+                  CAST(strftime('%s', parking_timestamp, 'utc') AS INTEGER),
+                  CAST(strftime('%s', leaving_timestamp, 'utc') AS INTEGER),
+                  parking_cost_per_unit, total_cost
+           FROM reserved_spots''',
+        'DROP TABLE reserved_spots',
+        'ALTER TABLE reserved_spots_new RENAME TO reserved_spots',
+        '''CREATE UNIQUE INDEX idx_reserved_spots_active_user
+           ON reserved_spots(user_id) WHERE leaving_timestamp IS NULL''',
+        '''CREATE UNIQUE INDEX idx_reserved_spots_active_spot
+           ON reserved_spots(spot_id) WHERE leaving_timestamp IS NULL''',
+        'CREATE INDEX idx_reserved_spots_spot ON reserved_spots(spot_id)',
+        'CREATE INDEX idx_reserved_spots_user_time ON reserved_spots(user_id, parking_timestamp)',
+        'CREATE INDEX idx_reserved_spots_parking_time ON reserved_spots(parking_timestamp)',
+        'DROP TABLE hourly_bookings',
+        '''CREATE TABLE hourly_bookings (
+               hour INTEGER NOT NULL,   -- epoch seconds of the local hour start
+               lot_id INTEGER NOT NULL,
+               bookings INTEGER NOT NULL,
+               PRIMARY KEY (hour, lot_id)
+           ) WITHOUT ROWID''',
+        rebuild_rollups,
+    ],
+    # 5. Registered users by name, for the paginated user list and prefix search.
+    [
+        'CREATE INDEX idx_users_role_username ON users(role, username)',
+    ],
+    # 6. Outcomes of keyed gate events, replayed on retries (models/kiosk.py).
+    [
+        '''CREATE TABLE idempotency_keys (
+               gate TEXT NOT NULL,
+               key TEXT NOT NULL,
+               request_hash TEXT NOT NULL,  -- the same key must come with the same request
+               status_code INTEGER NOT NULL,
+               response TEXT NOT NULL,      -- JSON body sent back
+               created_at INTEGER NOT NULL, -- epoch seconds
+               PRIMARY KEY (gate, key)
+           ) WITHOUT ROWID''',
+        'CREATE INDEX idx_idempotency_keys_created ON idempotency_keys(created_at)',
+    ],
+    # 7. Lot search (search_lots in app.py), results ordered by name without case.
+    [
+        # Name prefix, and the order of every result page.
+        '''CREATE INDEX idx_parking_lots_name_nocase
+           ON parking_lots(prime_location_name COLLATE NOCASE, id)''',
+        # Lots with free spots only. Rows enter and leave it as lots fill up and empty.
+        '''CREATE INDEX idx_parking_lots_has_free
+           ON parking_lots(prime_location_name COLLATE NOCASE, id) WHERE available_spots > 0''',
+        # Pincode prefix.
+        'CREATE INDEX idx_parking_lots_pincode ON parking_lots(pincode)',
+        # Price range.
+        'CREATE INDEX idx_parking_lots_price ON parking_lots(price_per_hour)',
+    ],
+    # 8. Lot versions, keying the cached dashboard rows of each lot
+    #    (models/fragments.py), and one version for all lots, bumped by any write
+    #    to the lot listing, keying the cached lot lists and pages of every
+    #    process (models/cache.py).
+    [
+        'ALTER TABLE parking_lots ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+        # Bumped by any write to what a lot row shows. Occupancy changes with
+        # every booking and vacate (models/allocator.py), so do the lot's
+        # occupied spots. A trigger also covers the CLI and other processes.
+        '''CREATE TRIGGER parking_lots_version
+           AFTER UPDATE OF prime_location_name, price_per_hour, address, pincode,
+                           maximum_number_of_spots, occupied_spots, available_spots ON parking_lots
+           BEGIN
+               UPDATE parking_lots SET version = version + 1 WHERE id = NEW.id;
+           END''',
+        'CREATE TABLE lots_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)',
+        'INSERT INTO lots_version (id, version) VALUES (1, 0)',
+        '''CREATE TRIGGER lots_version_update AFTER UPDATE OF version ON parking_lots
+           BEGIN
+               UPDATE lots_version SET version = version + 1 WHERE id = 1;
+           END''',
+        '''CREATE TRIGGER lots_version_insert AFTER INSERT ON parking_lots
+           BEGIN
+               UPDATE lots_version SET version = version + 1 WHERE id = 1;
+           END''',
+        '''CREATE TRIGGER lots_version_delete AFTER DELETE ON parking_lots
+           BEGIN
+               UPDATE lots_version SET version = version + 1 WHERE id = 1;
+           END''',
+    ],
+    # 9. Spots held for future windows (models/schedule.py).
+    [
+        '''CREATE TABLE scheduled_reservations (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               lot_id INTEGER NOT NULL,
+               spot_id INTEGER NOT NULL,
+               user_id INTEGER NOT NULL,
+               start_time INTEGER NOT NULL,         -- epoch seconds
+               end_time INTEGER NOT NULL,           -- epoch seconds, exclusive
+               parking_cost_per_unit REAL NOT NULL, -- price of the lot when booked
+               status TEXT NOT NULL DEFAULT 'scheduled', -- 'scheduled', 'checked_in' or 'cancelled'
+               booking_id INTEGER,                  -- reserved_spots row once checked in (it may be archived)
+               created_at INTEGER NOT NULL,
+               changed_version INTEGER NOT NULL DEFAULT 0, -- schedule version of the lot when its window last changed
+               FOREIGN KEY (lot_id) REFERENCES parking_lots(id) ON DELETE RESTRICT,
+               FOREIGN KEY (spot_id) REFERENCES parking_spots(id) ON DELETE RESTRICT,
+               FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE RESTRICT
+           )''',
+        # Held windows of a spot by start. They never overlap, so the last one
+        # starting before a time tells whether the spot is held then. Full
+        # indexes, not partial ones on the held windows: the foreign key checks
+        # of deleting spots or lots can't use partial ones. Cancelled windows
+        # are few, the held window lookups skip them.
+        'CREATE INDEX idx_scheduled_reservations_spot ON scheduled_reservations(spot_id, start_time)',
+        # Held windows of a lot not over yet, loaded into the in-memory index.
+        'CREATE INDEX idx_scheduled_reservations_lot ON scheduled_reservations(lot_id, end_time)',
+        # A user's reservations by time (user dashboard, overlapping windows).
+        'CREATE INDEX idx_scheduled_reservations_user ON scheduled_reservations(user_id, start_time)',
+        # The reservation a booking was checked in from, ended with the booking
+        # when it is vacated early.
+        'CREATE INDEX idx_scheduled_reservations_booking ON scheduled_reservations(booking_id)',
+        # Bumped by every change to the held windows of a lot, telling each
+        # process its in-memory copy is stale. The reservations changed are
+        # stamped with it, so a copy is brought up to date without reloading it.
+        'ALTER TABLE parking_lots ADD COLUMN schedule_version INTEGER NOT NULL DEFAULT 0',
+        'CREATE INDEX idx_scheduled_reservations_changed ON scheduled_reservations(lot_id, changed_version)',
+        # Resizing a lot changes its spots, only that reloads a copy whole
+        'ALTER TABLE parking_lots ADD COLUMN spots_version INTEGER NOT NULL DEFAULT 0',
+        '''CREATE TRIGGER parking_lots_spots_version
+           AFTER UPDATE OF maximum_number_of_spots ON parking_lots
+           BEGIN
+               UPDATE parking_lots SET spots_version = spots_version + 1 WHERE id = NEW.id;
+           END''',
+    ],
+]
+
+# Version of the schema once every migration has been applied.
+schema_version = len(migrations)
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def fingerprint():
+    """Checksum of the migration steps (SQL text, or function names), kept in 31 bits."""
+    steps = [step if isinstance(step, str) else step.__name__ for migration in migrations for step in migration]
+    return zlib.crc32('\n'.join(steps).encode()) & 0x7fffffff
+
+def is_current(conn):
+    """True when every migration has been applied and they match the ones applied."""
+    version, stored = conn.execute('SELECT * FROM pragma_user_version, pragma_application_id').fetchone()
+    return version == schema_version and stored == fingerprint()
+
+def migrate(conn):
+    """Applying every migration newer than the database's user_version."""
+    version = current_version(conn)
+    for number in range(version + 1, schema_version + 1):
+        conn.execute('BEGIN')
+        try:
+            for step in migrations[number - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Schema migrated to version {number}.")
+
+    stored = conn.execute('PRAGMA application_id').fetchone()[0]
+    if stored != fingerprint():
+        if stored and version == schema_version:
+            print("Warning: the applied migrations were changed, add a new migration instead.")
+        conn.execute(f'PRAGMA application_id = {fingerprint()}')
+    return current_version(conn)
@@ -0,0 +1,91 @@
+"""
+Pre-aggregated analytics for the chart APIs.
+
+The rollup tables are updated incrementally by book_spot/vacate_spot inside the
+booking's own transaction, so the chart endpoints read a handful of rows
+instead of aggregating the whole reservation history:
+
+- hourly_bookings:   bookings started per lot per hour     (/api/admin/peakhours)
+- user_monthly_cost: money spent per user per month         (/api/usermonthlycost)
+- user_lot_bookings: bookings per user per lot              (/api/mostusedlot)
+
+Hours are stored as the epoch second the local hour starts at and months as
+local 'YYYY-MM' strings (see models/timestamps.py). Imported history is
+added in one pass by record_history(). rebuild_rollups() recomputes all of
+them from reserved_spots, or from all_reservations when part of the history
+is archived (see models/archive.py).
+"""
+from models.timestamps import hour_bucket, month_bucket
+
+def local_hour(column):
+    # SQL for hour_bucket() of an epoch seconds column
+    return f"CAST(strftime('%s', strftime('%Y-%m-%d %H:00', {column}, 'unixepoch', 'localtime'), 'utc') AS INTEGER)"
+
+def record_booking(conn, user_id, lot_id, parking_timestamp):
+    conn.execute('''
+        INSERT INTO hourly_bookings (hour, lot_id, bookings) VALUES (?, ?, 1)
+        ON CONFLICT (hour, lot_id) DO UPDATE SET bookings = bookings + 1
+    ''', (hour_bucket(parking_timestamp), lot_id))
+    conn.execute('''
+        INSERT INTO user_lot_bookings (user_id, lot_id, bookings) VALUES (?, ?, 1)
+        ON CONFLICT (user_id, lot_id) DO UPDATE SET bookings = bookings + 1
+    ''', (user_id, lot_id))
+
+def record_vacate(conn, user_id, leaving_timestamp, total_cost):
+    conn.execute('''
+        INSERT INTO user_monthly_cost (user_id, month, total_cost) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, month) DO UPDATE SET total_cost = total_cost + excluded.total_cost
+    ''', (user_id, month_bucket(leaving_timestamp), total_cost))
+
+def record_history(conn, rows):
+    """
+    Adding completed reservations to the rollups in one pass, `rows` being a
+    query (without parameters) with the columns user_id, lot_id,
+    parking_timestamp, leaving_timestamp and total_cost.
+    """
+    conn.execute(f'''
+        INSERT INTO hourly_bookings (hour, lot_id, bookings)
+        SELECT {local_hour('parking_timestamp')}, lot_id, COUNT(*) FROM ({rows}) GROUP BY 1, 2
+        ON CONFLICT (hour, lot_id) DO UPDATE SET bookings = bookings + excluded.bookings
+    ''')
+    conn.execute(f'''
+        INSERT INTO user_lot_bookings (user_id, lot_id, bookings)
+        SELECT user_id, lot_id, COUNT(*) FROM ({rows}) GROUP BY 1, 2
+        ON CONFLICT (user_id, lot_id) DO UPDATE SET bookings = bookings + excluded.bookings
+    ''')
+    conn.execute(f'''
+        INSERT INTO user_monthly_cost (user_id, month, total_cost)
+        SELECT user_id, strftime('%Y-%m', leaving_timestamp, 'unixepoch', 'localtime'), SUM(total_cost)
+        FROM ({rows}) WHERE leaving_timestamp IS NOT NULL GROUP BY 1, 2
+        ON CONFLICT (user_id, month) DO UPDATE SET total_cost = total_cost + excluded.total_cost
+    ''')
+
+def rebuild_rollups(conn, history='reserved_spots'):
+    """Recomputing every rollup table from the reservation history in the `history` table or view."""
+    conn.execute('DELETE FROM hourly_bookings')
+    conn.execute(f'''
+        INSERT INTO hourly_bookings (hour, lot_id, bookings)
+        SELECT
+            {local_hour('rs.parking_timestamp')},
+            ps.lot_id,
+            COUNT(*)
+        FROM {history} rs
+        JOIN parking_spots ps ON rs.spot_id = ps.id
+        GROUP BY 1, 2
+    ''')
+    conn.execute('DELETE FROM user_lot_bookings')
+    conn.execute(f'''
+        INSERT INTO user_lot_bookings (user_id, lot_id, bookings)
+        SELECT rs.user_id, ps.lot_id, COUNT(*)
+        FROM {history} rs
+        JOIN parking_spots ps ON rs.spot_id = ps.id
+        GROUP BY 1, 2
+    ''')
+    conn.execute('DELETE FROM user_monthly_cost')
+    conn.execute(f'''
+        INSERT INTO user_monthly_cost (user_id, month, total_cost)
+        SELECT user_id, strftime('%Y-%m', leaving_timestamp, 'unixepoch', 'localtime'), SUM(total_cost)
+        FROM {history}
+        WHERE leaving_timestamp IS NOT NULL
+        GROUP BY 1, 2
+    ''')
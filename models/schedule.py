@@ -0,0 +1,375 @@
+"""
+Scheduled reservations: a spot held for a user over a future window [start, end).
+
+Reservations are rows of scheduled_reservations (migration 9), each on one
+spot, and the windows held on a spot never overlap. Which spots are free in
+a window is answered by ScheduleIndex: for every lot, the held windows of
+each spot as a tuple sorted by start. A binary search tells whether one spot
+is free, in O(log w) for the w windows on it. The lookups over a lot are not
+logarithmic: allocation tries the spots by number until one is free, and
+counting checks every spot that has windows, so both take O(spots log w)
+when most spots are held around the window asked for, and get slower as a
+lot fills up (benchmarks/bench_schedule.py). Lookups take no lock: writes,
+under the index's lock, put a new tuple (and set of held spots) in place of
+the old one, and a reader works on whichever it read.
+
+The index is a per-process copy of the table, and only ever holds committed
+rows. Every change to the held windows of a lot bumps
+parking_lots.schedule_version in the writer's transaction and stamps the
+reservation it changed with the new version (changed). Writers don't touch
+the copy: the next lookup finds the version moved on and reads the
+reservations stamped since the copy's version, one indexed query whichever
+process wrote them. Only a change to the lot's spots (spots_version, bumped
+by a trigger when the lot is resized) reloads the lot whole. A spot picked
+from the copy is checked against the database before it is reserved
+(spot_taken), so a wrong copy can't put two windows on one spot.
+
+At the start of the window the driver checks in (check_in), which turns the
+reservation into an active booking in reserved_spots, billed like any other
+when vacated. Vacating before the end of the window ends it then
+(end_checked_in), so the spot is free for the rest of it. If a walk-in is still parked on the spot, another spot free
+until the end of the window is used. To keep that rare, walk-ins
+(models/bookings.py) are not given spots held within the next `walkin_hold`
+seconds, and windows starting that soon are not given spots occupied now.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from models.db import run_in_write_transaction
+from models.allocator import claim_spot
+from models.rollups import record_booking
+from models.timestamps import now
+
+walkin_hold = 3600         # seconds
+checkin_early = 900        # seconds before the start a driver may check in
+min_length = 900           # shortest window, seconds
+max_length = 7 * 86400     # longest window, seconds
+max_ahead = 90 * 86400     # how far ahead windows may start, seconds
+
+class LotSchedule:
+    """The held windows of one lot, per spot, as (start, end) sorted by start."""
+    def __init__(self, version, spots_version, spots):
+        self.version = version
+        self.spots_version = spots_version
+        self.spots = spots # spot ids, by spot number
+        self.windows = dict.fromkeys(spots, ())
+        self.held = frozenset() # spots with windows
+        self.reservations = {} # reservation id -> (spot, start) of its window
+
+    def add(self, reservation, spot, start, end):
+        windows = self.windows[spot]
+        i = bisect_left(windows, (start,))
+        self.windows[spot] = windows[:i] + ((start, end),) + windows[i:]
+        if not windows:
+            self.held = self.held | {spot}
+        self.reservations[reservation] = (spot, start)
+
+    def remove(self, reservation):
+        if reservation not in self.reservations:
+            return
+        spot, start = self.reservations.pop(reservation)
+        windows = self.windows[spot]
+        i = bisect_left(windows, (start,))
+        self.windows[spot] = windows[:i] + windows[i + 1:]
+        if len(windows) == 1:
+            self.held = self.held - {spot}
+
+    def is_free(self, spot, start, end):
+        # Only the last window starting before `end` can overlap, the ones
+        # before it end before it starts. One read of the tuple, a write
+        # replaces it rather than changing it.
+        windows = self.windows[spot]
+        i = bisect_left(windows, (end,))
+        return i == 0 or windows[i - 1][1] <= start
+
+    def first_free(self, start, end, skip=()):
+        """The lowest numbered spot free over [start, end), None when there is none."""
+        return next((spot for spot in self.spots if spot not in skip and self.is_free(spot, start, end)), None)
+
+    def free_count(self, start, end, skip=()):
+        """How many spots are free over [start, end), `skip` being spots of this lot."""
+        # A spot without windows is free, only the held ones are checked
+        taken = sum(1 for spot in self.held if spot not in skip and not self.is_free(spot, start, end))
+        return len(self.spots) - len(skip) - taken
+
+@contextmanager
+def read_transaction(conn):
+    # One read transaction, so the versions match the rows. Inside the
+    # caller's transaction when there is one.
+    started = not conn.in_transaction
+    if started:
+        conn.execute('BEGIN')
+    try:
+        yield
+    finally:
+        if started:
+            conn.commit()
+
+def lot_versions(conn, lot_id):
+    return conn.execute('SELECT schedule_version, spots_version FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+
+class ScheduleIndex:
+    """
+    The lots' schedules of this process, read from the database. They are
+    read inside a transaction only before it writes to the lot's windows,
+    so what they hold is committed.
+    """
+    def __init__(self):
+        self.lots = {} # lot_id -> LotSchedule
+        self.lock = threading.Lock() # one reload or catch up at a time
+        self.reloads = 0
+        self.catch_ups = 0
+
+    def read(self, conn, lot_id, versions):
+        spots = [row[0] for row in conn.execute(
+            'SELECT id FROM parking_spots WHERE lot_id = ? ORDER BY spot_number', (lot_id,))]
+        schedule = LotSchedule(versions['schedule_version'], versions['spots_version'], spots)
+        held = conn.execute('''
+            SELECT id, spot_id, start_time, end_time FROM scheduled_reservations
+            WHERE lot_id = ? AND status IN ('scheduled', 'checked_in') AND end_time > ?
+            ORDER BY spot_id, start_time
+        ''', (lot_id, now()))
+        windows = {}
+        for reservation, spot, start, end in held:
+            windows.setdefault(spot, []).append((start, end))
+            schedule.reservations[reservation] = (spot, start)
+        # Built before the copy is shared, the writes after it swap whole tuples
+        schedule.windows.update((spot, tuple(spot_windows)) for spot, spot_windows in windows.items())
+        schedule.held = frozenset(windows)
+        self.reloads += 1
+        return schedule
+
+    def catch_up(self, conn, lot_id, schedule, version):
+        """Applying the changes committed since the schedule's version, up to `version`."""
+        changes = conn.execute('''
+            SELECT id, spot_id, start_time, end_time, status IN ('scheduled', 'checked_in') AS held
+            FROM scheduled_reservations WHERE lot_id = ? AND changed_version > ?
+        ''', (lot_id, schedule.version)).fetchall()
+        # Every old window goes first, a new one may take the place of another
+        for change in changes:
+            schedule.remove(change['id'])
+        current = now()
+        for change in changes:
+            if change['held'] and change['end_time'] > max(change['start_time'], current):
+                schedule.add(change['id'], change['spot_id'], change['start_time'], change['end_time'])
+        schedule.version = version
+        self.catch_ups += 1
+
+    def load(self, conn, lot_id):
+        """The lot's schedule read whole from the database, None for an unknown lot."""
+        with self.lock, read_transaction(conn):
+            versions = lot_versions(conn, lot_id)
+            schedule = None if versions is None else self.read(conn, lot_id, versions)
+            self.store(lot_id, schedule)
+        return schedule
+
+    def refresh(self, conn, lot_id):
+        """The lot's schedule brought up to the database's version. None for an unknown lot."""
+        with self.lock, read_transaction(conn):
+            versions = lot_versions(conn, lot_id)
+            schedule = self.lots.get(lot_id)
+            if versions is None:
+                schedule = None
+            elif schedule is None or schedule.spots_version != versions['spots_version']:
+                schedule = self.read(conn, lot_id, versions)
+            elif schedule.version < versions['schedule_version']:
+                # An older version is a caller's older read transaction, the copy is kept
+                self.catch_up(conn, lot_id, schedule, versions['schedule_version'])
+            self.store(lot_id, schedule)
+        return schedule
+
+    def store(self, lot_id, schedule):
+        if schedule is None:
+            self.lots.pop(lot_id, None)
+        else:
+            self.lots[lot_id] = schedule
+
+    def lot(self, conn, lot_id):
+        """The lot's schedule, brought up to date when the database has another version. None for an unknown lot."""
+        versions = lot_versions(conn, lot_id)
+        schedule = self.lots.get(lot_id)
+        if versions is None or schedule is None or (schedule.version, schedule.spots_version) != tuple(versions):
+            schedule = self.refresh(conn, lot_id)
+        return schedule
+
+    def free_count(self, conn, lot_id, start, end, skip=()):
+        """How many spots of a lot are free over [start, end), None for an unknown lot."""
+        schedule = self.lot(conn, lot_id)
+        return None if schedule is None else schedule.free_count(start, end, skip)
+
+    def stats(self):
+        with self.lock:
+            return {'lots': len(self.lots), 'windows': sum(len(schedule.reservations) for schedule in self.lots.values()),
+                    'reloads': self.reloads, 'catch_ups': self.catch_ups}
+
+def changed(conn, lot_id, reservation_id):
+    """
+    Bumping the lot's schedule version after a write to a reservation's
+    window, inside the writer's transaction, and stamping the reservation
+    with it. Every process picks the change up once it is committed.
+    """
+    version = conn.execute(
+        'UPDATE parking_lots SET schedule_version = schedule_version + 1 WHERE id = ? RETURNING schedule_version',
+        (lot_id,)
+    ).fetchone()[0]
+    conn.execute('UPDATE scheduled_reservations SET changed_version = ? WHERE id = ?', (version, reservation_id))
+
+def spot_taken(conn, spot, start, end):
+    """True when a window held on the spot overlaps [start, end), asked of the database."""
+    # Held windows don't overlap, the last one starting before `end` is the only candidate
+    last = conn.execute('''
+        SELECT end_time FROM scheduled_reservations
+        WHERE spot_id = ? AND start_time < ? AND status IN ('scheduled', 'checked_in')
+        ORDER BY start_time DESC LIMIT 1
+    ''', (spot, end)).fetchone()
+    return last is not None and last[0] > start
+
+def free_spot(conn, index, lot_schedule, lot_id, start, end, skip):
+    """
+    The lowest numbered spot of a lot free over [start, end), None when there
+    is none. Inside a write transaction, before it writes to the lot's windows.
+    """
+    spot = lot_schedule.first_free(start, end, skip)
+    if spot is not None and spot_taken(conn, spot, start, end):
+        # The copy missed a window, the lot is read again inside this transaction
+        spot = index.load(conn, lot_id).first_free(start, end, skip)
+    return spot
+
+def occupied_spots(conn, lot_id):
+    return {row[0] for row in conn.execute(
+        "SELECT id FROM parking_spots WHERE lot_id = ? AND status = 'occupied'", (lot_id,))}
+
+def skipped_spots(conn, lot_id, start):
+    # Spots a walk-in is parked on are not given to windows starting within walkin_hold
+    return occupied_spots(conn, lot_id) if start < now() + walkin_hold else set()
+
+def check_window(start, end):
+    current = now()
+    return current - 60 <= start < end and min_length <= end - start <= max_length and start <= current + max_ahead
+
+def free_count(conn, index, lot_id, start, end):
+    """How many spots of a lot can be reserved over [start, end), None for an unknown lot."""
+    return index.free_count(conn, lot_id, start, end, skipped_spots(conn, lot_id, start))
+
+def schedule(conn, index, user_id, lot_id, start, end):
+    """
+    Reserving the lowest numbered spot of a lot free over [start, end) for a
+    user, inside the caller's write transaction. Returns (status, reservation)
+    like schedule_spot.
+    """
+    if not check_window(start, end):
+        return 'bad_window', None
+    overlapping = conn.execute('''
+        SELECT 1 FROM scheduled_reservations
+        WHERE user_id = ? AND status = 'scheduled' AND start_time < ? AND end_time > ?
+    ''', (user_id, end, start)).fetchone()
+    if overlapping:
+        return 'overlap', None
+
+    lot_schedule = index.lot(conn, lot_id)
+    if lot_schedule is None:
+        return 'not_found', None
+    spot = free_spot(conn, index, lot_schedule, lot_id, start, end, skipped_spots(conn, lot_id, start))
+    if spot is None:
+        return 'lot_full', None
+    reservation = conn.execute('''
+        INSERT INTO scheduled_reservations (lot_id, spot_id, user_id, start_time, end_time, parking_cost_per_unit, created_at)
+        SELECT id, ?, ?, ?, ?, price_per_hour, ? FROM parking_lots WHERE id = ?
+        RETURNING id, lot_id, spot_id, start_time, end_time, parking_cost_per_unit
+    ''', (spot, user_id, start, end, now(), lot_id)).fetchone()
+    changed(conn, lot_id, reservation['id'])
+    spot_number = conn.execute('SELECT spot_number FROM parking_spots WHERE id = ?', (spot,)).fetchone()[0]
+    return 'scheduled', {**dict(reservation), 'spot_number': spot_number}
+
+def schedule_spot(conn, index, user_id, lot_id, start, end):
+    """
+    Reserving a spot of a lot for a user over [start, end) (epoch seconds).
+    Returns (status, reservation) where status is 'scheduled', 'bad_window'
+    (too short, too long, too far ahead or in the past), 'overlap' (the user
+    has a reservation then), 'lot_full' or 'not_found' (no such lot), and
+    reservation is only set when scheduled.
+    """
+    return run_in_write_transaction(conn, lambda conn: schedule(conn, index, user_id, lot_id, start, end))
+
+def cancel_scheduled(conn, user_id, reservation_id):
+    """Cancelling a user's reservation that wasn't checked in yet. Returns 'cancelled' or 'not_found'."""
+    def work(conn):
+        reservation = conn.execute('''
+            UPDATE scheduled_reservations SET status = 'cancelled'
+            WHERE id = ? AND user_id = ? AND status = 'scheduled'
+            RETURNING lot_id
+        ''', (reservation_id, user_id)).fetchone()
+        if reservation is None:
+            return 'not_found'
+        changed(conn, reservation['lot_id'], reservation_id)
+        return 'cancelled'
+    return run_in_write_transaction(conn, work)
+
+def check_in(conn, index, user_id, reservation_id):
+    """
+    Turning a user's reservation into an active booking, from `checkin_early`
+    seconds before its start until its end. Returns (status, booking) where
+    status is 'checked_in', 'not_found', 'too_early', 'expired',
+    'active_booking' (the user is parked elsewhere) or 'lot_full' (a walk-in
+    is on the spot and no other spot is free until the end of the window).
+    """
+    def work(conn):
+        reservation = conn.execute(
+            "SELECT * FROM scheduled_reservations WHERE id = ? AND user_id = ? AND status = 'scheduled'",
+            (reservation_id, user_id)
+        ).fetchone()
+        if reservation is None:
+            return 'not_found', None
+        current = now()
+        if current < reservation['start_time'] - checkin_early:
+            return 'too_early', None
+        if current >= reservation['end_time']:
+            return 'expired', None
+        active_booking = conn.execute(
+            'SELECT id FROM reserved_spots WHERE user_id = ? AND leaving_timestamp IS NULL', (user_id,)
+        ).fetchone()
+        if active_booking:
+            return 'active_booking', None
+
+        lot_id, spot_id = reservation['lot_id'], reservation['spot_id']
+        if claim_spot(conn, spot_id) is None:
+            # Somebody is still parked there, moving the rest of the window to a
+            # spot free now until its end. Its start becomes now, the spot may
+            # have been held earlier in the window.
+            spot_id = free_spot(conn, index, index.lot(conn, lot_id), lot_id, current, reservation['end_time'],
+                                occupied_spots(conn, lot_id))
+            if spot_id is None:
+                return 'lot_full', None
+            claim_spot(conn, spot_id)
+            conn.execute('UPDATE scheduled_reservations SET spot_id = ?, start_time = ? WHERE id = ?',
+                         (spot_id, current, reservation_id))
+            changed(conn, lot_id, reservation_id)
+
+        booking = conn.execute('''
+            INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, parking_cost_per_unit)
+            VALUES (?, ?, ?, ?)
+            RETURNING id, spot_id, parking_timestamp, parking_cost_per_unit
+        ''', (spot_id, user_id, current, reservation['parking_cost_per_unit'])).fetchone()
+        conn.execute("UPDATE scheduled_reservations SET status = 'checked_in', booking_id = ? WHERE id = ?",
+                     (booking['id'], reservation_id))
+        record_booking(conn, user_id, lot_id, current)
+        spot_number = conn.execute('SELECT spot_number FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()[0]
+        return 'checked_in', {**dict(booking), 'lot_id': lot_id, 'spot_number': spot_number}
+    return run_in_write_transaction(conn, work)
+
+def end_checked_in(conn, booking_id, leaving):
+    """
+    Ending the window of the reservation a booking was checked in from at
+    `leaving`, when the booking is vacated before the window is over. Inside
+    the caller's write transaction.
+    """
+    reservation = conn.execute(
+        "SELECT id, lot_id, end_time FROM scheduled_reservations WHERE booking_id = ? AND status = 'checked_in'",
+        (booking_id,)
+    ).fetchone()
+    if reservation is None or reservation['end_time'] <= leaving:
+        return
+    # Checked in early and gone before the start, the window becomes empty
+    conn.execute('UPDATE scheduled_reservations SET start_time = min(start_time, ?), end_time = ? WHERE id = ?',
+                 (leaving, leaving, reservation['id']))
+    changed(conn, reservation['lot_id'], reservation['id'])
@@ -0,0 +1,120 @@
+"""
+A read-only copy of the database for the analytics routes.
+
+A background thread copies the database with SQLite's online backup API
+every `interval` seconds. The copy is made in one step, from a single read
+transaction, so it is consistent and doesn't hold up writers under WAL. It is
+written to a temporary file that then replaces the snapshot. Readers open
+the snapshot as immutable (no locks at all), and a reader keeps the version
+it opened while the next one is swapped in.
+
+The thread is started on first use, in the process that serves requests.
+With several server processes only one of them copies the database: the one
+holding a lock on `<snapshot>.lock`, which the others try to take at every
+interval, so another takes over if it exits. The copy's modification time is
+set to when it was taken, and every process reads `taken_at` from it.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+from models.db import connect
+
+try:
+    import fcntl
+except ImportError: # no file locks (Windows), only the development server runs there
+    fcntl = None
+
+log = logging.getLogger('parking.snapshot')
+
+def snapshot_path(source):
+    return os.path.splitext(source)[0] + '-snapshot.db'
+
+class Snapshot:
+    def __init__(self, interval=30):
+        self.interval = interval
+        self.source = None
+        self.path = None
+        self.lock_file = None # open while this process may refresh the copy
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, source, path=None):
+        """Starting the refresh thread for `source`, unless it is already running."""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.source, self.path = source, path or snapshot_path(source)
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='snapshot', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                if self.elected():
+                    self.refresh()
+            except (sqlite3.Error, OSError):
+                # Readers go back to the primary once the copy gets too old.
+                log.exception('refreshing the snapshot failed')
+            self.stopping.wait(self.interval)
+
+    def elected(self):
+        """True while this process holds the lock of the refreshing process."""
+        if fcntl is None:
+            return True
+        if self.lock_file is None:
+            self.lock_file = open(f'{self.path}.lock', 'a')
+        try:
+            # Per process and not inherited by forked children, taking it again is a no-op
+            fcntl.lockf(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def refresh(self):
+        taken_at = time.time()
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        source = connect(self.source)
+        copy = sqlite3.connect(temporary)
+        try:
+            source.backup(copy)
+            # The copy is only ever read, as a single file without a WAL.
+            copy.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            copy.close()
+            source.close()
+        os.utime(temporary, (taken_at, taken_at))
+        os.replace(temporary, self.path)
+
+    @property
+    def taken_at(self):
+        """Epoch seconds the current copy was taken at, None before the first one."""
+        if self.path is None:
+            return None
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def age(self):
+        """Seconds since the current copy was taken, None before the first one."""
+        return None if self.taken_at is None else time.time() - self.taken_at
+
+    def connect(self):
+        conn = sqlite3.connect(f'file:{quote(os.path.abspath(self.path))}?immutable=1', uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
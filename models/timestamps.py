@@ -0,0 +1,39 @@
+"""
+Helpers for the integer timestamps stored in the database.
+
+reserved_spots keeps parking/leaving times as Unix epoch seconds (INTEGER), so
+time windows are plain range comparisons an index can serve and billing has
+second resolution. Everything shown to people is local time; these helpers do
+the conversions at that boundary.
+"""
+import time
+from datetime import datetime, timedelta
+
+display_format = '%Y-%m-%d %H:%M'
+
+def now():
+    """Current time as epoch seconds."""
+    return int(time.time())
+
+def to_display(timestamp):
+    """Epoch seconds -> 'YYYY-MM-DD HH:MM' local time ('' for None)."""
+    if timestamp is None:
+        return ''
+    return datetime.fromtimestamp(timestamp).strftime(display_format)
+
+def parse_local(text):
+    """'YYYY-MM-DD HH:MM' (or with a 'T', as sent by datetime-local inputs) local time -> epoch seconds."""
+    return int(datetime.fromisoformat(text.strip()).timestamp())
+
+def hour_bucket(timestamp):
+    """Epoch seconds of the start of the local hour containing `timestamp`."""
+    return int(datetime.fromtimestamp(timestamp).replace(minute=0, second=0, microsecond=0).timestamp())
+
+def month_bucket(timestamp):
+    """'YYYY-MM' of the local month containing `timestamp`."""
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m')
+
+def day_range(day=None):
+    """(start, end) epoch seconds of a local day, today by default; end is exclusive."""
+    start = datetime.combine(day or datetime.now().date(), datetime.min.time())
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
@@ -0,0 +1,80 @@
+"""
+Shared fixtures: a migrated database in a temporary directory, the app
+configured for it, and the SQL statements the app runs.
+
+    python -m pytest
+"""
+import pytest
+import app as app_module
+import models.export
+from models.db import init_db, connect
+from models.allocator import add_spots
+from models.bookings import book_spot
+
+def new_database(directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    path = str(directory / 'parking.db')
+    init_db(path)
+    return path
+
+@pytest.fixture
+def database(tmp_path):
+    return new_database(tmp_path)
+
+def seed(path, lots, spots=5, parked=2):
+    """`lots` lots of `spots` spots, with `parked` users parked in each. Returns the user ids."""
+    conn = connect(path)
+    with conn:
+        for lot in range(1, lots + 1):
+            conn.execute('INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots, address, pincode) '
+                         'VALUES (?, ?, ?, ?, ?)', (f'Lot {lot:04d}', 10, spots, f'{lot} Ring Road', f'{110000 + lot}'))
+            add_spots(conn, lot, spots)
+        users = [conn.execute("INSERT INTO users (username, password, role) VALUES (?, 'x', 'user') RETURNING id",
+                              (f'driver{i:05d}',)).fetchone()[0] for i in range(lots * parked + 2)]
+    for i, user_id in enumerate(users[:lots * parked]):
+        book_spot(conn, user_id, 1 + i // parked)
+    conn.close()
+    return users
+
+# Apps built by the current test, closed after it
+built_apps = []
+
+def configure(path, **config):
+    """A new app pointed at `path`, with a cheap hash so logins are fast."""
+    flask_app = app_module.create_app({
+        'DATABASE': path, 'TESTING': True, 'SECRET_KEY': 'test', 'SNAPSHOT_ENABLED': False,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1', 'PASSWORD_HASH_WORKERS': 1,
+        'GATE_TOKENS': {'gate-token': 'gate 1'}, **config,
+    })
+    built_apps.append(flask_app)
+    return flask_app
+
+@pytest.fixture
+def app(database):
+    return configure(database)
+
+@pytest.fixture(autouse=True)
+def stop_hashing_processes():
+    yield
+    while built_apps:
+        built_apps.pop().extensions['parking'].close()
+
+def client_as(flask_app, user_id, username, role):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=user_id, username=username, role=role)
+    return client
+
+@pytest.fixture
+def statements(monkeypatch):
+    """Every statement run on the connections the app opens, with its parameters filled in."""
+    executed = []
+    def traced(connect_function):
+        def connect_traced(*args, **kwargs):
+            conn = connect_function(*args, **kwargs)
+            conn.set_trace_callback(executed.append)
+            return conn
+        return connect_traced
+    monkeypatch.setattr(app_module, 'connect', traced(app_module.connect))
+    monkeypatch.setattr(models.export, 'connect', traced(models.export.connect))
+    return executed
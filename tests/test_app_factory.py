@@ -0,0 +1,28 @@
+"""
+create_app builds independent apps: each has its own config and process
+state, and none starts without a secret key.
+"""
+import pytest
+import app as app_module
+from conftest import new_database, seed, configure, client_as
+
+def test_apps_do_not_share_state(tmp_path):
+    first_path, second_path = new_database(tmp_path / 'first'), new_database(tmp_path / 'second')
+    seed(first_path, 2)
+    seed(second_path, 5)
+    first, second = configure(first_path), configure(second_path, CACHE_TTL=1)
+    assert first is not second and second.config['CACHE_TTL'] == 1 and first.config['CACHE_TTL'] == 30
+    assert first.extensions['parking'] is not second.extensions['parking']
+
+    counts = []
+    for flask_app in (first, second):
+        response = client_as(flask_app, 1, 'admin_123', 'admin').get('/api/admin/lotoccupancy')
+        counts.append(len(response.get_json()['labels']))
+    assert counts == [2, 5]
+    assert first.extensions['parking'].dashboard_cache.stats()['size'] == 1
+    assert second.extensions['parking'].dashboard_cache.stats()['size'] == 1
+
+def test_secret_key_is_required(database, monkeypatch):
+    monkeypatch.delenv('PARKING_SECRET_KEY', raising=False)
+    with pytest.raises(RuntimeError, match='SECRET_KEY'):
+        app_module.create_app({'DATABASE': database})
@@ -0,0 +1,46 @@
+"""
+Archiving moves old completed reservations out of reserved_spots without
+changing what the history, the exports, the revenue report and the rollups
+read through all_reservations. Active and recent reservations stay.
+"""
+from conftest import seed, client_as
+from models.bookings import book_spot, vacate_spot
+from models.db import connect
+from models.timestamps import now
+
+def history(app, users):
+    """Everything read from the whole history, by route."""
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    pages = {user: client_as(app, user, f'user {user}', 'user').get('/api/userhistory').get_json()['items']
+             for user in users}
+    conn = connect(app.config['DATABASE'])
+    rollups = {table: conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2').fetchall()
+               for table in ('hourly_bookings', 'user_monthly_cost', 'user_lot_bookings')}
+    return (pages, admin.get('/admin/export/reservations').data, admin.get('/api/admin/revenue').get_json()['total'],
+            {table: [tuple(row) for row in rows] for table, rows in rollups.items()})
+
+def test_archived_history_reads_the_same(app, database):
+    users = seed(database, 1, spots=5, parked=2)
+    conn = connect(database)
+    for days, user in [(400, users[2]), (200, users[3]), (100, users[2]), (0, users[3])]:
+        status, booking = book_spot(conn, user, 1)
+        vacate_spot(conn, user, booking['id'])
+        # Moved back in time, with a cost, the rollups are rebuilt from it below
+        leaving = now() - days * 86400
+        with conn:
+            conn.execute('UPDATE reserved_spots SET parking_timestamp = ?, leaving_timestamp = ?, total_cost = 20 WHERE id = ?',
+                         (leaving - 7200, leaving, booking['id']))
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['rebuild-rollups']).exit_code == 0
+    before = history(app, users[2:])
+    assert len(before[0][users[2]]) == 2 and before[2]['reservations'] == 4
+
+    result = runner.invoke(args=['archive-reservations', '--days', '30'])
+    assert result.exit_code == 0 and 'Archived 3 reservation(s)' in result.output
+    # The active bookings and the recent one are left in place
+    assert conn.execute('SELECT count(*) FROM reserved_spots').fetchone()[0] == 3
+    assert conn.execute('SELECT count(*) FROM reserved_spots WHERE leaving_timestamp IS NULL').fetchone()[0] == 2
+
+    assert history(app, users[2:]) == before
+    assert runner.invoke(args=['rebuild-rollups']).exit_code == 0
+    assert history(app, users[2:]) == before
@@ -0,0 +1,48 @@
+"""
+Logins upgrade hashes made with another method, are limited per username
+over a sliding window, and keep working after the hashing pool is shut down.
+"""
+from werkzeug.security import generate_password_hash, check_password_hash
+import models.auth
+from conftest import configure
+from models.auth import PasswordHasher, LoginLimiter
+from models.db import connect
+
+def test_legacy_hash_is_replaced_at_login(app, database):
+    legacy = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+    with connect(database) as conn:
+        conn.execute("INSERT INTO users (username, password, role) VALUES ('driver', ?, 'user')", (legacy,))
+    response = app.test_client().post('/login', data={'username': 'driver', 'password': 'secret'})
+    assert response.status_code == 302
+
+    stored = connect(database).execute("SELECT password FROM users WHERE username = 'driver'").fetchone()[0]
+    assert stored.startswith('pbkdf2:sha256:1$') and check_password_hash(stored, 'secret')
+
+def test_limiter_blocks_until_the_window_passes(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(models.auth.time, 'monotonic', lambda: clock[0])
+    limiter = LoginLimiter(attempts=3, window=60)
+    assert [limiter.allow('driver') for attempt in range(4)] == [True, True, True, False]
+    assert limiter.allow('other') and limiter.retry_after('driver') == 61
+
+    clock[0] += 30
+    assert not limiter.allow('driver')
+    clock[0] += 30
+    assert limiter.allow('driver')
+
+def test_login_route_turns_away_over_the_limit(database):
+    client = configure(database, LOGIN_ATTEMPTS=2).test_client()
+    codes = [client.post('/login', data={'username': 'nobody', 'password': 'x'}).status_code for attempt in range(3)]
+    assert codes == [200, 200, 429]
+
+def test_hashing_after_the_pool_is_shut_down():
+    hasher = PasswordHasher(method='pbkdf2:sha256:1', workers=1)
+    try:
+        stored = hasher.hash('secret')
+        hasher.shutdown()
+        assert hasher.pool is None
+        # Started again on the next use
+        assert hasher.verify(stored, 'secret') and not hasher.verify(stored, 'wrong')
+        assert hasher.pool is not None
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,45 @@
+"""
+A vacated booking is billed what compute_charges prices it at, and the
+revenue report over the history shows the same figure, for every tariff rule.
+"""
+from datetime import datetime
+import pytest
+import models.bookings
+from conftest import seed
+from models.archive import attach_archive
+from models.billing import compute_charges, revenue_report
+from models.bookings import book_spot, vacate_spot
+from models.db import connect
+
+def local(day, hour, minute=0):
+    return int(datetime(2026, 3, day, hour, minute).timestamp())
+
+# tariff, parking and leaving local times, the charge at 10 an hour
+cases = {
+    'minimum charge': ({'minimum_charge': 5}, local(10, 9), local(10, 9, 10), 5.0),
+    'per started hour': ({'per_started_hour': True}, local(10, 9), local(10, 11, 10), 30.0),
+    'daily cap': ({'daily_cap': 100}, local(10, 9), local(12, 11), 220.0),
+    'peak pricing': ({'peak_hours': (8, 9), 'peak_multiplier': 1.5}, local(10, 8, 30), local(10, 10, 30), 30.0),
+    'across midnight': ({'per_started_hour': True, 'peak_hours': (23,), 'peak_multiplier': 2},
+                        local(10, 23), local(11, 1, 30), 60.0),
+}
+
+@pytest.mark.parametrize('tariff, parking, leaving, expected', cases.values(), ids=cases.keys())
+def test_bill_matches_report(database, monkeypatch, tariff, parking, leaving, expected):
+    users = seed(database, 1, parked=0)
+    conn = connect(database)
+    status, booking = book_spot(conn, users[0], 1)
+    with conn:
+        conn.execute('UPDATE reserved_spots SET parking_timestamp = ? WHERE id = ?', (parking, booking['id']))
+    monkeypatch.setattr(models.bookings, 'now', lambda: leaving)
+    status, vacated = vacate_spot(conn, users[0], booking['id'], tariff)
+    assert status == 'vacated'
+
+    start_hour = datetime.fromtimestamp(parking).hour
+    assert vacated['total_cost'] == compute_charges(tariff, [leaving - parking], [10], [start_hour])[0] == expected
+
+    attach_archive(conn)
+    [row] = revenue_report(conn, tariff)
+    # Reported on the local day the booking ended
+    assert row['day'] == datetime.fromtimestamp(leaving).date().isoformat()
+    assert row['reservations'] == 1 and row['revenue'] == row['billed'] == expected
@@ -0,0 +1,61 @@
+"""
+Bookings from several threads at once, one connection each like request
+threads, never hand a spot out twice or give a user two active bookings, and
+leave the lot counters matching the spots (models/bookings.py).
+"""
+import threading
+from conftest import seed
+from models.db import connect
+from models.allocator import check_counters
+from models.bookings import book_spot, vacate_spot
+
+threads = 8
+
+def run_threads(path, work, items):
+    """Splitting items over the threads, all starting together."""
+    start = threading.Barrier(threads)
+    errors = []
+    def worker(chunk):
+        conn = connect(path)
+        try:
+            start.wait()
+            for item in chunk:
+                work(conn, item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+    pool = [threading.Thread(target=worker, args=(items[i::threads],)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    assert not errors, errors
+
+def test_concurrent_bookings_allocate_each_spot_once(database):
+    seed(database, 1, spots=10, parked=0)
+    with connect(database) as conn:
+        conn.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'user')",
+                         [(f'rush{i:03d}',) for i in range(30)])
+    users = [row[0] for row in connect(database).execute("SELECT id FROM users WHERE role = 'user'")]
+
+    outcomes = []
+    # Every user asks twice, from two different threads
+    run_threads(database, lambda conn, user_id: outcomes.append(book_spot(conn, user_id, 1)[0]), users * 2)
+
+    conn = connect(database)
+    active = conn.execute('''
+        SELECT count(*), count(DISTINCT spot_id), count(DISTINCT user_id)
+        FROM reserved_spots WHERE leaving_timestamp IS NULL
+    ''').fetchone()
+    assert tuple(active) == (10, 10, 10)
+    assert outcomes.count('booked') == 10
+    assert conn.execute("SELECT count(*) FROM parking_spots WHERE status = 'occupied'").fetchone()[0] == 10
+    assert not check_counters(conn)
+
+    bookings = conn.execute('SELECT id, user_id FROM reserved_spots WHERE leaving_timestamp IS NULL').fetchall()
+    # Every booking vacated twice at once, the second is not found
+    run_threads(database, lambda conn, booking: vacate_spot(conn, booking['user_id'], booking['id']), bookings * 2)
+    assert conn.execute("SELECT count(*) FROM parking_spots WHERE status = 'occupied'").fetchone()[0] == 0
+    assert conn.execute('SELECT count(*) FROM reserved_spots WHERE total_cost IS NULL').fetchone()[0] == 0
+    assert not check_counters(conn)
@@ -0,0 +1,52 @@
+"""
+Cached lot lists are dropped when a route changes a lot (lots_changed) and
+not reused once another process has written a lot (the lots_version
+trigger). JSON answers carry an ETag, answered with a 304 until the data
+changes.
+"""
+from conftest import seed, client_as
+from models.db import connect
+
+gate = {'X-Gate-Token': 'gate-token'}
+
+def test_lots_changed_clears_the_cache(app, database):
+    seed(database, 1)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    cache = app.extensions['parking'].dashboard_cache
+    assert b'Lot 0001' in admin.get('/admindashboard').data
+    assert cache.stats()['size'] == 1
+
+    admin.post('/admin/editlot/1', data={
+        'prime_location_name': 'Renamed', 'price_per_hour': '10', 'address': '1 Ring Road',
+        'pincode': '110001', 'maximum_number_of_spots': '5'})
+    assert cache.stats()['size'] == 0
+    assert b'Renamed' in admin.get('/admindashboard').data
+
+def test_write_of_another_process_is_not_served_from_cache(app, database):
+    seed(database, 1)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    cache = app.extensions['parking'].dashboard_cache
+    admin.get('/admindashboard')
+    admin.get('/admindashboard')
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+    # Written outside the app, nothing clears the cache but the version changed
+    with connect(database) as other:
+        other.execute("UPDATE parking_lots SET prime_location_name = 'Renamed' WHERE id = 1")
+    assert b'Renamed' in admin.get('/admindashboard').data
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 2)
+
+def test_etag_revalidation(app, database):
+    seed(database, 1, parked=0)
+    client = app.test_client()
+    first = client.get('/api/v1/lots', headers=gate)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and 'no-cache' in first.headers['Cache-Control']
+
+    unchanged = client.get('/api/v1/lots', headers={**gate, 'If-None-Match': etag})
+    assert unchanged.status_code == 304 and not unchanged.data
+
+    client.post('/api/v1/bookings', headers=gate, json={'username': 'driver00000', 'lot_id': 1})
+    changed = client.get('/api/v1/lots', headers={**gate, 'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert changed.get_json()['lots'][0]['occupied'] == 1
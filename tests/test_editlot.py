@@ -0,0 +1,26 @@
+"""
+Editing a lot is all or nothing: a refused resize leaves the lot's details
+as they were, and an unknown lot is reported, not updated.
+"""
+from conftest import seed, client_as
+from models.db import connect
+
+def edit(admin, lot_id, spots):
+    """The messages flashed by the edit."""
+    admin.post(f'/admin/editlot/{lot_id}', data={
+        'prime_location_name': 'Renamed', 'price_per_hour': '99', 'address': 'Elsewhere',
+        'pincode': '999999', 'maximum_number_of_spots': str(spots)})
+    with admin.session_transaction() as session:
+        return [message for category, message in session.pop('_flashes', [])]
+
+def test_refused_resize_changes_nothing(app, database):
+    seed(database, 1, spots=5, parked=5)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    assert edit(admin, 1, 2) == ['Cannot remove spots that are currently occupied.']
+    lot = connect(database).execute('SELECT * FROM parking_lots WHERE id = 1').fetchone()
+    assert (lot['prime_location_name'], lot['price_per_hour'], lot['maximum_number_of_spots']) == ('Lot 0001', 10, 5)
+
+def test_unknown_lot_is_not_found(app, database):
+    seed(database, 1)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    assert edit(admin, 42, 5) == ['Lot not found.']
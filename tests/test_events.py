@@ -0,0 +1,33 @@
+"""
+Live occupancy streams: past EVENT_STREAMS_PER_PROCESS clients are turned
+away with a 503, and a client that doesn't read keeps only its newest events.
+"""
+from conftest import seed, configure, client_as
+from models.events import EventBus
+
+def test_streams_over_the_cap_are_turned_away(database):
+    seed(database, 1)
+    app = configure(database, EVENT_STREAMS_PER_PROCESS=1, EVENT_STREAM_RETRY=7)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    stream = admin.get('/api/admin/occupancy/stream')
+    assert stream.status_code == 200 and next(stream.response) == b'retry: 5000\n\n'
+
+    refused = admin.get('/api/admin/occupancy/stream')
+    assert refused.status_code == 503 and refused.headers['Retry-After'] == '7'
+    # The pages retry a closed stream after EVENT_STREAM_RETRY
+    assert b'setTimeout(followOccupancy, 7000)' in admin.get('/admin/adminsummarychart').data
+
+    stream.close()
+    again = admin.get('/api/admin/occupancy/stream')
+    assert again.status_code == 200
+    again.close()
+
+def test_slow_subscriber_keeps_its_newest_events():
+    bus = EventBus(queue_size=3)
+    slow, fast = bus.subscribe(), bus.subscribe()
+    received = []
+    for event in range(10):
+        bus.publish(event)
+        received.append(fast.get_nowait())
+    assert received == list(range(10))
+    assert slow.qsize() == 3 and [slow.get_nowait() for i in range(3)] == [7, 8, 9]
@@ -0,0 +1,56 @@
+"""
+Reservation exports stream: the response body is a generator yielding one
+chunk per batch of rows, never the whole file, and the chunks join into
+well formed CSV or NDJSON (models/export.py). The memory use of a million
+row export is measured by benchmarks/bench_export.py.
+"""
+import csv
+import io
+import json
+import types
+import pytest
+from flask import session
+from models.db import connect
+from models.allocator import add_spots
+from models.export import columns, batch_size
+
+rows = 3 * batch_size + 500
+
+@pytest.fixture
+def exported(app, database):
+    with connect(database) as conn:
+        conn.execute("INSERT INTO users (username, password, role) VALUES ('exporter', 'x', 'user')")
+        conn.execute("INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots) VALUES ('Export', 10, 10)")
+        add_spots(conn, 1, 10)
+        conn.execute('''
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost_per_unit, total_cost)
+            SELECT 1 + n % 10, 2, 1600000000 + n * 60, 1600000000 + n * 60 + 3600, 10, 10 FROM seq
+        ''', (rows,))
+    def export(url):
+        """The export's response as the app built it, and its chunks."""
+        with app.test_request_context(url):
+            session.update(user_id=1, username='admin_123', role='admin')
+            response = app.full_dispatch_request()
+        assert response.status_code == 200 and response.is_streamed
+        assert isinstance(response.response, types.GeneratorType)
+        return response, list(response.response)
+    return export
+
+def test_csv_export_streams_in_batches(exported):
+    response, chunks = exported('/admin/export/reservations')
+    assert response.mimetype == 'text/csv'
+    assert len(chunks) == rows // batch_size + 1
+    lines = list(csv.reader(io.StringIO(''.join(chunks))))
+    assert lines[0] == columns and len(lines) == rows + 1
+    assert all(len(line) == len(columns) for line in lines)
+    assert [int(line[0]) for line in lines[1:]] == list(range(1, rows + 1))
+
+def test_ndjson_export_streams_in_batches(exported):
+    response, chunks = exported('/admin/export/reservations?format=ndjson&lot_id=1')
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(chunks) == -(-rows // batch_size)
+    assert all(chunk.endswith('\n') for chunk in chunks)
+    records = [json.loads(line) for line in ''.join(chunks).splitlines()]
+    assert len(records) == rows and all(list(record) == columns for record in records)
+    assert records[0]['username'] == 'exporter' and records[-1]['id'] == rows
@@ -0,0 +1,21 @@
+"""
+Dashboard rows are rendered once per lot version: unchanged lots reuse their
+cached row, and a write to a lot, from any process, re-renders only its row.
+"""
+from conftest import seed, client_as
+from models.bookings import book_spot
+from models.db import connect
+
+def test_rows_are_reused_until_the_lot_changes(app, database):
+    users = seed(database, 3, spots=5, parked=1)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    fragments = app.extensions['parking'].fragment_cache
+    admin.get('/admindashboard')
+    admin.get('/admindashboard')
+    assert (fragments.stats()['hits'], fragments.stats()['misses']) == (3, 3)
+
+    # Booked outside the app, only the lot's version tells its row is stale
+    book_spot(connect(database), users[3], 2)
+    page = admin.get('/admindashboard').data
+    assert (fragments.stats()['hits'], fragments.stats()['misses']) == (5, 4)
+    assert b'<td id="occupancy-2">2 / 5</td>' in page and b'<td id="occupancy-1">1 / 5</td>' in page
@@ -0,0 +1,17 @@
+"""
+Importing lots through the admin page pushes each new lot's occupancy to
+the live dashboards, and not the rejected ones.
+"""
+import io
+from conftest import seed, client_as
+
+def test_imported_lots_are_published(app, database):
+    seed(database, 1)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    subscriber = app.extensions['parking'].occupancy_events.subscribe()
+    csv = ('prime_location_name,price_per_hour,maximum_number_of_spots,address,pincode\n'
+           'Harbour,20,3,1 Quay,400001\nLot 0001,10,5,taken,110001\nMarket,15,2,2 Square,400002\n')
+    admin.post('/admin/import', data={'kind': 'lots', 'file': (io.BytesIO(csv.encode()), 'lots.csv')})
+
+    events = [subscriber.get_nowait() for i in range(subscriber.qsize())]
+    assert [(event['name'], event['available'], event['total']) for event in events] == [('Harbour', 3, 3), ('Market', 2, 2)]
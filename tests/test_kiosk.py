@@ -0,0 +1,49 @@
+"""
+Malformed gate events are refused one by one with a 400, without failing
+their batch, only the Idempotency-Key header keys a single booking, and a
+409 is not replayed to a retry of its key.
+"""
+from conftest import seed
+from models.db import connect
+
+gate = {'X-Gate-Token': 'gate-token'}
+
+def test_malformed_ids_are_refused_per_event(app, database):
+    seed(database, 1, parked=0)
+    results = app.test_client().post('/api/v1/gate/events', headers=gate, json={'events': [
+        {'type': 'vacate', 'username': 'driver00000', 'booking_id': [1]},
+        {'type': 'vacate', 'username': 'driver00000', 'booking_id': {'id': 1}},
+        {'type': 'book', 'username': 'driver00000', 'lot_id': True},
+        {'type': 'book', 'username': 'driver00000', 'lot_id': 2 ** 70},
+        {'type': 'book', 'username': 'driver00000', 'lot_id': 1},
+    ]}).get_json()['results']
+    assert [result['status_code'] for result in results] == [400, 400, 400, 400, 201]
+    assert results[0]['error'] == 'bad_event'
+
+def test_body_key_is_not_an_idempotency_key(app, database):
+    seed(database, 1, parked=0)
+    client = app.test_client()
+    for username in ('driver00000', 'driver00001'):
+        response = client.post('/api/v1/bookings', headers=gate, json={'username': username, 'lot_id': 1, 'key': 'k'})
+        assert response.status_code == 201 and not response.get_json().get('replayed')
+    assert connect(database).execute('SELECT count(*) FROM idempotency_keys').fetchone()[0] == 0
+
+def test_conflicts_are_not_replayed(app, database):
+    seed(database, 1, parked=0)
+    client = app.test_client()
+    book = {'username': 'driver00000', 'lot_id': 1}
+    keyed = {**gate, 'Idempotency-Key': 'retry'}
+    assert client.post('/api/v1/bookings', headers=gate, json=book).status_code == 201
+
+    # Already parked, the 409 is not kept under the key
+    response = client.post('/api/v1/bookings', headers=keyed, json=book)
+    assert response.status_code == 409 and response.get_json()['error'] == 'active_booking'
+    vacated = client.post('/api/v1/bookings/vacate', headers=gate, json={'username': 'driver00000'})
+    assert vacated.status_code == 200
+
+    # The same key books once the user has left, and replays that booking after
+    response = client.post('/api/v1/bookings', headers=keyed, json=book)
+    assert response.status_code == 201 and not response.get_json().get('replayed')
+    replayed = client.post('/api/v1/bookings', headers=keyed, json=book)
+    assert replayed.status_code == 201 and replayed.get_json()['replayed']
+    assert replayed.get_json()['booking_id'] == response.get_json()['booking_id']
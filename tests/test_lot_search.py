@@ -0,0 +1,43 @@
+"""
+Lot search: the filters combine, name prefixes match without case, pages
+follow each other by cursor under any filter, and a bad price is a 400.
+"""
+from conftest import seed, client_as
+from models.allocator import add_spots
+from models.db import connect
+
+# name, price, pincode, free spots
+lots = [('alpha north', 10, '110001', 2), ('Alpha South', 30, '110002', 2), ('ALPHA East', 15, '110011', 0),
+        ('Alpine', 12, '110012', 1), ('alps', 18, '220001', 3), ('Beta', 10, '110001', 4)]
+
+def search(client, **args):
+    """Every page of a search, by name."""
+    pages, after = [], None
+    while True:
+        body = client.get('/api/lots/search', query_string={**args, **({'after': after} if after else {})}).get_json()
+        pages.append([lot['prime_location_name'] for lot in body['items']])
+        after = body['next']
+        if after is None:
+            return pages
+
+def test_filters_and_cursors(app, database):
+    users = seed(database, 0)
+    with connect(database) as conn:
+        for name, price, pincode, free in lots:
+            lot_id = conn.execute('INSERT INTO parking_lots (prime_location_name, price_per_hour, maximum_number_of_spots, '
+                                  "address, pincode) VALUES (?, ?, ?, 'Somewhere', ?) RETURNING id",
+                                  (name, price, 4, pincode)).fetchone()[0]
+            add_spots(conn, lot_id, 4)
+            conn.execute('UPDATE parking_lots SET available_spots = ?, occupied_spots = ? WHERE id = ?',
+                         (free, 4 - free, lot_id))
+    client = client_as(app, users[0], 'driver00000', 'user')
+
+    assert search(client, name='alp', limit=2) == [['ALPHA East', 'alpha north'], ['Alpha South', 'Alpine'], ['alps']]
+    assert search(client, name='ALPHA', limit=1) == [['ALPHA East'], ['alpha north'], ['Alpha South']]
+    assert search(client, name='alp', max_price='15', has_free='1', limit=1) == [['alpha north'], ['Alpine']]
+    assert search(client, pincode='1100', min_price='10.5', limit=2) == [['ALPHA East', 'Alpha South'], ['Alpine']]
+    assert search(client, pincode='11000', name='b') == [['Beta']]
+
+    for bad in ({'min_price': 'cheap'}, {'max_price': '1O'}, {'limit': 'ten'}):
+        response = client.get('/api/lots/search', query_string=bad)
+        assert response.status_code == 400 and 'must be numbers' in response.get_json()['error']
@@ -0,0 +1,13 @@
+"""
+/admin/metrics lets a scraper in with the METRICS_TOKEN bearer token only.
+"""
+from conftest import seed, configure
+
+def test_scraper_token(database):
+    seed(database, 1)
+    client = configure(database, METRICS_TOKEN='s3cret').test_client()
+    def scrape(authorization):
+        return client.get('/admin/metrics', headers={'Authorization': authorization}).status_code
+    assert scrape('Bearer s3cret') == 200
+    assert scrape('Bearer s3cre') == scrape('Bearer s3cret!') == scrape('s3cret') == 403
+    assert scrape('Bearer s3crét') == 403
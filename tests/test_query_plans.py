@@ -0,0 +1,156 @@
+"""
+Every SQL statement the routes run is checked with EXPLAIN QUERY PLAN, and
+the test fails if one reads a whole table (SCAN) instead of searching an
+index, apart from the listings documented in full_listings.
+
+The statements are not listed by hand: every route is requested through the
+test client, covering its main branches, and the statements run on the
+app's connections are recorded with their parameters.
+"""
+import io
+import re
+import time
+from datetime import datetime, timedelta
+from flask import request_finished, request
+from conftest import seed, client_as
+from models.db import connect
+
+# Statements reading every row of a table on purpose, so a scan is the
+# right plan: a fragment of the statement and the table it may scan.
+full_listings = [
+    ('FROM parking_lots pl ORDER BY pl.prime_location_name', 'parking_lots'), # admin dashboard, every lot
+    ('ORDER BY occupied_count DESC', 'parking_lots'),                         # occupancy chart, every lot
+    ('FROM parking_lots ORDER BY id', 'parking_lots'),                        # kiosk API, every lot
+    ('import_reservations', 'import_reservations'),                           # an import reads all it staged
+]
+
+# Routes not requested here
+skipped_endpoints = {'static'}
+
+not_aliases = {'WHERE', 'ON', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'GROUP', 'ORDER', 'LIMIT', 'USING', 'NATURAL', 'SET'}
+
+def table_scans(conn, sql, tables):
+    """
+    The tables of `tables` the statement's plan reads in full. An index walked
+    in order and cut short by LIMIT (a keyset page) is not a full read.
+    """
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        aliases[table] = table
+        if alias and alias.upper() not in not_aliases:
+            aliases[alias] = table
+    scans = []
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+        match = re.match(r'SCAN (?:\w+\.)?(\w+)', row['detail'])
+        if match is None or aliases.get(match.group(1), match.group(1)) not in tables:
+            continue
+        if 'USING' in row['detail'] and 'INDEX' in row['detail'] and re.search(r'\bLIMIT\b', sql, re.I):
+            continue
+        scans.append((aliases.get(match.group(1), match.group(1)), row['detail']))
+    return scans
+
+def local(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M')
+
+def exercise_routes(app, database, statements):
+    users = seed(database, 3)
+    old = int(time.time()) - 400 * 86400
+    with connect(database) as conn:
+        conn.execute('INSERT INTO reserved_spots (spot_id, user_id, parking_timestamp, leaving_timestamp, '
+                     'parking_cost_per_unit, total_cost) VALUES (6, ?, ?, ?, 10, 10)', (users[0], old, old + 600))
+    assert 'Archived 1' in app.test_cli_runner().invoke(args=['archive-reservations']).output
+    del statements[:] # only the routes' statements are checked
+
+    anonymous = app.test_client()
+    anonymous.get('/')
+    anonymous.get('/signup')
+    anonymous.post('/signup', data={'username': 'newcomer', 'password': 'pw', 'confirm_password': 'pw'})
+    anonymous.get('/login')
+    anonymous.post('/login', data={'username': 'newcomer', 'password': 'pw'})
+    anonymous.get('/logout')
+
+    driver = client_as(app, users[-1], 'driver', 'user')
+    for path in ('/userdashboard', '/api/lots/search?q=Lot&min_price=1&max_price=50', '/userhistory',
+                 '/api/userhistory', '/api/mostusedlot', '/api/usermonthlycost', '/user/usersummarychart',
+                 '/export/myhistory?start=2020-01-01&end=2030-01-01'):
+        assert driver.get(path).status_code == 200, path
+    driver.post('/bookspot/1')
+    driver.get('/userdashboard')
+    booking = connect(database).execute('SELECT id FROM reserved_spots WHERE user_id = ? AND leaving_timestamp IS NULL',
+                                        (users[-1],)).fetchone()[0]
+    driver.post(f'/vacatespot/{booking}')
+
+    later = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+    driver.post('/schedulespot/2', data={'start': local(later), 'end': local(later + timedelta(hours=2))})
+    driver.get(f'/api/lots/2/availability?start={local(later)}&end={local(later + timedelta(hours=2))}')
+    soon = datetime.now().replace(second=0, microsecond=0)
+    driver.post('/schedulespot/3', data={'start': local(soon), 'end': local(soon + timedelta(hours=1))})
+    reservations = [row[0] for row in connect(database).execute(
+        'SELECT id FROM scheduled_reservations WHERE user_id = ? ORDER BY start_time DESC', (users[-1],))]
+    assert len(reservations) == 2
+    driver.post(f'/checkin/{reservations[0]}')   # too early
+    driver.post(f'/cancelschedule/{reservations[0]}')
+    driver.post(f'/checkin/{reservations[1]}')
+    checked_in = connect(database).execute('SELECT booking_id FROM scheduled_reservations WHERE id = ?',
+                                           (reservations[1],)).fetchone()[0]
+    driver.post(f'/vacatespot/{checked_in}')    # before the end of the window
+
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    for path in ('/admindashboard', '/admin/adminsummarychart', '/admin/allusers', '/api/admin/users?q=drive',
+                 '/admin/createlot', '/admin/editlot/1', '/admin/import',
+                 '/admin/export/reservations?lot_id=1&start=2020-01-01&end=2030-01-01&format=ndjson',
+                 '/api/admin/revenue?lot_id=1&start=2020-01-01', '/api/admin/peakhours', '/api/admin/lotoccupancy',
+                 '/api/admin/cachestats', '/admin/metrics'):
+        assert admin.get(path).status_code == 200, path
+    admin.get('/api/admin/occupancy/stream', buffered=False).close() # no SQL
+    lot = {'prime_location_name': 'Lot 9999', 'price_per_hour': '10', 'maximum_number_of_spots': '8',
+           'address': 'a', 'pincode': '1'}
+    admin.post('/admin/createlot', data=lot)
+    admin.post('/admin/editlot/4', data={**lot, 'maximum_number_of_spots': '4'})
+    admin.post('/admin/deletelot/4')
+    admin.post('/admin/import', data={'kind': 'lots', 'file': (io.BytesIO(
+        b'prime_location_name,price_per_hour,maximum_number_of_spots\nImported,10,3\n'), 'lots.csv')})
+    admin.post('/admin/import', data={'kind': 'reservations', 'file': (io.BytesIO(
+        b'username,prime_location_name,spot_number,parking_time,leaving_time,parking_cost_per_unit,total_cost\n'
+        b'driver00000,Lot 0001,1,2024-01-01 10:00,2024-01-01 11:00,10,10\n'), 'reservations.csv')})
+
+    gate = app.test_client()
+    headers = {'X-Gate-Token': 'gate-token'}
+    gate.get('/api/v1/lots', headers=headers)
+    gate.get('/api/v1/lots/1', headers=headers)
+    gate.post('/api/v1/bookings', json={'username': 'newcomer', 'lot_id': 2}, headers={**headers, 'Idempotency-Key': 'k1'})
+    gate.post('/api/v1/bookings/vacate', json={'username': 'newcomer'}, headers=headers)
+    gate.post('/api/v1/gate/events', headers=headers, json={'events': [
+        {'type': 'book', 'username': 'newcomer', 'lot_id': 3, 'key': 'k2'},
+        {'type': 'vacate', 'username': 'newcomer', 'key': 'k3'},
+    ]})
+
+def test_route_queries_use_indexes(app, database, statements):
+    requested = set()
+    def record_endpoint(sender, response, **extra):
+        requested.add(request.endpoint)
+    request_finished.connect(record_endpoint, app)
+    try:
+        exercise_routes(app, database, statements)
+    finally:
+        request_finished.disconnect(record_endpoint, app)
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules()}
+    assert endpoints - skipped_endpoints - requested == set()
+
+    # Planned on a connection with the same attached archive and temp tables
+    conn = connect(database)
+    for sql in dict.fromkeys(statements):
+        if re.match(r'\s*(ATTACH|CREATE TEMP)', sql, re.I):
+            conn.execute(re.sub(r'CREATE TEMP (\w+) (?!IF)', r'CREATE TEMP \1 IF NOT EXISTS ', sql))
+    tables = {row[0] for schema in ('main', 'temp', 'archive')
+              for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+    regressions = {}
+    for sql in dict.fromkeys(statements):
+        if not re.match(r'\s*(SELECT|WITH|UPDATE|DELETE|INSERT)', sql, re.I):
+            continue
+        flat = ' '.join(sql.split())
+        allowed = {table for fragment, table in full_listings if fragment in flat}
+        scans = [detail for table, detail in table_scans(conn, sql, tables) if table not in allowed]
+        if scans:
+            regressions[flat] = scans
+    assert regressions == {}
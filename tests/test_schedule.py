@@ -0,0 +1,56 @@
+"""
+The per-process schedule copies (models/schedule.py) only hold committed
+windows: a rolled back reservation is never trusted by the process that made
+it, and a write from another process is caught up without reloading the lot.
+"""
+import pytest
+from conftest import seed
+from models.db import connect, run_in_write_transaction
+from models.schedule import ScheduleIndex, schedule, schedule_spot
+from models.timestamps import now
+
+def window():
+    start = (now() // 3600 + 48) * 3600
+    return start, start + 3600
+
+def test_rolled_back_reservation_is_not_trusted(database):
+    users = seed(database, 1, spots=3, parked=0)
+    start, end = window()
+    first, second = connect(database), connect(database)
+    first_index, second_index = ScheduleIndex(), ScheduleIndex()
+
+    def rolled_back(conn):
+        # A window of another day, the copy would still show spot 1 free over [start, end)
+        assert schedule(conn, first_index, users[0], 1, start + 86400, end + 86400)[0] == 'scheduled'
+        raise RuntimeError('rolled back')
+    with pytest.raises(RuntimeError):
+        run_in_write_transaction(first, rolled_back)
+    # Another process commits the same schedule version with its own window
+    status, taken = schedule_spot(second, second_index, users[1], 1, start, end)
+    assert status == 'scheduled'
+
+    status, reservation = schedule_spot(first, first_index, users[0], 1, start, end)
+    assert status == 'scheduled' and reservation['spot_id'] != taken['spot_id']
+    spots = [row[0] for row in first.execute(
+        "SELECT spot_id FROM scheduled_reservations WHERE status = 'scheduled' AND start_time < ? AND end_time > ?",
+        (end, start))]
+    assert len(spots) == len(set(spots)) == 2
+
+def test_writes_of_other_processes_are_caught_up(database):
+    users = seed(database, 1, spots=3, parked=0)
+    start, end = window()
+    conn, other = connect(database), connect(database)
+    index, other_index = ScheduleIndex(), ScheduleIndex()
+    assert index.free_count(conn, 1, start, end) == 3
+
+    for user in users[:2]:
+        assert schedule_spot(other, other_index, user, 1, start, end)[0] == 'scheduled'
+    assert index.free_count(conn, 1, start, end) == 1
+    assert index.stats()['reloads'] == 1
+
+    # Resizing the lot changes its spots, the copy is reloaded
+    with other:
+        other.execute('UPDATE parking_lots SET maximum_number_of_spots = 4 WHERE id = 1')
+        other.execute("INSERT INTO parking_spots (lot_id, spot_number) VALUES (1, 4)")
+    assert index.free_count(conn, 1, start, end) == 2
+    assert index.stats()['reloads'] == 2
@@ -0,0 +1,72 @@
+"""
+The analytics routes read the snapshot while it is fresh enough and report
+its age in X-Data-Age, and of several processes only the one holding the
+snapshot's lock copies the database.
+"""
+import os
+import subprocess
+import sys
+import time
+import pytest
+import models.snapshot
+from conftest import seed, configure, client_as
+from models.bookings import book_spot
+from models.db import connect
+from models.snapshot import Snapshot, snapshot_path
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_analytics_read_the_snapshot(database):
+    users = seed(database, 1, parked=1)
+    app = configure(database, SNAPSHOT_ENABLED=True, SNAPSHOT_INTERVAL=3600, SNAPSHOT_MAX_STALENESS=120)
+    snapshot = app.extensions['parking'].analytics_snapshot
+    snapshot.start(database)
+    wait_for(lambda: snapshot.taken_at is not None)
+    # Written after the copy, the snapshot doesn't have it yet
+    book_spot(connect(database), users[1], 1)
+
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    taken_at = time.time() - 50
+    os.utime(snapshot.path, (taken_at, taken_at))
+    response = admin.get('/api/admin/lotoccupancy')
+    assert response.get_json()['values'] == [1]
+    assert 50 <= int(response.headers['X-Data-Age']) <= 52
+
+    # Too old, the primary is read instead
+    app.extensions['parking'].dashboard_cache.clear()
+    taken_at = time.time() - 500
+    os.utime(snapshot.path, (taken_at, taken_at))
+    response = admin.get('/api/admin/lotoccupancy')
+    assert response.get_json()['values'] == [2]
+    assert int(response.headers['X-Data-Age']) <= 2
+
+@pytest.mark.skipif(models.snapshot.fcntl is None, reason='no file locks, a single process refreshes')
+def test_only_the_lock_holder_refreshes(database):
+    path = snapshot_path(database)
+    # Another server process holding the lock, until its stdin closes
+    holder = subprocess.Popen([sys.executable, '-c', (
+        'import fcntl, sys\n'
+        f'lock = open({path + ".lock"!r}, "a")\n'
+        'fcntl.lockf(lock, fcntl.LOCK_EX)\n'
+        'print("locked", flush=True)\n'
+        'sys.stdin.read()\n'
+    )], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    snapshot = Snapshot(interval=0.05)
+    try:
+        assert holder.stdout.readline() == 'locked\n'
+        snapshot.start(database)
+        time.sleep(0.3)
+        assert not snapshot.elected() and snapshot.taken_at is None
+
+        # The holder exits, this process takes over at its next try
+        holder.stdin.close()
+        holder.wait()
+        wait_for(lambda: snapshot.taken_at is not None)
+        assert snapshot.elected()
+    finally:
+        snapshot.stop()
+        holder.kill()
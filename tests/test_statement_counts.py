@@ -0,0 +1,27 @@
+"""
+The admin dashboard runs the same number of SQL statements however many
+lots there are: occupancy and spot details are fetched for all lots at once,
+not per lot.
+"""
+from conftest import new_database, seed, configure, client_as
+
+def dashboard_statements(directory, statements, lots):
+    path = new_database(directory)
+    users = seed(path, lots)
+    app = configure(path)
+    admin = client_as(app, 1, 'admin_123', 'admin')
+    driver = client_as(app, users[-1], 'driver', 'user')
+    counts = []
+    # With cold caches, then after a booking changed one lot
+    for change in (False, True):
+        if change:
+            assert driver.post('/bookspot/1').status_code == 302
+        del statements[:]
+        assert admin.get('/admindashboard').status_code == 200
+        counts.append(len(statements))
+    return counts
+
+def test_admindashboard_statements_do_not_grow_with_lots(tmp_path, statements):
+    one_lot = dashboard_statements(tmp_path / 'one', statements, 1)
+    many_lots = dashboard_statements(tmp_path / 'many', statements, 200)
+    assert one_lot == many_lots
@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built and configured from the environment by create_app (PARKING_* variables).
+"""
+from app import create_app
+
+app = create_app()